@@ -1,39 +1,252 @@
 """All about backtests
 """
-import os
 import threading
-import pandas as pd
-from queue import Queue
-from zipline.utils.run_algo import _run
+import time
+from enum import Enum
 from zipline.utils.cli import Date
-from trading_calendars import get_calendar
+from engine import getEngine
+
+
+class Overflow(Enum):
+    """What Channel.give does when a subscriber is a full ring behind
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    COALESCE_LATEST = 'coalesce-latest'
 
 
 class Channel:
-    def __init__(self, consumer):
-        self.queue = Queue()
+    """Bounded ring buffer between a running algorithm and its readers
+
+    Items are stored in a fixed-size ring and every subscriber reads it
+    through its own cursor, so any number of readers see the same stream
+    independently. Only items some subscriber has yet to read are kept.
+    When the slowest subscriber falls a full ring behind, the overflow
+    policy decides: BLOCK waits for it, DROP_OLDEST skips its oldest
+    item, and COALESCE_LATEST skips it straight to the newest item.
+    An optional consumer is also called synchronously on every item.
+
+    Args:
+        consumer (callable): Called with every item, or None
+        capacity (int): Number of slots in the ring
+        overflow (Overflow): Policy when a subscriber is capacity behind
+    """
+    def __init__(self, consumer=None, capacity=1024,
+                 overflow=Overflow.BLOCK):
         self.consumer = consumer
+        self.capacity = capacity
+        self.overflow = Overflow(overflow)
+        self.ring = [None] * capacity
+        self.head = 0
+        self.subscribers = []
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.cond = threading.Condition()
 
     def give(self, item):
-        self.queue.put(item)
-        self.consumer(item)
+        if self.consumer is not None:
+            self.consumer(item)
+
+        with self.cond:
+            if not self.subscribers:
+                return
+            while self.head - self._tail() >= self.capacity:
+                if self.overflow == Overflow.BLOCK:
+                    self.cond.wait()
+                    if not self.subscribers:
+                        return
+                    continue
+
+                for sub in self.subscribers:
+                    lag = self.head - sub.cursor
+                    if lag < self.capacity:
+                        continue
+                    skip = 1 if self.overflow == Overflow.DROP_OLDEST \
+                        else lag
+                    tail = self._tail()
+                    sub.cursor += skip
+                    self._release(tail, self._tail())
+                    sub.dropped += skip
+                    self.dropped += skip
+
+            self.ring[self.head % self.capacity] = item
+            self.head += 1
+            self.cond.notify_all()
+
+    def subscribe(self):
+        """Start reading the channel from the next item given
+
+        Returns:
+            Subscription: An iterable cursor into the channel
+        """
+        with self.cond:
+            sub = Subscription(self, self.head)
+            self.subscribers.append(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self.cond:
+            if sub in self.subscribers:
+                tail = self._tail()
+                self.subscribers.remove(sub)
+                self._release(tail, self._tail())
+                self.cond.notify_all()
+
+    def close(self):
+        """Wake every subscriber; they stop once the ring is drained
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'subscribers': len(self.subscribers),
+                'pending': self.head - self._tail()
+            }
+
+    def _tail(self):
+        if not self.subscribers:
+            return self.head
+        return min(sub.cursor for sub in self.subscribers)
+
+    def _release(self, begin, end):
+        """Forget slots in [begin, end) that nobody will read any more
+        """
+        tail = self._tail()
+        for i in range(begin, min(end, tail)):
+            self.ring[i % self.capacity] = None
+
+    def _take(self, sub, timeout):
+        with self.cond:
+            while sub.cursor == self.head:
+                if self.closed or sub not in self.subscribers:
+                    raise StopIteration
+                if not self.cond.wait(timeout):
+                    raise TimeoutError
+            tail = self._tail()
+            item = self.ring[sub.cursor % self.capacity]
+            sub.cursor += 1
+            sub.delivered += 1
+            self.delivered += 1
+            self._release(tail, self._tail())
+            self.cond.notify_all()
+            return item
+
 
-    def take(self):
-        return self.queue.get()
+class Subscription:
+    """One reader's cursor into a Channel
+    """
+    def __init__(self, channel, cursor):
+        self.channel = channel
+        self.cursor = cursor
+        self.delivered = 0
+        self.dropped = 0
+
+    def take(self, timeout=None):
+        """Block for the next item
+
+        Raises:
+            StopIteration: The channel is closed and drained
+            TimeoutError: Nothing arrived within timeout seconds
+        """
+        return self.channel._take(self, timeout)
+
+    def close(self):
+        self.channel.unsubscribe(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.take()
+
+
+class BarSampler:
+    """Decides which bars of a run get emitted
+
+    Accepted specs are 'bar' (every bar), 'eod' (the last bar of each
+    session) and 'Nm' (the first bar of every N minute bucket, e.g.
+    '15m'). Rejected bars never touch context.portfolio, so minute runs
+    do not pay for a portfolio sync on every bar.
+
+    Args:
+        spec (str): The sampling spec
+        calendar (TradingCalendar): Needed for 'eod'
+    """
+    def __init__(self, spec='bar', calendar=None):
+        self.spec = spec
+        self.calendar = calendar
+        self.bucket = None
+        self.closes = {}
+        if spec == 'bar':
+            self.every = None
+        elif spec == 'eod':
+            if calendar is None:
+                raise ValueError("'eod' sampling needs a trading calendar")
+            self.every = None
+        elif spec.endswith('m') and spec[:-1].isdigit() and int(spec[:-1]):
+            self.every = int(spec[:-1]) * 60 * 10 ** 9
+        else:
+            raise ValueError("Invalid sample {!r}, expected 'bar', 'eod' "
+                             "or a minute count like '15m'".format(spec))
+
+    def __call__(self, dt):
+        if self.spec == 'bar':
+            return True
+        if self.spec == 'eod':
+            return dt >= self._sessionClose(dt)
+        bucket = dt.value // self.every
+        if bucket == self.bucket:
+            return False
+        self.bucket = bucket
+        return True
+
+    def _sessionClose(self, dt):
+        day = dt.date()
+        if day not in self.closes:
+            label = self.calendar.minute_to_session_label(dt)
+            self.closes = {day: self.calendar.session_close(label)}
+        return self.closes[day]
 
 
 class ZiplineRunThread(threading.Thread):
+    """Runs one backtest, giving (datetime, portfolio) updates to its
+    channel after every sampled bar
+
+    An optional profiling.RunProfiler wraps the whole simulation; optional
+    latency.LatencyStats record the user callbacks and the portfolio
+    snapshot taken on every emitted bar.
+    """
 
     def __init__(self, code, start, end, capital_base=100000,
-                 consume_portfolio=None):
+                 consume_portfolio=None, capacity=1024,
+                 overflow=Overflow.BLOCK, engine=None, checkpoint=None,
+                 resumeFrom=None, data_frequency='daily', sample='bar',
+                 profiler=None, latency=None):
         super(ZiplineRunThread, self).__init__()
         self.code = code
         self.start_date = Date(tz='utc', as_timestamp=True).parser(start)
         self.end_date = Date(tz='utc', as_timestamp=True).parser(end)
         self.capital_base = capital_base
         self.consume_portfolio = consume_portfolio
+        self.channel = Channel(consumer=consume_portfolio,
+                               capacity=capacity, overflow=overflow)
+        self.engine = engine or getEngine('quandl')
+        self.checkpoint = checkpoint
+        self.resumeFrom = resumeFrom
+        self.data_frequency = data_frequency
+        self.sampler = BarSampler(sample, self.engine.trading_calendar)
+        self.profiler = profiler
+        self.latency = latency
+        self.perf = None
 
-    def dummy_consume(self, portfolio):
+    def dummy_consume(self, update):
+        # update is a (datetime, portfolio) pair.
         # Structure of portfolio 'capital_used', 'cash', 'cash_flow',
         # 'current_portfolio_weights', 'pnl', 'portfolio_value',
         # 'positions', 'positions_exposure', 'positions_value',
@@ -41,85 +254,38 @@ class ZiplineRunThread(threading.Thread):
         pass
 
     def run(self):
-        spy_init_code = """
-    import inspect
-    stacks = inspect.stack()[1:]
-
-    __channel = None
-    print(stacks)
-    while stacks:
-        stacks, stack = stacks[1:], stacks[0]
-        frame, filename, lineno, func, code_ctx, index = stack
-        if '__channel__' in frame.f_locals:
-            __channel = frame.f_locals['__channel__']
-            break
-    if __channel is None:
-        raise Exception('Cannot find any stack that has __channel')
-
-    context.__channel = __channel
-        """
-
-        spy_action_code = """
-    context.__channel.give(context.portfolio)
-        """
-        code = self.code.split('\n')
         try:
-            i = list(filter(lambda x: 'def initialize' in x[1],
-                            enumerate(code)))[0][0]
-            code.insert(i + 1, spy_init_code)
-
-            j = list(filter(lambda x: 'def handle_data' in x[1],
-                            enumerate(code)))[0][0]
-            code.insert(j + 1, spy_action_code)
+            if self.profiler is None:
+                self._simulate()
+            else:
+                with self.profiler:
+                    self._simulate()
+        finally:
+            self.channel.close()
 
-            algotext = '\n'.join(code)
-
-        except Exception as e:
-            print('Failed to find <initialize> or <handle_data> in code')
-            print(e)
+    def _onBar(self, algo):
+        dt = algo.get_datetime()
+        if not self.sampler(dt):
+            return
+        if self.latency is None:
+            self.channel.give((dt, algo.portfolio))
             return
+        t0 = time.perf_counter_ns()
+        portfolio = algo.portfolio
+        self.latency.record('snapshot', time.perf_counter_ns() - t0)
+        self.channel.give((dt, portfolio))
 
-        __channel__ = Channel(consumer=self.consume_portfolio or
-                              self.dummy_consume)
-
-        print(algotext)
-
-        algotext = algotext
-        algofile = None
-        define = ()
-        data_frequency = 'daily'
-        capital_base = 1000000
-        bundle = 'quandl'
-        bundle_timestamp = pd.Timestamp.utcnow()
-        start = self.start_date
-        end = self.end_date
-        output = '-'
-        trading_calendar = get_calendar('XNYS')
-        print_algo = False
-        metrics_set = 'default'
-        local_namespace = {}
-        blotter = 'default'
-
-        _ = _run(
-            initialize=None,
-            handle_data=None,
-            before_trading_start=None,
-            analyze=None,
-            algofile=algofile,
-            algotext=algotext,
-            defines=define,
-            data_frequency=data_frequency,
-            capital_base=capital_base,
-            data=None,
-            bundle=bundle,
-            bundle_timestamp=bundle_timestamp,
-            start=start,
-            end=end,
-            output=output,
-            trading_calendar=trading_calendar,
-            print_algo=print_algo,
-            metrics_set=metrics_set,
-            local_namespace=local_namespace,
-            environ=os.environ,
-            blotter=blotter,
+    def _simulate(self):
+        timer = self.latency if self.profiler is None \
+            else self.profiler.callbacks
+        self.perf = self.engine.run(
+            self.code,
+            start=self.start_date,
+            end=self.end_date,
+            capital_base=self.capital_base,
+            data_frequency=self.data_frequency,
+            checkpoint=self.checkpoint,
+            resumeFrom=self.resumeFrom,
+            timer=timer,
+            onBar=self._onBar,
         )
@@ -1,14 +1,36 @@
 import argparse
 from cmd2 import Cmd
+from collections import namedtuple
+from enum import IntEnum
+import io
 import os
+import struct
+import threading
+import time
 import colorama
 import traceback
 import pdb
 
 BLKSZ = 1024
+READSZ = 64 * 1024
 COMMAND_FUNC_PREFIX = 'do_'
 MSG_SEP = b'\xab'
 
+# Frame header: payload length, message type, sequence number
+FRAME_HEADER = struct.Struct('!IBI')
+
+
+class MsgType(IntEnum):
+    """Type tag carried in every frame header
+    """
+    TEXT = 0
+    JSON = 1
+    RECORDS = 2
+    STATS = 3
+
+
+Frame = namedtuple('Frame', ['msgType', 'seq', 'payload'])
+
 
 def with_argparser(argparser: argparse.ArgumentParser):
     """Decorater for cmd commands
@@ -60,6 +82,57 @@ def with_pipecloser(func):
     return cmd_wrapper
 
 
+def closePipe(pipe):
+    """Close a pipe end, ignoring ends that are missing or already closed
+    """
+    if pipe is None:
+        return
+    try:
+        os.close(pipe)
+    except OSError:
+        pass
+
+
+class PipeStage(threading.Thread):
+    """Runs one action of a pipeline in its own thread
+
+    The stage owns both of its pipe ends and closes them once the action
+    returns or fails. A broken pipe means the downstream stage has gone
+    away and is not treated as an error.
+
+    Args:
+        name (str): Name used when reporting on the stage
+        action (callable): The action, called as
+                           action(arg, inPipe=inPipe, outPipe=outPipe)
+        arg (str): Argument string for the action
+        inPipe (int): Read end of the upstream pipe, or None
+        outPipe (int): Write end of the downstream pipe
+    """
+    def __init__(self, name, action, arg, inPipe=None, outPipe=1):
+        super(PipeStage, self).__init__(name=name, daemon=True)
+        self.action = action
+        self.arg = arg
+        self.inPipe = inPipe
+        self.outPipe = outPipe
+        self.error = None
+        self.traceback = None
+        self.elapsed = None
+
+    def run(self):
+        begin = time.perf_counter()
+        try:
+            self.action(self.arg, inPipe=self.inPipe, outPipe=self.outPipe)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.error = e
+            self.traceback = traceback.format_exc()
+        finally:
+            self.elapsed = time.perf_counter() - begin
+            closePipe(self.outPipe)
+            closePipe(self.inPipe)
+
+
 class MyCmd(Cmd):
     """Base cmd class for trading shell
 
@@ -72,41 +145,65 @@ class MyCmd(Cmd):
     #     print(str(arg))
 
     def piperun(self, arg):
-        piped_args = arg.split('|')
+        """Run `a | b | c` with every stage streaming concurrently
+
+        Each stage runs in its own PipeStage thread and talks to its
+        neighbours through an os.pipe(), whose kernel buffer bounds how
+        far a producer can run ahead of its consumer. Frames coming out
+        of the last stage are written to stdout as soon as they arrive.
+        A stage that dies closes both of its pipes, so the stage after
+        it sees end of file and the stage before it gets a broken pipe
+        on its next write. Actions must consume their input before they
+        return and must not close their pipes themselves.
+        """
+        stages = []
         r = None
-
-        # pdb.set_trace()
-        for arg in piped_args:
-            args = arg.split()
-            if len(args) == 0:
+        for i, stageArg in enumerate(arg.split('|')):
+            args = stageArg.split()
+            if len(args) == 0 or args[0] not in self.actions:
                 self.perror('Invalid args: {}'.format(args))
-                return
-
-            command = args[0]
+                closePipe(r)
+                break
 
             rr, w = os.pipe()
+            stage = PipeStage('{}:{}'.format(i, args[0]),
+                              self.actions[args[0]], ' '.join(args[1:]),
+                              inPipe=r, outPipe=w)
+            stages.append(stage)
+            r = rr
+        else:
+            for stage in stages:
+                stage.start()
             try:
-                self.actions[command](' '.join(args[1:]),
-                                      inPipe=r,
-                                      outPipe=w)
-                r = rr
-
-            except Exception as e:
-                self.perror(str(e))
-                tb = traceback.format_exc()
-                print(tb)
-
-        self.writeTo(1, self.readFrom(r))
+                for frame in frameReader(r):
+                    self.writeTo(1, self.renderFrame(frame))
+            except KeyboardInterrupt:
+                self.perror('Pipeline interrupted')
+                return
+            finally:
+                closePipe(r)
+
+        for stage in stages:
+            if stage.ident is None:
+                closePipe(stage.inPipe)
+                closePipe(stage.outPipe)
+                continue
+            stage.join()
+            if stage.error is not None:
+                self.perror('{}: {}'.format(stage.name, stage.error))
+                print(stage.traceback)
+            self.pfeedback('{}: {:.3f}s'.format(stage.name, stage.elapsed))
+
+    def renderFrame(self, frame):
+        """Turn a frame into the bytes shown on the terminal
+        """
+        return frame.payload + b'\n'
 
     def readFrom(self, pipe):
-        buf = b''
-        while True and pipe:
-            buf_more = os.read(pipe, BLKSZ)
-            if not buf_more:
-                break
-            buf += buf_more
-
-        return buf
+        """Read every frame from pipe and render the payloads as lines
+        """
+        return b''.join(self.renderFrame(frame)
+                        for frame in frameReader(pipe))
 
     def writeTo(self, pipe, buf):
         os.write(pipe, buf)
@@ -115,31 +212,156 @@ class MyCmd(Cmd):
         self.piperun('echo ' + arg)
 
     def echo(self, arg, inPipe=None, outPipe=1):
-        buf = self.readFrom(inPipe)
-        self.writeTo(outPipe, buf + arg.encode('utf-8'))
-        os.close(outPipe)
-        return
+        writer = FrameWriter(outPipe)
+        for frame in frameReader(inPipe):
+            writer.write(frame.payload, frame.msgType)
+        writer.write(arg.encode('utf-8'), MsgType.TEXT)
 
     def do_quit(self, arg):
         return True
 
 
-def pipeReader(pipe, sep):
+def pipeReader(pipe, sep, readSize=READSZ):
     """Creates a generator that reads data packs from pipe
 
-    Read from pipe until reaching a separator
+    Read from pipe until reaching a separator. Incoming bytes land in a
+    single growable bytearray through ``readinto`` and every byte is
+    scanned for ``sep`` exactly once, so the cost is linear in the amount
+    of data read. Consumed frames are reclaimed by sliding the unfinished
+    tail to the front whenever the buffer runs out of room.
+
+    Args:
+        pipe (int): File descriptor to read from
+        sep (bytes): Frame separator
+        readSize (int): Maximum number of bytes per read
+
+    Yields:
+        bytes: One frame, without the separator
     """
+    if not pipe:
+        return
 
-    curBuf = b''
-    dirtyBuf = b''
-    while pipe:
-        dirtyBuf += os.read(pipe, BLKSZ)
-        if not dirtyBuf:
+    src = io.FileIO(pipe, 'rb', closefd=False)
+    buf = bytearray(max(readSize, 2 * len(sep)))
+    start = scan = end = 0
+    seplen = len(sep)
+
+    while True:
+        if len(buf) - end < readSize:
+            if start:
+                # Slide the unconsumed tail to the front
+                buf[:end - start] = buf[start:end]
+                scan -= start
+                end -= start
+                start = 0
+            if len(buf) - end < readSize:
+                buf.extend(bytes(max(len(buf), readSize)))
+
+        with memoryview(buf) as view:
+            n = src.readinto(view[end:end + readSize])
+        if not n:
             break
+        end += n
+
+        with memoryview(buf) as view:
+            while True:
+                occur = buf.find(sep, scan, end)
+                if occur < 0:
+                    # The separator may straddle the next read
+                    scan = max(start, end - seplen + 1)
+                    break
+                yield bytes(view[start:occur])
+                start = scan = occur + seplen
+
+
+class FrameWriter:
+    """Writes length-prefixed frames to a pipe
+
+    Each frame is a FRAME_HEADER followed by the payload. The header and
+    payload go out in a single writev, so no payload is ever copied and
+    readers never have to search for a delimiter. Writes are serialized,
+    so several threads can share one writer.
+
+    Args:
+        pipe (int): File descriptor to write to
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def write(self, payload, msgType=MsgType.JSON):
+        with self.lock:
+            header = FRAME_HEADER.pack(len(payload), msgType, self.seq)
+            self.seq = (self.seq + 1) & 0xffffffff
+
+            chunks = [header, payload]
+            while chunks:
+                n = os.writev(self.pipe, chunks)
+                # Drop whatever a short write managed to send
+                while chunks and n >= len(chunks[0]):
+                    n -= len(chunks[0])
+                    chunks.pop(0)
+                if chunks and n:
+                    chunks[0] = memoryview(chunks[0])[n:]
+
+
+def frameReader(pipe, readSize=READSZ):
+    """Creates a generator that reads frames written by FrameWriter
+
+    The header tells the exact payload size, so every frame is pulled
+    with two exact-size reads from a buffered reader. A frame cut short
+    by end of file is dropped.
 
-        curBuf += dirtyBuf.split(sep)[0]
-        occur = dirtyBuf.find(sep)
-        dirtyBuf = dirtyBuf[(occur % len(dirtyBuf)) + 1:]
-        if occur >= 0:
-            yield curBuf
-            curBuf = b''
+    Args:
+        pipe (int): File descriptor to read from
+        readSize (int): Size of the read buffer
+
+    Yields:
+        Frame: (msgType, seq, payload) of each frame
+    """
+    if not pipe:
+        return
+
+    src = io.BufferedReader(io.FileIO(pipe, 'rb', closefd=False), readSize)
+    hsize = FRAME_HEADER.size
+    while True:
+        header = src.read(hsize)
+        if len(header) < hsize:
+            break
+        length, msgType, seq = FRAME_HEADER.unpack(header)
+        payload = src.read(length)
+        if len(payload) < length:
+            break
+        yield Frame(MsgType(msgType), seq, payload)
+
+
+class FrameDecoder:
+    """Incremental counterpart of frameReader for non-blocking reads
+
+    Bytes are fed as they arrive, in chunks of any size; feed() returns
+    the frames they complete and keeps a partial one for the next call.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        """Add bytes read from a pipe
+
+        Returns:
+            list: The frames completed by data
+        """
+        self.buf += data
+        hsize = FRAME_HEADER.size
+        frames = []
+        start = 0
+        while len(self.buf) - start >= hsize:
+            length, msgType, seq = FRAME_HEADER.unpack_from(self.buf, start)
+            end = start + hsize + length
+            if end > len(self.buf):
+                break
+            frames.append(Frame(MsgType(msgType), seq,
+                                bytes(self.buf[start + hsize:end])))
+            start = end
+        del self.buf[:start]
+        return frames
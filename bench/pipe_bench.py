@@ -0,0 +1,107 @@
+"""Throughput benchmark for base.pipeReader
+
+Pushes N separator-terminated frames through an os.pipe() from a writer
+thread and drains them with the current pipeReader and with the legacy
+bytes-concatenating reader it replaced. Reports MB/s and frames/s.
+
+Usage:
+    python bench/pipe_bench.py [--frames 1000 10000 ...] [--read-size 65536]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from base import BLKSZ, MSG_SEP, READSZ, pipeReader  # noqa: E402
+
+
+def legacyPipeReader(pipe, sep):
+    """The original reader, kept verbatim for comparison
+    """
+    curBuf = b''
+    dirtyBuf = b''
+    while pipe:
+        dirtyBuf += os.read(pipe, BLKSZ)
+        if not dirtyBuf:
+            break
+
+        curBuf += dirtyBuf.split(sep)[0]
+        occur = dirtyBuf.find(sep)
+        dirtyBuf = dirtyBuf[(occur % len(dirtyBuf)) + 1:]
+        if occur >= 0:
+            yield curBuf
+            curBuf = b''
+
+
+def makeFrame():
+    return json.dumps({
+        'portfolio_value': 123456.789,
+        'pnl': -1234.5678,
+        'return': -0.0123456
+    }).encode('utf8') + MSG_SEP
+
+
+def feed(w, frame, nframes, chunkFrames=1024):
+    chunk = frame * chunkFrames
+    full, rest = divmod(nframes, chunkFrames)
+    try:
+        for _ in range(full):
+            os.write(w, chunk)
+        if rest:
+            os.write(w, frame * rest)
+    finally:
+        os.close(w)
+
+
+def measure(readerFactory, nframes):
+    frame = makeFrame()
+    r, w = os.pipe()
+    writer = threading.Thread(target=feed, args=(w, frame, nframes))
+
+    begin = time.perf_counter()
+    writer.start()
+    count = 0
+    for _ in readerFactory(r):
+        count += 1
+    elapsed = time.perf_counter() - begin
+
+    writer.join()
+    os.close(r)
+    assert count == nframes, (count, nframes)
+    nbytes = len(frame) * nframes
+    return elapsed, nbytes / elapsed / 1e6, nframes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, nargs='+',
+                        default=[10 ** k for k in range(3, 8)])
+    parser.add_argument('--read-size', type=int, default=READSZ)
+    parser.add_argument('--legacy-max', type=int, default=10 ** 5,
+                        help='skip the legacy reader above this many frames')
+    args = parser.parse_args()
+
+    readers = [
+        ('pipeReader', lambda r: pipeReader(r, MSG_SEP, args.read_size),
+         None),
+        ('legacy', lambda r: legacyPipeReader(r, MSG_SEP), args.legacy_max),
+    ]
+
+    row = '{:<12}{:>10}{:>12}{:>12}{:>14}'
+    print(row.format('reader', 'frames', 'seconds', 'MB/s', 'frames/s'))
+    for nframes in args.frames:
+        for name, factory, limit in readers:
+            if limit is not None and nframes > limit:
+                print(row.format(name, nframes, '-', '-', 'skipped'))
+                continue
+            elapsed, mbps, fps = measure(factory, nframes)
+            print(row.format(name, nframes, '{:.3f}'.format(elapsed),
+                             '{:.1f}'.format(mbps), '{:.0f}'.format(fps)))
+
+
+if __name__ == '__main__':
+    main()
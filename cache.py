@@ -0,0 +1,119 @@
+"""On-disk cache of backtest results
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+from records import PORTFOLIO_DTYPE, packRecords
+from util import hashAlgo
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'TRADINGSHELL_CACHE',
+    os.path.join(os.path.expanduser('~'), '.tradingshell', 'cache'))
+DEFAULT_CACHE_BYTES = 1 << 30
+CACHE_SUFFIX = '.rec'
+
+
+class ResultCache:
+    """Content-addressed store of the record stream of finished runs
+
+    A run is identified by the hash of its algorithm source and every
+    input that changes its output. The stored value is the packed
+    PORTFOLIO_DTYPE stream the run emitted, so a hit can be replayed
+    without simulating. Entries are files whose mtime is bumped on every
+    hit; the least recently used ones are deleted once the directory
+    grows past maxBytes.
+
+    Args:
+        root (str): Directory holding the entries
+        maxBytes (int): Size bound of the directory
+    """
+    def __init__(self, root=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_CACHE_BYTES):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(code, engine, start, end, capital_base, data_frequency,
+            bundle_timestamp, sample='bar', bundle='quandl'):
+        """Hash the algorithm and its run inputs into a cache key
+        """
+        inputs = json.dumps([hashAlgo(code), engine, str(start), str(end),
+                             float(capital_base), data_frequency,
+                             str(bundle_timestamp), sample, bundle])
+        return hashlib.sha256(inputs.encode('utf8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Load the records of a cached run
+
+        Returns:
+            np.ndarray: The PORTFOLIO_DTYPE records, or None on a miss
+        """
+        path = self.path(key)
+        try:
+            records = np.fromfile(path, dtype=PORTFOLIO_DTYPE)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return records
+
+    def writer(self, key):
+        """Start recording a run under key
+
+        Returns:
+            CacheWriter: Collects records; nothing is visible until commit
+        """
+        return CacheWriter(self, key)
+
+    def evict(self):
+        """Delete least recently used entries until under maxBytes
+        """
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.name.endswith(CACHE_SUFFIX):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.maxBytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class CacheWriter:
+    """Streams the records of a running backtest into a cache entry
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, self.tmppath = tempfile.mkstemp(dir=cache.root, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+
+    def add(self, record):
+        self.file.write(packRecords([record]))
+
+    def commit(self):
+        """Publish the entry atomically and enforce the size bound
+        """
+        self.file.close()
+        os.replace(self.tmppath, self.cache.path(self.key))
+        self.cache.evict()
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmppath)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,159 @@
+"""Checkpoints of running backtests
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from records import PORTFOLIO_DTYPE, packRecords
+from util import hashAlgo
+
+DEFAULT_CHECKPOINT_DIR = os.environ.get(
+    'TRADINGSHELL_CHECKPOINTS',
+    os.path.join(os.path.expanduser('~'), '.tradingshell', 'checkpoints'))
+CHECKPOINT_SUFFIX = '.ckpt'
+SESSION_FORMAT = '%Y-%m-%d'
+# Bumped when the saved state changes meaning, orphaning older chains
+STATE_VERSION = 2
+
+
+class CheckpointStore:
+    """Chains of algorithm state snapshots taken at session boundaries
+
+    Checkpoints are grouped by a key covering every run input except the
+    end date, so a run that only extends the end date finds the
+    checkpoints of earlier runs. Each checkpoint holds the algorithm
+    state at the start of its session, the records emitted since the
+    previous checkpoint and the session of that previous checkpoint.
+    The records of a resumed run's past are therefore the concatenation
+    of the segments along the chain.
+
+    Args:
+        root (str): Directory holding one subdirectory per key
+    """
+    def __init__(self, root=DEFAULT_CHECKPOINT_DIR):
+        self.root = root
+
+    @staticmethod
+    def key(code, engine, start, capital_base, data_frequency,
+            bundle_timestamp, sample='bar', bundle='quandl'):
+        """Hash the algorithm and its run inputs, bar the end date
+        """
+        inputs = json.dumps([STATE_VERSION, hashAlgo(code), engine,
+                             str(start), float(capital_base),
+                             data_frequency, str(bundle_timestamp), sample,
+                             bundle])
+        return hashlib.sha256(inputs.encode('utf8')).hexdigest()
+
+    def path(self, key, session):
+        return os.path.join(self.root, key,
+                            session.strftime(SESSION_FORMAT) +
+                            CHECKPOINT_SUFFIX)
+
+    def save(self, key, session, state, records, prev=None):
+        """Write a checkpoint atomically
+
+        Args:
+            key (str): Output of key()
+            session (pd.Timestamp): The session the state resumes at
+            state (dict): The algorithm state
+            records (list): Records emitted since the prev checkpoint
+            prev (pd.Timestamp): Session of the previous checkpoint
+        """
+        directory = os.path.join(self.root, key)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({
+                    'session': session,
+                    'prev': prev,
+                    'state': state,
+                    'records': packRecords(records),
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, self.path(key, session))
+        except BaseException:
+            os.remove(tmppath)
+            raise
+
+    def load(self, key, session):
+        with open(self.path(key, session), 'rb') as f:
+            return pickle.load(f)
+
+    def sessions(self, key):
+        """Sessions of every checkpoint under key, oldest first
+        """
+        try:
+            names = os.listdir(os.path.join(self.root, key))
+        except FileNotFoundError:
+            return []
+        return sorted(pd.Timestamp(name[:-len(CHECKPOINT_SUFFIX)], tz='UTC')
+                      for name in names if name.endswith(CHECKPOINT_SUFFIX))
+
+    def latest(self, key, start, end):
+        """Find the newest checkpoint a run over [start, end] can use
+
+        A checkpoint is usable if its session lies strictly inside the
+        run and every checkpoint along its chain can be read.
+
+        Returns:
+            tuple: (checkpoint dict, records before it) or None
+        """
+        for session in reversed(self.sessions(key)):
+            if not start < session <= end:
+                continue
+            try:
+                chain = self._chain(key, session)
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+                continue
+            records = np.concatenate(
+                [np.frombuffer(c['records'], dtype=PORTFOLIO_DTYPE)
+                 for c in reversed(chain)])
+            return chain[0], records
+        return None
+
+    def _chain(self, key, session):
+        chain = []
+        while session is not None:
+            checkpoint = self.load(key, session)
+            chain.append(checkpoint)
+            session = checkpoint['prev']
+        return chain
+
+
+class Checkpointer:
+    """Feeds the session boundaries of one run into a CheckpointStore
+
+    Called with (session, getState) at every session close, session
+    being the next one; saves the state of every `every`-th one. Records
+    the run emits are handed to add() so each checkpoint stores the
+    segment since the previous one.
+
+    Args:
+        store (CheckpointStore): Where checkpoints go
+        key (str): Output of CheckpointStore.key()
+        every (int): Sessions between checkpoints
+        prev (pd.Timestamp): Session of the checkpoint the run resumed
+                             from, if any
+    """
+    def __init__(self, store, key, every, prev=None):
+        self.store = store
+        self.key = key
+        self.every = every
+        self.prev = prev
+        self.boundaries = 0
+        self.segment = []
+
+    def add(self, record):
+        self.segment.append(record)
+
+    def __call__(self, session, getState):
+        boundary, self.boundaries = self.boundaries, self.boundaries + 1
+        if boundary == 0 or boundary % self.every:
+            return
+        self.store.save(self.key, session, getState(), self.segment,
+                        self.prev)
+        self.prev = session
+        self.segment = []
@@ -1,20 +1,105 @@
+// One websocket carrying every plot of the display server. Messages
+// name their plot; handlers are kept per plot id. The sequence number
+// of the last point seen of every plot is kept too, so after the
+// connection drops it reconnects and resubscribes from there. Plots
+// subscribed with a chart width come downsampled to that width.
+class PlotSocket {
+
+  constructor(url) {
+    this.url = url;
+    this.handlers = {};
+    this.seqs = {};
+    this.widths = {};
+    this.onPlots = null;
+    this.pending = [];
+    this.closed = false;
+    this.open();
+  }
+
+  open = () => {
+    let ws = new WebSocket(this.url);
+    this.ws = ws;
+    ws.onopen = () => {
+      Object.keys(this.handlers).forEach(plot => {
+        ws.send(JSON.stringify({type: 'Subscribe', plot: Number(plot),
+                                since: this.seqs[plot],
+                                width: this.widths[plot]}));
+      });
+      this.pending.forEach(msg => ws.send(msg));
+      this.pending = [];
+    };
+    ws.onmessage = (e) => {
+      let msg = JSON.parse(e.data);
+      if (msg.type === 'Plots') {
+        if (this.onPlots) { this.onPlots(msg.plots); }
+      } else if (this.handlers[msg.plot]) {
+        if (msg.seq !== undefined) { this.seqs[msg.plot] = msg.seq; }
+        this.handlers[msg.plot](msg);
+      }
+    };
+    ws.onclose = () => {
+      if (!this.closed) { setTimeout(this.open, 1000); }
+    };
+  }
+
+  send = (msg) => {
+    let text = JSON.stringify(msg);
+    if (this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(text);
+    } else {
+      this.pending.push(text);
+    }
+  }
+
+  subscribe = (plot, handler, width) => {
+    this.handlers[plot] = handler;
+    this.widths[plot] = width;
+    this.send({type: 'Subscribe', plot: plot, since: this.seqs[plot],
+               width: width});
+  }
+
+  unsubscribe = (plot) => {
+    delete this.handlers[plot];
+    delete this.seqs[plot];
+    delete this.widths[plot];
+    this.send({type: 'Unsubscribe', plot: plot});
+  }
+
+  close = () => {
+    this.closed = true;
+    this.ws.close();
+  }
+}
+
 class API {
 
-  getPlotWebsocket = (host) => {
+  getPlotSocket = (host) => {
     if (typeof host == 'undefined' || host == null) { host = ''; }
     return fetch(host + '/plot', {
       method: 'GET',
     })
       .then(res => res.text())
       .then(data => JSON.parse(data))
-      .then(jsondata => jsondata.port)
-      .then(wsport => {
+      .then(info => {
         var host = window.location.hostname;
-        var ws = new WebSocket('ws:' + host + ':' + wsport.toString());
-        return ws;
+        return new PlotSocket('ws://' + host + ':' + info.port.toString() +
+                              info.path);
       });
   }
 
+  // A range of a plot, from and to being sequence numbers or dates,
+  // summed up to fit a chart of the given width
+  getPlotRange = (plot, from, to, width, host) => {
+    if (typeof host == 'undefined' || host == null) { host = ''; }
+    let query = new URLSearchParams({width: width});
+    if (from != null) { query.set('from', from); }
+    if (to != null) { query.set('to', to); }
+    return fetch(host + '/plot/' + plot + '?' + query.toString(), {
+      method: 'GET',
+    })
+      .then(res => res.json());
+  }
+
   newSession = (host) => {
     if (typeof host == 'undefined' || host == null) { host = ''; }
     return fetch(host + '/api/newSession', {
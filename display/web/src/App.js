@@ -36,63 +36,115 @@ class App extends Component {
   }
 
   connect = () => {
-    if (this.state.backtestWebsocket) {
-      this.state.backtestWebsocket.close();
+    if (this.state.plotSocket) {
+      this.state.plotSocket.close();
     }
-    
-    api.getPlotWebsocket() 
-      .then(ws => {        
+
+    api.getPlotSocket()
+      .then(socket => {
         this.setState({
-          backtestWebsocket: ws
+          plotSocket: socket
         });
-        ws.onmessage = this.updatePerformance;
-      }); 
+        // Follow the newest plot
+        socket.onPlots = (plots) => {
+          if (plots.length === 0) { return; }
+          let newest = plots[plots.length - 1].plot;
+          if (newest !== this.state.plot) {
+            if (this.state.plot) { socket.unsubscribe(this.state.plot); }
+            this.setState({plot: newest, performanceSeries: []});
+            // Downsampled by the server to the width of the window
+            socket.subscribe(newest, this.updatePerformance,
+                             window.innerWidth);
+          }
+        };
+      });
+  }
+
+  toPoint = (p, date) => {
+    return {date: date,
+            portfolioValue: parseFloat(p.portfolio_value),
+            pnl: parseFloat(p.pnl),
+            return: parseFloat(p.return)};
+  }
+
+  appendPoints = (points, series, cursor) => {
+    let added = points.map(p => {
+      if (p.timestamp) {
+        cursor = new Date(p.timestamp.slice(0, 23) + 'Z');
+      } else {
+        cursor = new Date(cursor);
+        cursor.setDate(cursor.getDate() + 1);
+      }
+      return this.toPoint(p, cursor);
+    });
+    this.setState({
+      performanceSeries: series.concat(added),
+      lastDate: cursor
+    });
   }
-   
-  updatePerformance = (e) => {
-    console.log('receive message ');
-    console.log(e.data);
+
+  updatePerformance = (msg) => {
     this.log('recived message');
 
     try {
-      let msg = JSON.parse(e.data);
-
       switch (msg.type) {
       case 'Init':
         // Set up the plot with parameters
         let title = msg.title;
         let xlabel = msg.xlable;
-        let lastDate = new Date(msg.startDate);
-        lastDate.setDate(lastDate.getDate() - 1);
+        let startDate = new Date(msg.startDate);
+        startDate.setDate(startDate.getDate() - 1);
         this.setState({
-          lastDate: lastDate,
+          startDate: startDate,
+          lastDate: startDate,
           title: title,
           xlabel: xlabel
         });
 
         break;
-      case 'Update':
-        // Update the plot with a new data point
-        let portfolioValue = parseFloat(msg.portfolioValue);
-        let pnl = parseFloat(msg.pnl);
-        let returnVal = parseFloat(msg.return);
-
-        let nextDate = new Date(this.state.lastDate);
-        nextDate.setDate(nextDate.getDate() + 1);
-        let newSeries = this.state.performanceSeries.concat([{date: nextDate,
-                                                              portfolioValue: portfolioValue,
-                                                              pnl: pnl,
-                                                              return: returnVal
-                                                              }]);
+      case 'Snapshot':
+        // The points so far, by column; reset means they replace ours
+        let names = Object.keys(msg.columns);
+        let rows = [];
+        for (let i = 0; i < msg.count; i++) {
+          let row = {};
+          names.forEach(name => {
+            if (msg.columns[name][i] !== null) {
+              row[name] = msg.columns[name][i];
+            }
+          });
+          rows.push(row);
+        }
+        let series = msg.reset ? [] : this.state.performanceSeries;
+        this.appendPoints(rows, series,
+                          msg.reset ? this.state.startDate
+                                    : this.state.lastDate);
+        break;
+      case 'Updates':
+        // Append a batch of data points to the plot
+        this.appendPoints(msg.points, this.state.performanceSeries,
+                          this.state.lastDate);
+        break;
+      case 'View':
+        // Downsampled points replacing ours from an offset on
+        let viewed = msg.points.map((p, i) => {
+          let date;
+          if (p.timestamp) {
+            date = new Date(p.timestamp.slice(0, 23) + 'Z');
+          } else {
+            date = new Date(this.state.startDate);
+            date.setDate(date.getDate() + msg.seqs[i]);
+          }
+          return this.toPoint(p, date);
+        });
         this.setState({
-          performanceSeries: newSeries,
-          lastDate: nextDate
+          performanceSeries: this.state.performanceSeries
+            .slice(0, msg.from).concat(viewed)
         });
-        
         break;
       case 'End':
-        // The server says no more data, we close the websocket
-        this.state.backtestWebsocket.close();
+        // The server says no more data for this plot
+        this.state.plotSocket.unsubscribe(msg.plot);
         break;
       }
     } catch(err) {
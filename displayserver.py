@@ -1,17 +1,30 @@
-import sys
-import os
-from threading import Thread
-import tornado.web
+import itertools
 import json
-import asyncio
-import websockets
+import os
+import threading
 import traceback
-from multiprocessing import Process
-import io
+from collections import deque
 from enum import Enum
-from util import getFreePort
+import asyncio
+import numpy as np
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from base import READSZ, FrameDecoder, MsgType
+from downsample import (DEFAULT_POINTS_PER_PIXEL, MAX_VIEW_WIDTH,
+                        MinMaxView, Pyramid, timesOf, valueOf,
+                        viewBuckets)
+from records import recordsToDicts, unpackRecords
 
 WEBPORT = 9000
+PLOT_SOCKET_PATH = '/ws'
+# Close code sent to a client dropped for falling behind
+SLOW_CLIENT_CODE = 1013
+DEFAULT_HISTORY_POINTS = 100000
+# Ended plots a server keeps for late viewers, the oldest going first
+DEFAULT_ENDED_PLOTS = 16
+# Chart width assumed by range queries not giving one
+DEFAULT_RANGE_WIDTH = 1000
 
 
 class DisplayType(Enum):
@@ -19,136 +32,726 @@ class DisplayType(Enum):
     PLT = 1
 
 
+class SlowClient(Enum):
+    """What a ClientQueue does when its client falls too far behind
+    """
+    DROP = 'drop'
+    COALESCE = 'coalesce'
+
+
+def framePoints(frame):
+    """The plot points carried by a frame, or None for other frames
+    """
+    if frame.msgType == MsgType.RECORDS:
+        return recordsToDicts(unpackRecords(frame.payload))
+    if frame.msgType == MsgType.JSON:
+        points = json.loads(frame.payload.decode('utf8'))
+        return points if isinstance(points, list) else [points]
+    return None
+
+
 class PlotHandler(tornado.web.RequestHandler):
     """Handles HTTP request to /plot
 
-    The only job that PlotHanlder does is to return the websocket port
-    upon requested.
-
+    Lists the plots of the server, where its websocket is and how many
+    clients it serves.
     """
     def initialize(self, appRef):
         self.appRef = appRef
 
     def get(self):
-        self.write({'ports': [port for _, port in self.appRef.plotters]})
+        self.write({'plots': self.appRef.plotList(),
+                    'port': self.appRef.port,
+                    'path': PLOT_SOCKET_PATH,
+                    'clients': len(self.appRef.sockets),
+                    'stats': self.appRef.stats})
 
 
-class WebPlotter(Thread):
-    def __init__(self, dataReader, wsport, initParams: dict):
-        super(WebPlotter, self).__init__()
-        self.dataReader = dataReader
-        self.wsport = wsport
-        self.initParams = initParams
+class PlotRangeHandler(tornado.web.RequestHandler):
+    """Handles HTTP request to /plot/<id>
 
-    def run(self):
-        async def action(websocket, path):
-            """Runs a websocket protocol with a web front end
-
-            There are three types of messages: Init, Update, and End.
-            The server will send an Init message with all parameters
-            describing the plot (e.g. title, xlabel). Then for each
-            message that gets read from dataReader, send a json string
-            with type Update.
-
-            Args:
-                websocket (websocket): The client websocket
-                path (str): The path for the socket (unused)
-
-            Returns:
-                None
-            """
-
-            initMessage = self.initParams
-            initMessage.update({'type': 'Init'})
-            await websocket.send(json.dumps(initMessage))
-
-            for msg in self.dataReader:
-                try:
-                    msg = msg.decode('utf8')
-                    msg = json.loads(str(msg))
-                    msg.update({'type': 'Update'})
-                    await websocket.send(json.dumps(msg))
-                except Exception as e:
-                    print(e)
-                    traceback.print_exc()
-
-            endMessage = {'type': 'End'}
-            await websocket.send(json.dumps(endMessage))
-
-            print('exiting action, closing websocket server')
-            self.server.close()
-
-        async def start_action():
-            async with websockets.serve(action, 'localhost', self.wsport)\
-                       as server:
-                self.server = server
-                await server.wait_closed()
+    Answers a range of a plot from its level of detail pyramid. The
+    query arguments from and to bound the range, inclusive, by sequence
+    number or by date for plots whose points have timestamps; they
+    default to the whole plot. width is the width of the chart in
+    pixels, bounding the buckets returned.
+    """
+    def initialize(self, appRef):
+        self.appRef = appRef
+
+    def bound(self, name, default, after):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            if value.lstrip('-').isdigit():
+                return int(value)
+            time = np.datetime64(value, 'ns').astype('i8')
+            return self.pyramid.locate(time, after)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+
+    def get(self, id):
+        plot = self.appRef.plots.get(int(id))
+        if plot is None:
+            raise tornado.web.HTTPError(404)
+        self.pyramid = plot.pyramid
+        try:
+            width = int(self.get_argument('width', DEFAULT_RANGE_WIDTH))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='width must be a number')
+        lo = self.bound('from', 1, True)
+        hi = self.bound('to', plot.history.last, False)
+        result = self.pyramid.range(
+            lo, hi, viewBuckets(width, self.appRef.pointsPerPixel))
+        result.update({'plot': plot.id, 'seq': plot.history.last,
+                       'field': plot.field})
+        self.write(result)
+
+
+class ClientQueue:
+    """Messages waiting to go out on one browser connection
+
+    Plots push messages without waiting; a coroutine sends them one at
+    a time, each once the previous one is written. A client that stops
+    reading therefore only grows its own queue. Once the queue holds
+    more than maxPending messages or maxPoints points, the COALESCE
+    policy merges the queued updates of every plot, and a client still
+    over the bounds, or any client under the DROP policy, is
+    disconnected. It can reconnect and subscribe again.
+
+    Args:
+        socket (PlotSocket): The connection
+        policy (SlowClient): What to do with a client falling behind
+        maxPending (int): Messages the queue may hold
+        maxPoints (int): Points the queued updates may hold
+        stats (dict): Counts 'coalesced' messages and 'dropped' clients
+    """
+    def __init__(self, socket, policy=SlowClient.COALESCE, maxPending=256,
+                 maxPoints=100000, stats=None):
+        self.socket = socket
+        self.policy = SlowClient(policy)
+        self.maxPending = maxPending
+        self.maxPoints = maxPoints
+        self.stats = stats if stats is not None else {}
+        self.pending = deque()
+        self.points = 0
+        self.sending = False
+        self.closed = False
+
+    def push(self, message, text=None):
+        """Queue a message
 
+        Args:
+            message (dict): The message, shared with other queues so it
+                            is never modified
+            text (str): The message serialized, or None
+        """
+        if self.closed:
+            return
+        self.pending.append((message, text))
+        self.points += len(message.get('points', ()))
+        if len(self.pending) > self.maxPending or \
+                self.points > self.maxPoints:
+            self.overflow()
+        if not self.sending and not self.closed:
+            self.sending = True
+            tornado.ioloop.IOLoop.current().add_callback(self._drain)
+
+    def overflow(self):
+        if self.policy == SlowClient.COALESCE:
+            self.coalesce()
+            if len(self.pending) <= self.maxPending and \
+                    self.points <= self.maxPoints:
+                return
+        self.closed = True
+        self.pending.clear()
+        self.points = 0
+        self.stats['dropped'] = self.stats.get('dropped', 0) + 1
+        self.socket.close(SLOW_CLIENT_CODE, 'client too slow')
+
+    def coalesce(self):
+        """Merge the queued updates of each plot into one message
+
+        Updates are only merged up to the next other message of their
+        plot, so Init and End keep their place. Queued views of a plot
+        are merged the same way.
+        """
+        merged = []
+        open = {}
+        copied = set()
+        for message, text in self.pending:
+            kind = message.get('type')
+            plot = message.get('plot')
+            if kind not in ('Updates', 'View'):
+                open.pop((plot, 'Updates'), None)
+                open.pop((plot, 'View'), None)
+                merged.append((message, text))
+                continue
+            if (plot, kind) not in open:
+                open[plot, kind] = len(merged)
+                merged.append((message, text))
+                continue
+            i = open[plot, kind]
+            first, _ = merged[i]
+            if kind == 'View':
+                # A view replaces the points from its offset on
+                start = message['from'] - first['from']
+                if start > 0:
+                    message = dict(message, **{
+                        'from': first['from'],
+                        'seqs': first['seqs'][:start] + message['seqs'],
+                        'points': first['points'][:start] +
+                        message['points']})
+                    text = None
+                merged[i] = (message, text)
+                continue
+            if i not in copied:
+                # Queued messages are shared, merge into a copy
+                first = dict(first, points=list(first['points']))
+                merged[i] = (first, None)
+                copied.add(i)
+            first['points'].extend(message['points'])
+            if 'seq' in message:
+                first['seq'] = message['seq']
+        self.stats['coalesced'] = self.stats.get('coalesced', 0) + \
+            len(self.pending) - len(merged)
+        self.pending = deque(merged)
+        self.points = sum(len(message.get('points', ()))
+                          for message, _ in merged)
+
+    async def _drain(self):
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(start_action())
-        except websockets.exceptions.ConnectionClosed as e:
-            print(e)
-            os.exit(1)
+            while self.pending and not self.closed:
+                message, text = self.pending.popleft()
+                self.points -= len(message.get('points', ()))
+                if text is None:
+                    text = json.dumps(message)
+                await self.socket.write_message(text)
+        except tornado.websocket.WebSocketClosedError:
+            self.closed = True
+        finally:
+            self.sending = False
+
+
+class PlotSocket(tornado.websocket.WebSocketHandler):
+    """One browser connection, carrying any number of plots
+
+    Every message names the plot it belongs to. The browser sends
+    Subscribe and Unsubscribe messages with a plot id, and Subscribe
+    may carry since, the last sequence number it has of the plot. The
+    server sends a Plots message listing the plots on connect and
+    whenever one is added, then for every subscribed plot its Init
+    message, a Snapshot of its points so far, Updates messages with the
+    new points and the sequence number of the last one, and an End
+    message.
+
+    A Subscribe carrying the width of the chart in pixels asks for the
+    plot downsampled instead: after Init come View messages, each
+    replacing the points of the view from an offset on, from the first
+    that covers all of it.
+    """
+    def initialize(self, appRef):
+        self.appRef = appRef
+        self.plots = set()
+        self.queue = ClientQueue(self, appRef.slowClient, appRef.maxPending,
+                                 appRef.maxPoints, appRef.stats)
+
+    def check_origin(self, origin):
+        # The front end is served from the webpack server's port
+        return True
+
+    def open(self):
+        self.appRef.sockets.add(self)
+        self.queue.push(self.appRef.plotsMessage())
+
+    def on_message(self, message):
+        try:
+            msg = json.loads(message)
+            plot = self.appRef.plots.get(msg.get('plot'))
+        except (ValueError, AttributeError, TypeError):
+            return
+        if plot is None:
+            return
+        if msg.get('type') == 'Subscribe' and plot not in self.plots:
+            since = msg.get('since')
+            width = msg.get('width')
+            self.plots.add(plot)
+            plot.subscribe(self, since if isinstance(since, int) else None,
+                           width if isinstance(width, int) and width > 0
+                           else None)
+        elif msg.get('type') == 'Unsubscribe' and plot in self.plots:
+            self.plots.discard(plot)
+            plot.unsubscribe(self)
+
+    def on_close(self):
+        self.queue.closed = True
+        for plot in self.plots:
+            plot.unsubscribe(self)
+        self.plots.clear()
+        self.appRef.sockets.discard(self)
+
+
+class PlotHistory:
+    """The latest points of a plot, stored by column
+
+    Every point gets the next sequence number of the plot. Fields with
+    numbers are kept in float arrays, others in object arrays, so a
+    point costs a few words. Only the last cap points are served;
+    arrays grow up to twice that and are then compacted, making appends
+    amortized O(1) with bounded memory.
+
+    Args:
+        cap (int): Points kept
+    """
+    def __init__(self, cap=DEFAULT_HISTORY_POINTS):
+        self.cap = cap
+        self.columns = {}
+        self.capacity = 0
+        self.size = 0
+        self.next = 1
+
+    @property
+    def last(self):
+        """Sequence number of the latest point, 0 before any
+        """
+        return self.next - 1
+
+    @property
+    def first(self):
+        """Sequence number of the oldest point served
+        """
+        return self.next - min(self.size, self.cap)
+
+    @staticmethod
+    def _empty(dtype, capacity):
+        if dtype == object:
+            return np.full(capacity, None, dtype=object)
+        return np.full(capacity, np.nan)
+
+    def _reserve(self, n):
+        if self.size + n > self.capacity and self.capacity < 2 * self.cap:
+            self.capacity = min(max(2 * self.capacity, self.size + n, 1024),
+                                2 * self.cap)
+            for name, column in self.columns.items():
+                grown = self._empty(column.dtype, self.capacity)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        if self.size + n > self.capacity:
+            keep = min(self.size, self.cap - n)
+            for name, column in self.columns.items():
+                column[:keep] = column[self.size - keep:self.size]
+                column[keep:] = self._empty(column.dtype, 1)[0]
+            self.size = keep
+
+    def extend(self, points):
+        """Append points, dicts of field values
+
+        Returns:
+            tuple: Sequence numbers of the first and last point
+        """
+        first = self.next
+        self.next += len(points)
+        points = points[-self.cap:]
+        self._reserve(len(points))
+        for i, point in enumerate(points, self.size):
+            if not isinstance(point, dict):
+                point = {'value': point}
+            for name, value in point.items():
+                column = self.columns.get(name)
+                numeric = isinstance(value, (int, float)) and \
+                    not isinstance(value, bool)
+                if column is None:
+                    column = self.columns[name] = self._empty(
+                        float if numeric else object, self.capacity)
+                elif column.dtype != object and not numeric:
+                    column = self.columns[name] = column.astype(object)
+                column[i] = value
+        self.size += len(points)
+        return first, self.last
+
+    def snapshot(self, since=0):
+        """The points after sequence number since, by column
+
+        Returns:
+            dict: Sequence numbers of the first and last point (seq)
+                  and the columns as
+                  lists, None where a point lacks a field
+        """
+        start = max(since + 1, self.first)
+        lo = self.size - (self.next - start)
+        columns = {}
+        for name, column in self.columns.items():
+            values = column[lo:self.size]
+            if values.dtype != object:
+                values = np.where(np.isnan(values), None,
+                                  values.astype(object))
+            else:
+                values = [None if isinstance(v, float) and v != v else v
+                          for v in values]
+            columns[name] = list(values)
+        return {'first': start, 'seq': self.last,
+                'count': self.next - start, 'columns': columns}
+
+
+class Plot:
+    """A stream of frames shown as one plot
+
+    The frames are read from a pipe on the server's event loop, so a
+    plot costs no thread. The pipe is read once whoever watches; each
+    update is serialized once and queued to every subscribed connection,
+    so a slow viewer never holds up the pipe or the other viewers.
+
+    The plot keeps its latest points in a PlotHistory. A subscriber
+    gets them in one Snapshot message before the live Updates; one that
+    reconnects passes the sequence number it has seen and only gets the
+    points after it, or everything kept if those are gone.
+
+    The whole series is also kept as a MinMaxView as wide as the widest
+    chart served. A subscriber giving its chart's width follows a view
+    of that width instead, derived from the widest one when first asked
+    for and then updated with the new points like it; subscribers of
+    the same width share it. For zooming, the plotted field of every
+    point goes into a Pyramid too.
+
+    Args:
+        id (int): Assigned by the server
+        pipe (int): Read end of the pipe the frames come from
+        initParams (dict): Parameters of the Init message, e.g. title;
+                           field names the field to downsample by
+        historyPoints (int): Points kept for late subscribers
+        pointsPerPixel (int): Points of a downsampled view per pixel
+        onEnd (callable): Called with the plot once it ended, or None
+    """
+    def __init__(self, id, pipe, initParams,
+                 historyPoints=DEFAULT_HISTORY_POINTS,
+                 pointsPerPixel=DEFAULT_POINTS_PER_PIXEL, onEnd=None):
+        self.id = id
+        self.pipe = pipe
+        self.initParams = dict(initParams)
+        self.history = PlotHistory(historyPoints)
+        self.pointsPerPixel = pointsPerPixel
+        widest = viewBuckets(MAX_VIEW_WIDTH, pointsPerPixel)
+        self.views = {widest: MinMaxView(widest,
+                                         self.initParams.get('field'))}
+        self.pyramid = Pyramid()
+        self.decoder = FrameDecoder()
+        # The buckets of the view every subscriber follows, or None
+        self.subscribers = {}
+        self.ended = False
+        self.onEnd = onEnd
+        self.done = threading.Event()
+
+    @property
+    def field(self):
+        """The field of the points plotted, None until known
+        """
+        return self.views[max(self.views)].field
+
+    def info(self):
+        return {'plot': self.id, 'title': self.initParams.get('title'),
+                'ended': self.ended, 'seq': self.history.last}
+
+    def subscribe(self, socket, since=None, width=None):
+        """Send the plot so far to a connection and follow it live
+
+        Args:
+            socket (PlotSocket): The connection
+            since (int): Last sequence number the client has, or None
+            width (int): Width of the client's chart in pixels, to get
+                         the plot downsampled, or None
+        """
+        socket.queue.push(dict(self.initParams, type='Init', plot=self.id))
+        buckets = None
+        if width is not None:
+            buckets = viewBuckets(width, self.pointsPerPixel)
+            view = self.views.get(buckets)
+            if view is None:
+                widest = self.views[max(self.views)]
+                view = self.views[buckets] = widest.coarsened(buckets)
+            socket.queue.push(self.viewMessage(view, 0))
+        else:
+            # Resume only if nothing after since was evicted
+            reset = since is None or since < self.history.first - 1 or \
+                since > self.history.last
+            snapshot = self.history.snapshot(0 if reset else since)
+            snapshot.update({'type': 'Snapshot', 'plot': self.id,
+                             'reset': reset})
+            socket.queue.push(snapshot)
+        if self.ended:
+            socket.queue.push({'type': 'End', 'plot': self.id})
+        else:
+            self.subscribers[socket] = buckets
+
+    def unsubscribe(self, socket):
+        buckets = self.subscribers.pop(socket, None)
+        if buckets is not None and buckets != max(self.views) and \
+                buckets not in self.subscribers.values():
+            del self.views[buckets]
+
+    def publish(self, message, buckets=None):
+        """Fan a message out to the queues of subscribers
+
+        Args:
+            buckets (int): Only to the subscribers of the view with as
+                           many buckets, by default to the others
+        """
+        sockets = [socket for socket, following in self.subscribers.items()
+                   if following == buckets]
+        if not sockets:
+            return
+        text = json.dumps(message)
+        for socket in sockets:
+            socket.queue.push(message, text)
+
+    def viewMessage(self, view, bucket):
+        """A View message of the points of a view from a bucket on
+        """
+        offset, seqs, points = view.points(bucket)
+        return {'type': 'View', 'plot': self.id, 'from': offset,
+                'bucket': view.size, 'seq': self.history.last,
+                'seqs': seqs, 'points': points}
+
+    def onReadable(self, fd, events):
+        """Read what the pipe has; called by the event loop
+        """
+        try:
+            data = os.read(self.pipe, READSZ)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.end()
+            return
+        for frame in self.decoder.feed(data):
+            try:
+                points = framePoints(frame)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if points:
+                self.receive(points)
+
+    def receive(self, points):
+        """Add points to the plot and send them to the subscribers
+        """
+        first, last = self.history.extend(points)
+        self.publish({'type': 'Updates', 'plot': self.id,
+                      'first': first, 'seq': last, 'points': points})
+        following = set(self.subscribers.values())
+        for buckets, view in self.views.items():
+            bucket = view.add(first, points)
+            if bucket is not None and buckets in following:
+                self.publish(self.viewMessage(view, bucket), buckets)
+
+        field = self.field
+        values = np.array([valueOf(point, field) for point in points],
+                          dtype='f8')
+        self.pyramid.extend(first, values, timesOf(points))
+
+    def end(self):
+        if self.pipe is not None:
+            tornado.ioloop.IOLoop.current().remove_handler(self.pipe)
+        self.ended = True
+        message = {'type': 'End', 'plot': self.id}
+        for socket in list(self.subscribers):
+            socket.queue.push(message)
+        self.subscribers.clear()
+        if self.onEnd is not None:
+            self.onEnd(self)
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """Block until the pipe is drained
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        return self.done.wait(timeout)
 
 
 class WebDisplayServer(tornado.web.Application):
-    def __init__(self):
+    def __init__(self, port=WEBPORT, slowClient=SlowClient.COALESCE,
+                 maxPending=256, maxPoints=100000,
+                 historyPoints=DEFAULT_HISTORY_POINTS,
+                 pointsPerPixel=DEFAULT_POINTS_PER_PIXEL,
+                 endedPlots=DEFAULT_ENDED_PLOTS):
         """Initialize a web display server
+
+        Ended plots have no subscribers left and only serve late viewers,
+        so beyond the endedPlots most recent ones they are dropped, with
+        all their points; memory stays bounded however many plots run.
+
+        Args:
+            port (int): The port the server listens on
+            slowClient (SlowClient): Policy for clients falling behind
+            maxPending (int): Messages queued per client at most
+            maxPoints (int): Points queued per client at most
+            historyPoints (int): Points every plot keeps
+            pointsPerPixel (int): Points per pixel of downsampled plots
+            endedPlots (int): Ended plots kept
         """
 
         handlers = [
-            (r'/plot', PlotHandler, {'appRef': self})
+            (r'/plot', PlotHandler, {'appRef': self}),
+            (r'/plot/(\d+)', PlotRangeHandler, {'appRef': self}),
+            (PLOT_SOCKET_PATH, PlotSocket, {'appRef': self}),
         ]
 
         settings = {
             'xsrf_cookies': False,
-            'debug': True
+            'debug': False
         }
 
-        self.plotters = []
+        self.port = port
+        self.slowClient = SlowClient(slowClient)
+        self.maxPending = maxPending
+        self.maxPoints = maxPoints
+        self.historyPoints = historyPoints
+        self.pointsPerPixel = pointsPerPixel
+        self.stats = {'coalesced': 0, 'dropped': 0}
+        self.endedPlots = endedPlots
+        self.plots = {}
+        # Ids of the ended plots kept, oldest first
+        self.ended = deque()
+        self.sockets = set()
+        self.ids = itertools.count(1)
+        self.loop = None
 
         super(WebDisplayServer, self).__init__(handlers, **settings)
 
-    def addPlotter(self, dataReader, initParams: dict):
-        """Add another plotter to the server
+    def plotList(self):
+        return [plot.info() for plot in self.plots.values()]
+
+    def plotsMessage(self):
+        return {'type': 'Plots', 'plots': self.plotList()}
+
+    def addPlotter(self, pipe, initParams: dict):
+        """Add another plot to the server
+
+        The plot is served over the server's one websocket endpoint
+        under a new id. Thread-safe; the pipe is read on the server's
+        event loop, which must be running.
 
-        The web display server will create a free port used for
-        interaction between the front end client and the web plotter.
-        The web plotter will be run as a separate thread.
         Args:
-            dataReader (object): An object that has implemented __iter__
-                                 and __next__. __next__ should return a json
-                                 string of the data.
+            pipe (int): Read end of a pipe carrying frames, e.g. the
+                        inPipe of the plot action
             initParams (dict): A dictionary of some intialization params for
             the plot.
+
+        Returns:
+            Plot: The plot; its wait() returns once the pipe is drained
         """
 
-        wsport = getFreePort()
-        plotter = WebPlotter(dataReader, wsport, initParams)
-        plotter.start()
-        self.plotters.append((plotter, wsport))
+        plot = Plot(next(self.ids), pipe, initParams, self.historyPoints,
+                    self.pointsPerPixel, self._ended)
+        os.set_blocking(pipe, False)
+        self.loop.add_callback(self._register, plot)
+        return plot
 
+    def addRun(self, records, initParams: dict):
+        """Add the plot of a stored run, e.g. from the result cache
 
-class WebDisplayServerProcess(Process):
-    """Represents an individual process to run webdisplayserver
+        Thread-safe like addPlotter.
 
-    It receives the same args as WebDisplayServer, only have other
-    methods to start and stop.
+        Args:
+            records (np.ndarray): The PORTFOLIO_DTYPE records of the run
+            initParams (dict): Parameters of the plot
 
+        Returns:
+            Plot: The plot, ended once loaded
+        """
+        plot = Plot(next(self.ids), None, initParams, self.historyPoints,
+                    self.pointsPerPixel, self._ended)
+        self.loop.add_callback(self._register, plot, records)
+        return plot
+
+    def _register(self, plot, records=None):
+        self.plots[plot.id] = plot
+        if records is not None:
+            if len(records):
+                plot.receive(recordsToDicts(records))
+            # Announces the plot
+            plot.end()
+            return
+        self.loop.add_handler(plot.pipe, plot.onReadable,
+                              tornado.ioloop.IOLoop.READ)
+        self._announce()
+
+    def _ended(self, plot):
+        self.ended.append(plot.id)
+        while len(self.ended) > self.endedPlots:
+            evicted = self.plots.pop(self.ended.popleft())
+            for socket in self.sockets:
+                socket.plots.discard(evicted)
+        self._announce()
+
+    def _announce(self):
+        """Send the list of plots to every connection
+        """
+        message = self.plotsMessage()
+        text = json.dumps(message)
+        for socket in list(self.sockets):
+            socket.queue.push(message, text)
+
+
+class WebDisplayServerThread(threading.Thread):
+    """Runs a WebDisplayServer on an event loop in its own thread
+
+    All plots and browser connections are served by this one thread and
+    one listening socket, whatever their number.
+
+    Args:
+        port (int): The port the server listens on
     """
-    def __init__(self, port):
-        super(WebDisplayServerProcess, self).__init__()
-        self.server = WebDisplayServer()
+    def __init__(self, port=WEBPORT):
+        super(WebDisplayServerThread, self).__init__(daemon=True)
+        self.server = WebDisplayServer(port)
         self.port = port
+        self.http = None
+        self.error = None
+        self.started = threading.Event()
 
     def run(self):
-        self.server.listen(self.port)
-        tornado.ioloop.IOLoop.current().start()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            self.http = self.server.listen(self.port)
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            return
+        self.server.loop = loop
+        self.started.set()
+        loop.start()
+
+    def stop(self):
+        if self.server.loop is not None:
+            self.server.loop.add_callback(self._shutdown)
+        self.join()
+
+    def _shutdown(self):
+        self.http.stop()
+        for socket in list(self.server.sockets):
+            socket.close()
+        self.server.loop.stop()
+
+    def addPlotter(self, pipe, initParams: dict):
+        """WebDisplayServer.addPlotter, once the server is listening
+        """
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+        return self.server.addPlotter(pipe, initParams)
 
-    def addPlotter(self, dataSource, initParams: dict):
-        self.server.addPlotter(dataSource, initParams)
+    def addRun(self, records, initParams: dict):
+        """WebDisplayServer.addRun, once the server is listening
+        """
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+        return self.server.addRun(records, initParams)
 
 
 # class DisplayManager():
@@ -0,0 +1,321 @@
+"""Downsampled views of long plot series
+"""
+import numpy as np
+
+DEFAULT_POINTS_PER_PIXEL = 2
+# Widest view served, in pixels
+MAX_VIEW_WIDTH = 4096
+DEFAULT_FANOUT = 4
+NAT = np.iinfo(np.int64).min
+
+
+def valueOf(point, field):
+    """The number a point is plotted at, or None
+    """
+    value = point.get(field) if isinstance(point, dict) else point
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+            value != value:
+        return None
+    return value
+
+
+def numericField(point):
+    """The first field of a point holding a number, or None
+    """
+    if isinstance(point, dict):
+        for name in point:
+            if valueOf(point, name) is not None:
+                return name
+    return None
+
+
+def viewBuckets(width, pointsPerPixel=DEFAULT_POINTS_PER_PIXEL):
+    """Buckets of a view of about pointsPerPixel points per pixel
+
+    Every bucket shows two points, its lowest and its highest.
+    """
+    width = min(max(1, int(width)), MAX_VIEW_WIDTH)
+    return max(1, width * pointsPerPixel // 2)
+
+
+def timesOf(points):
+    """The timestamps of points as int64 ns, NaT where they have none
+    """
+    times = np.full(len(points), NAT)
+    for i, point in enumerate(points):
+        if isinstance(point, dict) and 'timestamp' in point:
+            try:
+                times[i] = np.datetime64(point['timestamp'], 'ns').astype('i8')
+            except (ValueError, TypeError):
+                pass
+    return times
+
+
+def _merge(a, b):
+    if a is None or b is None:
+        return b if a is None else a
+    low = a if a[1] <= b[1] else b
+    high = a if a[4] >= b[4] else b
+    return low[:3] + high[3:]
+
+
+class MinMaxView:
+    """A series reduced to the lowest and highest point of each bucket
+
+    Buckets hold a power of two consecutive points, numbered by their
+    sequence numbers. Once a point falls past the last bucket, adjacent
+    buckets are merged in pairs, doubling their size, so there are never
+    more than maxBuckets and adding a point is amortized O(1) whatever
+    the length of the series. The view keeps the original points, not
+    copies, as they are shared with the messages sent.
+
+    Args:
+        maxBuckets (int): Buckets kept at most
+        field (str): Field of dict points to plot, by default the first
+                     one holding a number
+    """
+    def __init__(self, maxBuckets, field=None):
+        self.maxBuckets = max(1, maxBuckets)
+        self.field = field
+        self.size = 1
+        self.start = None
+        # [low seq, low value, low point, high seq, high value, high point]
+        # of every bucket, None for buckets without a value
+        self.buckets = []
+
+    def _halve(self):
+        self.size *= 2
+        buckets = self.buckets + [None] * (len(self.buckets) % 2)
+        self.buckets = [_merge(a, b)
+                        for a, b in zip(buckets[::2], buckets[1::2])]
+
+    def add(self, first, points):
+        """Add points numbered from first
+
+        Returns:
+            int: Index of the first bucket changed, None if none was
+        """
+        dirty = None
+        for seq, point in enumerate(points, first):
+            if self.start is None:
+                self.start = seq
+            if self.field is None:
+                self.field = numericField(point)
+            value = valueOf(point, self.field)
+            if value is None:
+                continue
+            k = (seq - self.start) // self.size
+            while k >= self.maxBuckets:
+                self._halve()
+                k = (seq - self.start) // self.size
+                dirty = 0
+            if k >= len(self.buckets):
+                self.buckets.extend([None] * (k + 1 - len(self.buckets)))
+            bucket = self.buckets[k]
+            if bucket is None:
+                self.buckets[k] = [seq, value, point, seq, value, point]
+            else:
+                if value < bucket[1]:
+                    bucket[:3] = seq, value, point
+                if value > bucket[4]:
+                    bucket[3:] = seq, value, point
+            dirty = k if dirty is None else min(dirty, k)
+        return dirty
+
+    def coarsened(self, maxBuckets):
+        """A view of the same points with at most maxBuckets buckets
+        """
+        view = MinMaxView(maxBuckets, self.field)
+        view.size = self.size
+        view.start = self.start
+        view.buckets = [None if bucket is None else list(bucket)
+                        for bucket in self.buckets]
+        while len(view.buckets) > view.maxBuckets:
+            view._halve()
+        return view
+
+    @staticmethod
+    def _count(bucket):
+        if bucket is None:
+            return 0
+        return 1 if bucket[0] == bucket[3] else 2
+
+    def points(self, bucket=0):
+        """The points of the view from a bucket on, in order
+
+        Returns:
+            tuple: Index of the first point returned in the whole view,
+                   and lists of the sequence numbers and the points
+        """
+        offset = sum(self._count(b) for b in self.buckets[:bucket])
+        seqs = []
+        points = []
+        for b in self.buckets[bucket:]:
+            if b is None:
+                continue
+            low, high = b[:3], b[3:]
+            if low[0] > high[0]:
+                low, high = high, low
+            for seq, _, point in (low, high)[:self._count(b)]:
+                seqs.append(seq)
+                points.append(point)
+        return offset, seqs, points
+
+
+class _Columns:
+    """Arrays of equal length grown by doubling
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.arrays = {name: np.empty(0, dtype) for name, dtype in fields}
+        self.size = 0
+
+    def __getitem__(self, name):
+        return self.arrays[name][:self.size]
+
+    def resize(self, size):
+        capacity = len(self.arrays[self.fields[0][0]])
+        if size > capacity:
+            capacity = max(size, 2 * capacity, 1024)
+            for name, dtype in self.fields:
+                grown = np.empty(capacity, dtype)
+                grown[:self.size] = self.arrays[name][:self.size]
+                self.arrays[name] = grown
+        self.size = size
+
+
+def _jsonList(values):
+    return np.where(np.isnan(values), None, values.astype(object)).tolist()
+
+
+class Pyramid:
+    """Levels of detail of a series, for zooming into any range of it
+
+    Level 0 holds every value with its time. A bucket of level L sums up
+    fanout buckets of level L - 1, so fanout ** L values, by their open,
+    high, low and close. Levels are added as the series grows until the
+    top one has at most fanout buckets, which makes the levels together
+    about a third of the size of level 0 with the default fanout of 4.
+
+    Appending values only recomputes the last bucket of every level and
+    those the new values fill, in bulk with numpy, so a stored run is
+    loaded by a single extend() and a live one updated batch by batch.
+    A range is answered from the finest level showing it in at most the
+    buckets asked for, by slicing that level.
+
+    Args:
+        fanout (int): Buckets of a level summed up by a bucket above
+    """
+    VALUE_FIELDS = (('value', 'f8'), ('time', 'i8'))
+    BUCKET_FIELDS = (('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                     ('close', 'f8'), ('time', 'i8'))
+
+    def __init__(self, fanout=DEFAULT_FANOUT):
+        self.fanout = fanout
+        self.start = None
+        self.levels = [_Columns(self.VALUE_FIELDS)]
+
+    @property
+    def size(self):
+        return self.levels[0].size
+
+    def extend(self, first, values, times=None):
+        """Append values numbered from sequence number first
+
+        Args:
+            first (int): Sequence number of the first value
+            values (np.ndarray): The values, NaN where a point has none
+            times (np.ndarray): Their times as int64 ns, NaT if unknown
+        """
+        if not len(values):
+            return
+        if self.start is None:
+            self.start = first
+        base = self.levels[0]
+        changed = base.size
+        base.resize(base.size + len(values))
+        base.arrays['value'][changed:base.size] = values
+        base.arrays['time'][changed:base.size] = \
+            NAT if times is None else times
+
+        below = base
+        level = 1
+        while below.size > self.fanout or level < len(self.levels):
+            if level == len(self.levels):
+                self.levels.append(_Columns(self.BUCKET_FIELDS))
+                changed = 0
+            lo = changed // self.fanout
+            starts = np.arange(lo * self.fanout, below.size, self.fanout)
+            ends = np.append(starts[1:], below.size) - 1
+            if below is base:
+                opens = highs = lows = closes = below['value']
+            else:
+                opens, highs, lows, closes = (below[name] for name in
+                                              ('open', 'high', 'low',
+                                               'close'))
+            bucket = self.levels[level]
+            bucket.resize(lo + len(starts))
+            arrays = bucket.arrays
+            arrays['open'][lo:bucket.size] = opens[starts]
+            arrays['high'][lo:bucket.size] = np.fmax.reduceat(highs, starts)
+            arrays['low'][lo:bucket.size] = np.fmin.reduceat(lows, starts)
+            arrays['close'][lo:bucket.size] = closes[ends]
+            arrays['time'][lo:bucket.size] = below['time'][starts]
+            changed = lo
+            below = bucket
+            level += 1
+
+    def locate(self, time, after=True):
+        """Sequence number of the first value at or after a time, or of
+        the last one at or before it
+
+        Args:
+            time (int): ns since the epoch
+
+        Raises:
+            ValueError: The values have no times
+        """
+        times = self.levels[0]['time']
+        if not len(times) or times[0] == NAT:
+            raise ValueError('the series has no times')
+        if after:
+            return self.start + int(np.searchsorted(times, time))
+        return self.start + int(np.searchsorted(times, time, 'right')) - 1
+
+    def range(self, lo, hi, buckets):
+        """The values from sequence number lo to hi, inclusive
+
+        Args:
+            buckets (int): Buckets the range may take at most; the
+                           finest level within the bound is used
+
+        Returns:
+            dict: The level and the values per bucket (factor), then
+                  the seqs and times of the first value of every bucket
+                  and by column either value, at level 0, or open,
+                  high, low and close
+        """
+        level = 0
+        factor = 1
+        if self.start is not None:
+            lo = max(lo, self.start)
+            hi = min(hi, self.start + self.size - 1)
+            while -(-(hi - lo + 1) // factor) > buckets and \
+                    level + 1 < len(self.levels):
+                level += 1
+                factor *= self.fanout
+        columns = self.levels[level]
+        if self.start is None or hi < lo:
+            i = j = 0
+        else:
+            i = (lo - self.start) // factor
+            j = (hi - self.start) // factor + 1
+        result = {'level': level, 'factor': factor,
+                  'seqs': list(range(self.start + i * factor,
+                                     self.start + j * factor, factor))
+                  if j > i else []}
+        times = np.datetime_as_string(columns['time'][i:j].view('M8[ns]'))
+        result['times'] = [None if t == 'NaT' else t for t in times.tolist()]
+        for name, _ in columns.fields[:-1]:
+            result[name] = _jsonList(columns[name][i:j])
+        return result
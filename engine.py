@@ -0,0 +1,499 @@
+"""Long-lived zipline environment shared by backtests
+"""
+import os
+import pickle
+import re
+import threading
+import numpy as np
+import pandas as pd
+from zipline.data import bundles
+from zipline.data.data_portal import DataPortal
+from zipline.extensions import load
+from zipline.finance import metrics
+from zipline.finance.blotter import Blotter
+from zipline.finance.metrics.tracker import MetricsTracker
+from zipline.finance.trading import TradingEnvironment
+from zipline.pipeline.data import USEquityPricing
+from zipline.pipeline.loaders import USEquityPricingLoader
+from zipline.algorithm import TradingAlgorithm
+from zipline.utils.factory import create_simulation_parameters
+from trading_calendars import get_calendar
+from ingest import loadBundle
+from pricestore import DEFAULT_STORE_DIR, DEFAULT_WINDOW_CACHE_BYTES, \
+    STORE_FIELDS, PriceStore, WindowCache
+
+_engines = {}
+_enginesLock = threading.Lock()
+
+
+def getEngine(bundle='quandl', calendar='XNYS', environ=os.environ):
+    """Return the process-wide engine for a bundle, creating it if needed
+    """
+    with _enginesLock:
+        key = (bundle, calendar)
+        if key not in _engines:
+            _engines[key] = ZiplineEngine(bundle, calendar, environ)
+        return _engines[key]
+
+
+class EngineContext:
+    """Everything loaded from one ingestion of a bundle
+    """
+    def __init__(self, timestamp, bundle_data, env, data_portal,
+                 choose_loader):
+        self.timestamp = timestamp
+        self.bundle_data = bundle_data
+        self.env = env
+        self.data_portal = data_portal
+        self.choose_loader = choose_loader
+
+
+class StorePortal(DataPortal):
+    """DataPortal serving daily history windows from a PriceStore
+
+    history() of a daily run used to load, adjust and copy its window
+    on every call. The store maps the bundle's bars, adjusted once per
+    ingestion, as date x asset arrays, so a window is a slice of them
+    rescaled to its as-of session, and the windows that had to be
+    rescaled are cached. Other windows go to the DataPortal.
+
+    Args:
+        storeRoot (str): Directory of the ingestion's store
+        dailyReader (BcolzDailyBarReader): Source of the store
+        adjustmentReader (SQLiteAdjustmentReader): The bundle's adjustments
+        cacheBytes (int): Size bound of the window cache
+    """
+    def __init__(self, *args, storeRoot=None, dailyReader=None,
+                 adjustmentReader=None,
+                 cacheBytes=DEFAULT_WINDOW_CACHE_BYTES, **kwargs):
+        super(StorePortal, self).__init__(*args, **kwargs)
+        self.storeRoot = storeRoot
+        self.dailyReader = dailyReader
+        self.adjustmentReader = adjustmentReader
+        self.cacheBytes = cacheBytes
+        self.windows = None
+        self.storeLock = threading.Lock()
+
+    def windowCache(self):
+        """Open the store, building it on first use
+
+        Returns:
+            WindowCache: The cache in front of the store
+        """
+        with self.storeLock:
+            if self.windows is None:
+                reader = self.dailyReader
+                sessions = self.trading_calendar.sessions_in_range(
+                    reader.first_trading_day, reader.last_available_dt)
+                store = PriceStore.open(self.storeRoot, reader, sessions,
+                                        sorted(self.asset_finder.sids),
+                                        self.adjustmentReader)
+                self.windows = WindowCache(store, self.cacheBytes)
+            return self.windows
+
+    def get_history_window(self, assets, end_dt, bar_count, frequency,
+                           field, data_frequency, ffill=True):
+        if frequency == '1d' and data_frequency == 'daily' and \
+                field in STORE_FIELDS and (ffill or field != 'price') and \
+                bar_count > 0:
+            frame = self.storeWindow(assets, end_dt, bar_count, field)
+            if frame is not None:
+                return frame
+        return super(StorePortal, self).get_history_window(
+            assets, end_dt, bar_count, frequency, field, data_frequency,
+            ffill)
+
+    def storeWindow(self, assets, end_dt, bar_count, field):
+        """The history window from the store, or None if it cannot serve it
+        """
+        windows = self.windowCache()
+        store = windows.store
+        row = store.locate(self.trading_calendar.minute_to_session_label(
+            end_dt))
+        columns = store.columnsOf(assets)
+        if row is None or row + 1 < bar_count or columns is None:
+            return None
+        values = windows.window(field, row, bar_count, columns)
+        frame = store.frame(field, row, bar_count, assets, values)
+        if field == 'price':
+            # Like the DataPortal, do not carry prices past an asset's end
+            ended = [(j, frame.index > asset.end_date)
+                     for j, asset in enumerate(assets)
+                     if asset.end_date < frame.index[-1]]
+            if ended:
+                values = np.array(values)
+                for j, after in ended:
+                    values[after, j] = np.nan
+                frame = store.frame(field, row, bar_count, assets, values)
+        return frame
+
+
+def metricKey(metric):
+    """Identify a metric across runs by its type and configuration
+
+    Must be called before the metric has seen a run, when its
+    attributes are the ones it was constructed with.
+    """
+    config = []
+    for name, value in sorted(vars(metric).items()):
+        if callable(value) and hasattr(value, '__qualname__'):
+            value = value.__module__ + '.' + value.__qualname__
+        config.append((name, repr(value)))
+    return type(metric).__name__, tuple(config)
+
+
+def restoreMetric(metric, saved, sessions):
+    """Put back the state of a metric saved at a session close
+
+    Arrays of a metric are indexed by session and sized to the run, so
+    the fresh ones are kept and only their first sessions are copied
+    from the saved ones; everything else is replaced.
+
+    Args:
+        metric: The metric of the resumed run, after start_of_simulation
+        saved (dict): Its attributes in the checkpointed run
+        sessions (int): Sessions completed when the state was saved
+    """
+    for name, value in saved.items():
+        fresh = getattr(metric, name, None)
+        if isinstance(value, (np.ndarray, pd.Series)) and \
+                isinstance(fresh, (np.ndarray, pd.Series)):
+            source = np.asarray(value)
+            count = min(sessions, len(source), len(fresh))
+            if isinstance(fresh, pd.Series):
+                fresh.iloc[:count] = source[:count]
+            else:
+                fresh[:count] = source[:count]
+        else:
+            setattr(metric, name, value)
+
+
+class ResumableAlgorithm(TradingAlgorithm):
+    """TradingAlgorithm that can snapshot and restore its state
+
+    The state is what a run carries from one session to the next: the
+    ledger's portfolio, positions and daily returns, the blotter's open
+    orders, the attributes the user's initialize put on the context and
+    the cumulative state of the metrics. A resumed run's metrics tracker
+    starts at the first session of the checkpointed run, so its packets
+    and risk metrics are those of a full replay.
+
+    States are taken at the close of a session, so the next session's
+    dividends and splits, applied when it starts, are left to the
+    resumed run. If some of the metrics cannot be pickled the state has
+    no metrics and the run cannot be resumed from it, see resumable().
+
+    Args:
+        checkpoint (callable): Called as checkpoint(session, getState)
+                               at every session close, with the next
+                               session, the one a resume starts at; or
+                               None
+        resumeFrom (dict): A state from getState to start from, or None
+        timer (profiling.CallbackTimer): Times the script's callbacks and
+                                         scheduled functions, or None
+        onBar (callable): Called as onBar(algo) after handle_data on
+                          every bar, or None
+    """
+    def __init__(self, *args, checkpoint=None, resumeFrom=None, timer=None,
+                 onBar=None, **kwargs):
+        self.checkpoint = checkpoint
+        self.resumeFrom = resumeFrom
+        self.timer = timer
+        self.onBar = onBar
+        self.userAttrs = set()
+        self.metricKeys = {}
+        self.closedMetrics = None
+        super(ResumableAlgorithm, self).__init__(*args, **kwargs)
+        if timer is not None:
+            self._initialize = timer.wrap('initialize', self._initialize)
+            self._handle_data = timer.wrap('handle_data', self._handle_data)
+            self._before_trading_start = timer.wrap(
+                'before_trading_start', self._before_trading_start)
+
+    def _create_metrics_tracker(self):
+        first = self.sim_params.start_session
+        if self.resumeFrom is not None:
+            first = self.resumeFrom['first_session']
+        self.metricKeys = {id(metric): metricKey(metric)
+                           for metric in self._metrics_set}
+        tracker = MetricsTracker(
+            trading_calendar=self.trading_calendar,
+            first_session=first,
+            last_session=self.sim_params.end_session,
+            capital_base=self.sim_params.capital_base,
+            emission_rate=self.sim_params.emission_rate,
+            data_frequency=self.sim_params.data_frequency,
+            asset_finder=self.asset_finder,
+            metrics=self._metrics_set,
+        )
+        handle_market_close = tracker.handle_market_close
+
+        def closeSession(*args, **kwargs):
+            session = tracker._current_session
+            packet = handle_market_close(*args, **kwargs)
+            # Shallow copies: arrays are only written at later sessions
+            self.closedMetrics = {self.metricKeys[id(metric)]:
+                                  dict(vars(metric))
+                                  for metric in self._metrics_set}
+            if self.checkpoint is not None:
+                self.checkpoint(
+                    self.trading_calendar.next_session_label(session),
+                    self.getState)
+            return packet
+        tracker.handle_market_close = closeSession
+        return tracker
+
+    def _create_generator(self, sim_params):
+        generator = super(ResumableAlgorithm, self)._create_generator(
+            sim_params)
+        if self.resumeFrom is not None:
+            self.restoreMetrics(self.resumeFrom)
+        return generator
+
+    def initialize(self, *args, **kwargs):
+        before = set(self.__dict__)
+        super(ResumableAlgorithm, self).initialize(*args, **kwargs)
+        self.userAttrs = set(self.__dict__) - before
+        if self.resumeFrom is not None:
+            self.setState(self.resumeFrom)
+
+    def handle_data(self, data):
+        super(ResumableAlgorithm, self).handle_data(data)
+        if self.onBar is not None:
+            self.onBar(self)
+
+    def schedule_function(self, func, *args, **kwargs):
+        if self.timer is not None:
+            func = self.timer.wrap(getattr(func, '__name__', repr(func)),
+                                   func)
+        return super(ResumableAlgorithm, self).schedule_function(
+            func, *args, **kwargs)
+
+    def getState(self):
+        ledger = self.metrics_tracker._ledger
+        user = {}
+        for name in self.userAttrs:
+            if name.startswith('__'):
+                continue
+            value = getattr(self, name)
+            try:
+                pickle.dumps(value)
+            except Exception:
+                continue
+            user[name] = value
+
+        tracker = self.metrics_tracker
+        sessions = tracker._session_count
+        return {
+            'first_session': tracker._first_session,
+            'sessions': sessions,
+            'daily_returns': np.array(
+                ledger.daily_returns_array[:sessions]),
+            'metrics': self.metricState(),
+            'portfolio': dict(vars(ledger._immutable_portfolio)),
+            'position_tracker': ledger.position_tracker,
+            'payout_last_sale_prices': ledger._payout_last_sale_prices,
+            'open_orders': {asset: list(orders) for asset, orders
+                            in self.blotter.open_orders.items() if orders},
+            'user': user,
+        }
+
+    def setState(self, state):
+        ledger = self.metrics_tracker._ledger
+        portfolio = dict(state['portfolio'])
+        # Positions are rebuilt from the tracker on the next sync
+        portfolio.pop('positions', None)
+        vars(ledger._immutable_portfolio).update(portfolio)
+        ledger.position_tracker = state['position_tracker']
+        ledger._payout_last_sale_prices = state['payout_last_sale_prices']
+        ledger._previous_total_returns = portfolio['returns']
+        ledger._dirty_portfolio = True
+
+        for asset, orders in state['open_orders'].items():
+            self.blotter.open_orders[asset].extend(orders)
+            for order in orders:
+                self.blotter.orders[order.id] = order
+
+        for name, value in state['user'].items():
+            setattr(self, name, value)
+
+    def metricState(self):
+        """The metrics as of the last session close, or None if they
+        cannot be saved
+        """
+        if len(set(self.metricKeys.values())) < len(self.metricKeys):
+            # Two metrics alike could not be told apart on resume
+            return None
+        closed = self.closedMetrics
+        if closed is None:
+            # No session closed yet, the metrics are as constructed
+            return {}
+        try:
+            pickle.dumps(closed)
+        except Exception:
+            return None
+        return closed
+
+    def restoreMetrics(self, state):
+        """Bring the metrics tracker to where the checkpointed run was
+        """
+        tracker = self.metrics_tracker
+        sessions = state['sessions']
+        tracker._session_count = sessions
+        # The array shares its memory with the ledger's returns series
+        tracker._ledger.daily_returns_array[:sessions] = \
+            state['daily_returns']
+        for metric in self._metrics_set:
+            saved = state['metrics'].get(self.metricKeys[id(metric)])
+            if saved is not None:
+                restoreMetric(metric, saved, sessions)
+        self.closedMetrics = state['metrics']
+
+
+def resumable(state):
+    """Whether a run can resume from a checkpointed state
+
+    States without the metrics' state, from checkpoints written before
+    it was saved or with metrics that could not be pickled, would make
+    the resumed run report different metrics than a full one.
+    """
+    return state.get('metrics') is not None
+
+
+class ZiplineEngine:
+    """Keeps a bundle's readers, calendar and asset finder hot
+
+    zipline.utils.run_algo._run loads the bundle, builds a trading
+    environment (asset finder, benchmark and treasury curves), a data
+    portal and the pipeline loader on every call. The engine does that
+    once per bundle ingestion and hands the same objects to every run,
+    reloading only when a newer ingestion of the bundle appears.
+
+    Args:
+        bundle (str): Name of the registered zipline bundle
+        calendar (str): Name of the trading calendar
+        environ (mapping): Environment used to locate the bundle
+    """
+    def __init__(self, bundle='quandl', calendar='XNYS', environ=os.environ):
+        self.bundle = bundle
+        self.environ = environ
+        self.trading_calendar = get_calendar(calendar)
+        self.ctx = None
+        self.lock = threading.Lock()
+
+    def latestIngestion(self):
+        """Timestamp of the most recent ingestion of the bundle
+        """
+        ingestions = bundles.ingestions_for_bundle(self.bundle,
+                                                   self.environ)
+        if not ingestions:
+            raise ValueError('no data for bundle {!r}, run ingest first'
+                             .format(self.bundle))
+        return ingestions[0]
+
+    def context(self):
+        """Return the hot EngineContext, reloading it if the bundle moved
+        """
+        with self.lock:
+            timestamp = self.latestIngestion()
+            if self.ctx is None or self.ctx.timestamp != timestamp:
+                self.ctx = self._load(timestamp)
+            return self.ctx
+
+    def _load(self, timestamp):
+        bundle_data = loadBundle(self.bundle, self.trading_calendar,
+                                 self.environ, timestamp)
+
+        prefix, connstr = re.split(
+            r'sqlite:///',
+            str(bundle_data.asset_finder.engine.url),
+            maxsplit=1,
+        )
+        if prefix:
+            raise ValueError(
+                "invalid url {!r}, must begin with 'sqlite:///'".format(
+                    str(bundle_data.asset_finder.engine.url)))
+
+        env = TradingEnvironment(asset_db_path=connstr, environ=self.environ)
+        first_trading_day = \
+            bundle_data.equity_minute_bar_reader.first_trading_day
+        data_portal = StorePortal(
+            env.asset_finder,
+            trading_calendar=self.trading_calendar,
+            first_trading_day=first_trading_day,
+            equity_minute_reader=bundle_data.equity_minute_bar_reader,
+            equity_daily_reader=bundle_data.equity_daily_bar_reader,
+            adjustment_reader=bundle_data.adjustment_reader,
+            storeRoot=os.path.join(
+                DEFAULT_STORE_DIR, self.bundle,
+                bundles.core.to_bundle_ingest_dirname(timestamp)),
+            dailyReader=bundle_data.equity_daily_bar_reader,
+            adjustmentReader=bundle_data.adjustment_reader,
+        )
+
+        pipeline_loader = USEquityPricingLoader(
+            bundle_data.equity_daily_bar_reader,
+            bundle_data.adjustment_reader,
+        )
+
+        def choose_loader(column):
+            if column in USEquityPricing.columns:
+                return pipeline_loader
+            raise ValueError(
+                'No PipelineLoader registered for column %s.' % column)
+
+        return EngineContext(timestamp, bundle_data, env, data_portal,
+                             choose_loader)
+
+    def run(self, algotext, start, end, capital_base=100000,
+            data_frequency='daily', defines=(), metrics_set='default',
+            blotter='default', namespace=None, checkpoint=None,
+            resumeFrom=None, timer=None, onBar=None):
+        """Run an algorithm against the hot environment
+
+        Takes the same inputs as zipline's _run for a script algorithm,
+        plus the checkpoint, timing and per-bar hooks of
+        ResumableAlgorithm.
+
+        Returns:
+            pd.DataFrame: The daily performance frame
+        """
+        ctx = self.context()
+
+        namespace = dict(namespace or {})
+        for assign in defines:
+            name, value = assign.split('=', 1)
+            namespace[name.strip()] = eval(value, namespace)
+
+        if self.trading_calendar.session_distance(start, end) < 1:
+            raise ValueError(
+                'There are no trading days between {} and {}'.format(
+                    start.date(), end.date()))
+
+        if isinstance(metrics_set, str):
+            metrics_set = metrics.load(metrics_set)
+        if isinstance(blotter, str):
+            blotter = load(Blotter, blotter)
+
+        algo = ResumableAlgorithm(
+            checkpoint=checkpoint,
+            resumeFrom=resumeFrom,
+            timer=timer,
+            onBar=onBar,
+            namespace=namespace,
+            env=ctx.env,
+            get_pipeline_loader=ctx.choose_loader,
+            trading_calendar=self.trading_calendar,
+            sim_params=create_simulation_parameters(
+                start=start,
+                end=end,
+                capital_base=capital_base,
+                data_frequency=data_frequency,
+                trading_calendar=self.trading_calendar,
+            ),
+            metrics_set=metrics_set,
+            blotter=blotter,
+            algo_filename='<algorithm>',
+            script=algotext,
+        )
+        return algo.run(ctx.data_portal, overwrite_sim_params=False)
@@ -0,0 +1,802 @@
+"""Offline zipline bundles from local CSV or Parquet files
+
+A bundle directory holds one file per asset, named after its symbol, in
+a daily/ and/or a minute/ subdirectory:
+
+    mybundle/daily/SPY.csv
+    mybundle/daily/TLT.parquet
+    mybundle/minute/SPY.csv.gz
+
+Every file has a date column (date, datetime, dt or timestamp, or the
+first column) and open, high, low, close and volume columns. Daily files
+may also carry a dividend column (cash amount on the ex date) and a
+split column (ratio on the effective date, e.g. 2.0 for a 2:1 split).
+Naive timestamps are taken as UTC. Parquet files need pyarrow or
+fastparquet, which pandas picks up when installed.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from trading_calendars import get_calendar
+from zipline.assets import AssetDBWriter, AssetFinder
+from zipline.data import bundles
+from zipline.data.minute_bars import BcolzMinuteBarReader, \
+    BcolzMinuteBarWriter
+from zipline.data.us_equity_pricing import BcolzDailyBarReader, \
+    BcolzDailyBarWriter, SQLiteAdjustmentReader, SQLiteAdjustmentWriter
+from zipline.utils import paths
+
+OHLCV = ['open', 'high', 'low', 'close', 'volume']
+DATE_COLUMNS = ('date', 'datetime', 'dt', 'timestamp')
+BAR_SUFFIXES = ('.csv', '.csv.gz', '.csv.bz2', '.parquet', '.pq')
+EXCHANGE = 'NYSE'
+DAILY_APPENDS = 'daily_appends'
+MINUTE_APPENDS = 'minute_appends'
+APPENDS_MANIFEST = 'appends.json'
+# Local bundles by name, for processes other than the one that ingested
+LOCAL_BUNDLES = os.environ.get(
+    'TRADINGSHELL_BUNDLES',
+    os.path.join(os.path.expanduser('~'), '.tradingshell', 'bundles.json'))
+
+# Set in every parsing process by _initParser
+_sessions = None
+_minutes = None
+
+
+def assetFiles(directory):
+    """Map the symbol of every bar file in directory to its path
+    """
+    files = {}
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return files
+    for name in names:
+        for suffix in BAR_SUFFIXES:
+            if name.lower().endswith(suffix):
+                files[name[:-len(suffix)].upper()] = \
+                    os.path.join(directory, name)
+                break
+    return files
+
+
+def readBars(path):
+    """Read one bar file into a frame indexed by UTC timestamps
+
+    Returns:
+        pd.DataFrame: Sorted, duplicate-free, lower-case columns
+    """
+    if path.lower().endswith(('.parquet', '.pq')):
+        frame = pd.read_parquet(path)
+        if isinstance(frame.index, pd.DatetimeIndex):
+            frame = frame.reset_index()
+    else:
+        frame = pd.read_csv(path)
+    frame.columns = [str(c).strip().lower() for c in frame.columns]
+
+    dateColumn = next((c for c in DATE_COLUMNS if c in frame.columns),
+                      frame.columns[0])
+    missing = [c for c in OHLCV if c not in frame.columns]
+    if missing:
+        raise ValueError('{} has no {} column'.format(
+            path, ', '.join(missing)))
+
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop(dateColumn),
+                                                  utc=True))
+    frame = frame[~frame.index.duplicated(keep='last')]
+    return frame.sort_index()
+
+
+def _initParser(sessions, minutes):
+    global _sessions, _minutes
+    _sessions = sessions
+    _minutes = minutes
+
+
+def _align(index, values, labels):
+    """Lay rows out on labels, the sorted int64 times they must cover
+
+    Rows at times outside labels are dropped; labels without a row get
+    zeros, which zipline reads as no data.
+    """
+    pos = np.searchsorted(labels, index)
+    keep = pos < len(labels)
+    keep[keep] = labels[pos[keep]] == index[keep]
+    if not keep.any():
+        return labels[:0], values[:0]
+    lo, hi = pos[keep][0], pos[keep][-1] + 1
+    aligned = np.zeros((hi - lo, values.shape[1]))
+    aligned[pos[keep] - lo] = values[keep]
+    return labels[lo:hi], aligned
+
+
+def parseDaily(path):
+    """Parse a daily bar file; executed in a worker process
+
+    Returns:
+        dict: Session labels, OHLCV rows aligned on them, dividends and
+              splits as (int64 ns, value) arrays, and the rows read
+    """
+    frame = readBars(path)
+    index = frame.index.normalize().values.astype('datetime64[ns]') \
+        .view('i8')
+    values = np.nan_to_num(frame[OHLCV].values.astype('f8'))
+    labels, bars = _align(index, values, _sessions)
+
+    events = {}
+    for column, neutral in (('dividend', 0.0), ('split', 1.0)):
+        if column in frame.columns:
+            amounts = frame[column].values.astype('f8')
+            hit = ~np.isnan(amounts) & (amounts != neutral)
+            events[column] = (index[hit], amounts[hit])
+        else:
+            events[column] = (index[:0], np.empty(0))
+
+    return {'labels': labels, 'bars': bars, 'rows': len(frame),
+            'dividends': events['dividend'], 'splits': events['split']}
+
+
+def parseMinute(path):
+    """Parse a minute bar file; executed in a worker process
+
+    Returns:
+        dict: Trading minutes, OHLCV rows aligned on them and the rows
+              read
+    """
+    frame = readBars(path)
+    index = frame.index.values.astype('datetime64[ns]').view('i8')
+    values = np.nan_to_num(frame[OHLCV].values.astype('f8'))
+    labels, bars = _align(index, values, _minutes)
+    # Minute bars are sparse, only keep the minutes that traded
+    traded = bars[:, 3] > 0
+    return {'labels': labels[traded], 'bars': bars[traded],
+            'rows': len(frame)}
+
+
+def parseAll(pool, parse, paths, window):
+    """Parse files on the pool, yielding results in order
+
+    At most window files are in flight, so parsed data does not pile up
+    when the writer is slower than the parsers.
+    """
+    pending = deque()
+    paths = iter(paths)
+    for path in paths:
+        pending.append(pool.submit(parse, path))
+        if len(pending) >= window:
+            break
+    while pending:
+        result = pending.popleft().result()
+        for path in paths:
+            pending.append(pool.submit(parse, path))
+            break
+        yield result
+
+
+class LocalIngester:
+    """Ingests a bundle directory, parsing files on a process pool
+
+    Parsing runs in parallel; zipline's bcolz writers take the parsed
+    assets one at a time, in sid order, as they come off the pool.
+
+    Args:
+        directory (str): The bundle directory
+        workers (int): Parsing processes, defaults to the usable cores
+        sids (dict): Sids of symbols already in the bundle; other symbols
+                     get new sids in sorted order
+    """
+    def __init__(self, directory, workers=None, sids=None):
+        self.directory = directory
+        self.workers = workers or len(os.sched_getaffinity(0))
+        self.daily = assetFiles(os.path.join(directory, 'daily'))
+        self.minute = assetFiles(os.path.join(directory, 'minute'))
+        self.symbols = sorted(set(self.daily) | set(self.minute))
+        if not self.symbols:
+            raise ValueError('no daily/ or minute/ bar files in {}'.format(
+                directory))
+        self.sids = dict(sids or {})
+        nextSid = max(self.sids.values(), default=-1) + 1
+        for symbol in self.symbols:
+            if symbol not in self.sids:
+                self.sids[symbol] = nextSid
+                nextSid += 1
+        self.names = {sid: symbol for symbol, sid in self.sids.items()}
+        self.spans = {}
+        self.splits = []
+        self.dividends = []
+        self.rows = {'daily': 0, 'minute': 0}
+        self.begin = time.perf_counter()
+
+    def ingest(self, asset_db_writer, minute_bar_writer, daily_bar_writer,
+               adjustment_writer, calendar, start_session, end_session,
+               show_progress=False):
+        """Write bars, assets and adjustments; the zipline ingest body
+
+        Returns:
+            dict: Assets, rows read per frequency, seconds and rows/s
+        """
+        with self._pool(calendar, start_session, end_session) as pool:
+            if self.daily:
+                daily_bar_writer.write(
+                    self._bars(pool, parseDaily, self.daily, 'daily'),
+                    show_progress=show_progress)
+            if self.minute:
+                minute_bar_writer.write(
+                    self._bars(pool, parseMinute, self.minute, 'minute'),
+                    show_progress=show_progress)
+
+        asset_db_writer.write(equities=self.metadata())
+        adjustment_writer.write(splits=self._adjustments(self.splits),
+                                dividends=self._adjustments(self.dividends))
+        return self.summary()
+
+    def append(self, path, segment, calendar, sessions, equities=(),
+               minutes_per_day=390):
+        """Write the bars after an existing ingestion as delta tables
+
+        Only rows on the candidate sessions are kept, and the delta ends
+        at the last session any file has data for. The daily delta holds
+        every known sid, zero-filled where a file has no rows, so daily
+        reads never miss a sid; the minute delta holds the sids that
+        traded.
+
+        Args:
+            path (str): The new ingestion directory
+            segment (int): Number of the delta, names its tables
+            calendar (TradingCalendar): The bundle's calendar
+            sessions (pd.DatetimeIndex): Sessions after the existing data
+            equities (list): Assets already in the bundle
+
+        Returns:
+            dict: The manifest entry of the delta, or None if no file has
+                  data on the candidate sessions
+        """
+        with self._pool(calendar, sessions[0], sessions[-1]) as pool:
+            daily = dict(self._parsed(pool, parseDaily, self.daily))
+            minute = dict(self._parsed(pool, parseMinute, self.minute))
+
+        ends = [r['labels'][-1] for r in daily.values() if len(r['labels'])]
+        ends += [calendar.minute_to_session_label(
+            pd.Timestamp(r['labels'][-1], tz='UTC')).value
+            for r in minute.values() if len(r['labels'])]
+        if not ends:
+            return None
+        labels = sessions.values.astype('datetime64[ns]').view('i8')
+        sessions = sessions[labels <= max(ends)]
+        first, last = sessions[0], sessions[-1]
+
+        entry = {
+            'start': str(first.date()),
+            'end': str(last.date()),
+            'daily': os.path.join(DAILY_APPENDS, '{}.bcolz'.format(segment)),
+            'minute': None,
+            'sids': sorted(self.names),
+            'minute_sids': [],
+        }
+        BcolzDailyBarWriter(os.path.join(path, entry['daily']), calendar,
+                            first, last).write(
+            self._padded(daily, sessions), show_progress=False)
+
+        close = calendar.session_close(last).value
+        traded = {sid: result for sid, result in minute.items()
+                  if len(result['labels']) and result['labels'][0] <= close}
+        if traded:
+            entry['minute'] = os.path.join(MINUTE_APPENDS,
+                                           '{}.bcolz'.format(segment))
+            entry['minute_sids'] = sorted(traded)
+            BcolzMinuteBarWriter(os.path.join(path, entry['minute']),
+                                 calendar, first, last,
+                                 minutes_per_day).write(
+                self._trimmed(traded, close), show_progress=False)
+
+        for equity in equities:
+            self._span(equity.sid, [equity.start_date.value,
+                                    equity.end_date.value])
+        return entry
+
+    def metadata(self, exchanges=None):
+        """The equities table for the asset db writer
+        """
+        exchanges = exchanges or {}
+        sids = sorted(self.spans)
+        first = [self.spans[sid][0] for sid in sids]
+        last = [self.spans[sid][1] for sid in sids]
+        return pd.DataFrame({
+            'symbol': [self.names[sid] for sid in sids],
+            'start_date': pd.to_datetime(first, utc=True),
+            'end_date': pd.to_datetime(last, utc=True),
+            'auto_close_date': pd.to_datetime(last, utc=True) +
+            pd.Timedelta(days=1),
+            'exchange': [exchanges.get(sid, EXCHANGE) for sid in sids],
+        }, index=pd.Index(sids, name='sid'))
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.begin
+        rows = self.rows['daily'] + self.rows['minute']
+        return {
+            'type': 'ingest',
+            'directory': self.directory,
+            'assets': len(self.spans),
+            'daily_rows': self.rows['daily'],
+            'minute_rows': self.rows['minute'],
+            'elapsed': elapsed,
+            'rows_per_second': rows / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _pool(self, calendar, start_session, end_session):
+        sessions = calendar.sessions_in_range(start_session, end_session)
+        sessions = sessions.values.astype('datetime64[ns]').view('i8')
+        minutes = None
+        if self.minute:
+            minutes = calendar.minutes_for_sessions_in_range(
+                start_session, end_session)
+            minutes = minutes.values.astype('datetime64[ns]').view('i8')
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   initializer=_initParser,
+                                   initargs=(sessions, minutes))
+
+    def _parsed(self, pool, parse, files):
+        """Yield (sid, parse result) of every file, in sid order
+        """
+        symbols = sorted(files, key=self.sids.get)
+        results = parseAll(pool, parse, [files[s] for s in symbols],
+                           2 * self.workers)
+        for symbol, result in zip(symbols, results):
+            yield self.sids[symbol], result
+
+    def _bars(self, pool, parse, files, frequency):
+        for sid, result in self._parsed(pool, parse, files):
+            if not len(result['labels']):
+                continue
+            self.rows[frequency] += result['rows']
+            self._span(sid, result['labels'])
+            if frequency == 'daily':
+                self._events(sid, result)
+            yield sid, pd.DataFrame(
+                result['bars'], columns=OHLCV,
+                index=pd.DatetimeIndex(result['labels'], tz='UTC'))
+
+    def _padded(self, results, sessions):
+        """Daily frames of every known sid over all of sessions
+        """
+        labels = sessions.values.astype('datetime64[ns]').view('i8')
+        for sid in sorted(self.names):
+            bars = np.zeros((len(labels), len(OHLCV)))
+            result = results.get(sid)
+            if result is not None and len(result['labels']):
+                keep = result['labels'] <= labels[-1]
+                bars[np.searchsorted(labels, result['labels'][keep])] = \
+                    result['bars'][keep]
+                self.rows['daily'] += int(keep.sum())
+                self._span(sid, result['labels'][keep])
+                self._events(sid, result, labels[0], labels[-1])
+            yield sid, pd.DataFrame(bars, columns=OHLCV, index=sessions)
+
+    def _trimmed(self, results, close):
+        for sid, result in sorted(results.items()):
+            keep = result['labels'] <= close
+            self.rows['minute'] += int(keep.sum())
+            self._span(sid, result['labels'][keep])
+            yield sid, pd.DataFrame(
+                result['bars'][keep], columns=OHLCV,
+                index=pd.DatetimeIndex(result['labels'][keep], tz='UTC'))
+
+    def _span(self, sid, labels):
+        day = 24 * 3600 * 10 ** 9
+        first, last = labels[0] // day * day, labels[-1] // day * day
+        if sid in self.spans:
+            first = min(first, self.spans[sid][0])
+            last = max(last, self.spans[sid][1])
+        self.spans[sid] = (first, last)
+
+    def _events(self, sid, result, first=None, last=None):
+        """Collect the dividends and splits of a result within [first, last]
+        """
+        def within(dates):
+            keep = np.ones(len(dates), dtype=bool)
+            if first is not None:
+                keep &= (dates >= first) & (dates <= last)
+            return keep
+
+        dates, amounts = result['dividends']
+        keep = within(dates)
+        if keep.any():
+            self.dividends.append(pd.DataFrame({
+                'sid': sid,
+                'amount': amounts[keep],
+                'ex_date': pd.to_datetime(dates[keep], utc=True),
+                'record_date': pd.NaT,
+                'declared_date': pd.NaT,
+                'pay_date': pd.NaT,
+            }))
+        dates, ratios = result['splits']
+        keep = within(dates)
+        if keep.any():
+            # zipline stores the price multiplier, the inverse of 2:1
+            self.splits.append(pd.DataFrame({
+                'sid': sid,
+                'ratio': 1.0 / ratios[keep],
+                'effective_date': pd.to_datetime(dates[keep], utc=True),
+            }))
+
+    @staticmethod
+    def _adjustments(frames):
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)
+
+
+def localBundle(directory, workers=None, report=None):
+    """Build a zipline ingest function for a bundle directory
+
+    Args:
+        directory (str): The bundle directory
+        workers (int): Parsing processes, defaults to the usable cores
+        report (callable): Called with the ingest summary, or None
+
+    Returns:
+        callable: To pass to zipline.data.bundles.register
+    """
+    def ingest(environ, asset_db_writer, minute_bar_writer,
+               daily_bar_writer, adjustment_writer, calendar, start_session,
+               end_session, cache, show_progress, output_dir):
+        summary = LocalIngester(directory, workers).ingest(
+            asset_db_writer, minute_bar_writer, daily_bar_writer,
+            adjustment_writer, calendar, start_session, end_session,
+            show_progress)
+        if report is not None:
+            report(summary)
+    return ingest
+
+
+def _readLocalBundles(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def registerLocalBundle(name, directory, calendar_name='XNYS', workers=None,
+                        report=None, path=LOCAL_BUNDLES):
+    """Register a bundle directory with zipline and remember it
+
+    zipline only knows the bundles registered in the current process;
+    the name, directory and calendar are also saved to path so that
+    registerLocalBundles() brings the bundle back in later processes.
+
+    Args:
+        name (str): The bundle name
+        directory (str): The bundle directory
+        calendar_name (str): Trading calendar of the bars
+        workers (int): Parsing processes, defaults to the usable cores
+        report (callable): Called with the ingest summary, or None
+        path (str): The JSON file local bundles are saved to
+    """
+    directory = os.path.abspath(directory)
+    if name in bundles.bundles:
+        bundles.unregister(name)
+    bundles.register(name, localBundle(directory, workers, report),
+                     calendar_name=calendar_name)
+
+    saved = _readLocalBundles(path)
+    saved[name] = {'directory': directory, 'calendar': calendar_name}
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    fd, tmppath = tempfile.mkstemp(dir=parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(saved, f, indent=2)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+def registerLocalBundles(path=LOCAL_BUNDLES):
+    """Register the local bundles saved by registerLocalBundle()
+
+    Run at the start of every process that may load them: the shell and
+    the job workers. Bundles already registered are left alone.
+
+    Returns:
+        list: The names registered
+    """
+    names = []
+    for name, entry in _readLocalBundles(path).items():
+        if name in bundles.bundles:
+            continue
+        bundles.register(name, localBundle(entry['directory']),
+                         calendar_name=entry['calendar'])
+        names.append(name)
+    return names
+
+
+# sids is None for a segment holding every asset
+Segment = namedtuple('Segment', 'reader sids first last')
+
+
+class AppendedBarReader:
+    """Bar reader of an ingestion followed by appended delta tables
+
+    Every segment covers a range of the calendar; reads are split on the
+    segment bounds and each part served by the segment owning it, so
+    delta tables stack on the base ingestion without rewriting it.
+    Assets a segment does not hold read as no data there.
+
+    Args:
+        segments (list): Segments, ordered by time, base ingestion first
+        calendar (TradingCalendar): The bundle's calendar
+        minutes (bool): Whether the segments hold minute bars
+    """
+    def __init__(self, segments, calendar, minutes=False):
+        self.segments = segments
+        self.calendar = calendar
+        self.minutes = minutes
+        self.base = segments[0].reader
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    @property
+    def trading_calendar(self):
+        return self.calendar
+
+    @property
+    def first_trading_day(self):
+        return self.base.first_trading_day
+
+    @property
+    def last_available_dt(self):
+        return max(self.base.last_available_dt, self.segments[-1].last)
+
+    @property
+    def sessions(self):
+        return self.calendar.sessions_in_range(self.first_trading_day,
+                                               self.last_available_dt)
+
+    def _range(self, start, end):
+        if self.minutes:
+            return self.calendar.minutes_in_range(start, end)
+        return self.calendar.sessions_in_range(start, end)
+
+    def load_raw_arrays(self, columns, start_date, end_date, assets):
+        """OHLCV arrays of assets over [start_date, end_date]
+
+        Returns:
+            list: One (dates, assets) array per column
+        """
+        dates = self._range(start_date, end_date)
+        sids = [int(asset) for asset in assets]
+        out = [np.zeros((len(dates), len(sids))) if column == 'volume'
+               else np.full((len(dates), len(sids)), np.nan)
+               for column in columns]
+        for segment in self.segments:
+            lo = max(start_date, segment.first)
+            hi = min(end_date, segment.last)
+            if lo > hi:
+                continue
+            cols = [i for i, sid in enumerate(sids)
+                    if segment.sids is None or sid in segment.sids]
+            if not cols:
+                continue
+            rows = dates.searchsorted(lo)
+            arrays = segment.reader.load_raw_arrays(
+                columns, lo, hi, [assets[i] for i in cols])
+            for array, part in zip(out, arrays):
+                array[rows:rows + len(part), cols] = part
+        return out
+
+    def _segmentAt(self, sid, dt):
+        for segment in reversed(self.segments):
+            if segment.first <= dt <= segment.last:
+                if segment.sids is None or sid in segment.sids:
+                    return segment
+                return None
+        return self.segments[0]
+
+    def get_value(self, sid, dt, field):
+        segment = self._segmentAt(int(sid), dt)
+        if segment is None:
+            return 0 if field == 'volume' else np.nan
+        return segment.reader.get_value(sid, dt, field)
+
+    def get_last_traded_dt(self, asset, dt):
+        for segment in reversed(self.segments):
+            if segment.first > dt:
+                continue
+            if segment.sids is not None and int(asset) not in segment.sids:
+                continue
+            traded = segment.reader.get_last_traded_dt(
+                asset, min(dt, segment.last))
+            if traded is not pd.NaT:
+                return traded
+        return pd.NaT
+
+
+def _readManifest(path):
+    try:
+        with open(os.path.join(path, APPENDS_MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _appendedReaders(path, manifest, daily, minute, calendar):
+    """Stack the delta tables of a manifest on an ingestion's readers
+    """
+    def session(day):
+        return pd.Timestamp(day, tz='UTC')
+
+    baseEnd = session(manifest['base_end'])
+    dailySegments = [Segment(daily, None, daily.first_trading_day, baseEnd)]
+    minuteSegments = [Segment(
+        minute, None, calendar.session_open(minute.first_trading_day),
+        calendar.session_close(baseEnd))]
+    for entry in manifest['segments']:
+        first, last = session(entry['start']), session(entry['end'])
+        dailySegments.append(Segment(
+            BcolzDailyBarReader(os.path.join(path, entry['daily'])),
+            frozenset(entry['sids']), first, last))
+        if entry['minute']:
+            minuteSegments.append(Segment(
+                BcolzMinuteBarReader(os.path.join(path, entry['minute'])),
+                frozenset(entry['minute_sids']),
+                calendar.session_open(first), calendar.session_close(last)))
+    return (AppendedBarReader(dailySegments, calendar),
+            AppendedBarReader(minuteSegments, calendar, minutes=True))
+
+
+def loadBundle(bundle, calendar, environ=os.environ, timestamp=None):
+    """zipline.data.bundles.load, aware of appended delta tables
+
+    zipline's load always opens the most recent ingestion; this one
+    opens the ingestion of timestamp, the most recent if None.
+
+    Raises:
+        ValueError: The bundle has no ingestion
+
+    Returns:
+        BundleData: With the bar readers of an appended ingestion
+                    replaced by AppendedBarReaders
+    """
+    if timestamp is None:
+        ingestions = bundles.ingestions_for_bundle(bundle, environ)
+        if not ingestions:
+            raise ValueError('no data for bundle {!r}, run ingest first'
+                             .format(bundle))
+        timestamp = ingestions[0]
+    core = bundles.core
+    timestr = core.to_bundle_ingest_dirname(timestamp)
+    data = core.BundleData(
+        asset_finder=AssetFinder(
+            core.asset_db_path(bundle, timestr, environ=environ)),
+        equity_minute_bar_reader=BcolzMinuteBarReader(
+            core.minute_equity_path(bundle, timestr, environ=environ)),
+        equity_daily_bar_reader=BcolzDailyBarReader(
+            core.daily_equity_path(bundle, timestr, environ=environ)),
+        adjustment_reader=SQLiteAdjustmentReader(
+            core.adjustment_db_path(bundle, timestr, environ=environ)),
+    )
+    path = paths.data_path([bundle, timestr], environ=environ)
+    manifest = _readManifest(path)
+    if manifest is None:
+        return data
+    daily, minute = _appendedReaders(path, manifest,
+                                     data.equity_daily_bar_reader,
+                                     data.equity_minute_bar_reader, calendar)
+    return data._replace(equity_daily_bar_reader=daily,
+                         equity_minute_bar_reader=minute)
+
+
+def linkIngestion(src, dst):
+    """Lay out a new ingestion directory sharing the bar files of src
+
+    Bar tables are never written in place, so they are hard linked (or
+    copied across filesystems); the SQLite databases and the manifest
+    are modified by an append and so are copied.
+    """
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            source = os.path.join(root, name)
+            if name.endswith('.sqlite') or name == APPENDS_MANIFEST:
+                shutil.copy2(source, os.path.join(target, name))
+                continue
+            try:
+                os.link(source, os.path.join(target, name))
+            except OSError:
+                shutil.copy2(source, os.path.join(target, name))
+
+
+def appendBundle(bundle, directory, calendar_name='XNYS',
+                 environ=os.environ, workers=None):
+    """Append the new sessions of a bundle directory to its last ingestion
+
+    The new ingestion shares the bar tables of the previous one and adds
+    delta tables for the sessions after it, plus the new adjustments and
+    assets. It is built in a hidden directory and renamed into place, so
+    loaders see either the previous ingestion or the complete new one;
+    engines already holding the previous ingestion keep reading it.
+
+    Args:
+        bundle (str): A bundle ingested from directory
+        directory (str): The bundle directory, with the new rows
+        calendar_name (str): Trading calendar of the bars
+        workers (int): Parsing processes, defaults to the usable cores
+
+    Returns:
+        dict: The ingest summary, with the appended range; None if no
+              file has rows after the previous ingestion
+    """
+    ingestions = bundles.ingestions_for_bundle(bundle, environ)
+    if not ingestions:
+        raise ValueError('no data for bundle {!r}, run ingest first'
+                         .format(bundle))
+    calendar = get_calendar(calendar_name)
+    previous = bundles.core.to_bundle_ingest_dirname(ingestions[0])
+    src = paths.data_path([bundle, previous], environ=environ)
+    data = loadBundle(bundle, calendar, environ, ingestions[0])
+    finder = data.asset_finder
+    equities = finder.retrieve_all(finder.sids)
+
+    manifest = _readManifest(src) or {'segments': []}
+    lastDay = max(equity.end_date for equity in equities).normalize()
+    manifest.setdefault('base_end', str(lastDay.date()))
+    sessions = calendar.sessions_in_range(
+        lastDay + pd.Timedelta(days=1),
+        min(pd.Timestamp.utcnow().normalize(), calendar.last_session))
+    if not len(sessions):
+        return None
+
+    ingester = LocalIngester(
+        directory, workers, {equity.symbol: equity.sid for equity in equities})
+    timestamp = pd.Timestamp.utcnow()
+    timestr = bundles.core.to_bundle_ingest_dirname(timestamp)
+    dst = paths.data_path([bundle, timestr], environ=environ)
+    tmp = paths.data_path([bundle, '.append-' + timestr], environ=environ)
+    try:
+        linkIngestion(src, tmp)
+        entry = ingester.append(tmp, len(manifest['segments']), calendar,
+                                sessions, equities)
+        if entry is None:
+            shutil.rmtree(tmp)
+            return None
+        manifest['segments'].append(entry)
+
+        assetDb = bundles.core.asset_db_path(bundle, timestr, environ=environ)
+        assetDb = os.path.join(tmp, os.path.basename(assetDb))
+        if os.path.exists(assetDb):
+            os.remove(assetDb)
+        AssetDBWriter(assetDb).write(equities=ingester.metadata(
+            {equity.sid: equity.exchange for equity in equities}))
+
+        daily, _ = _appendedReaders(
+            tmp, manifest, data.equity_daily_bar_reader,
+            data.equity_minute_bar_reader, calendar)
+        adjustments = os.path.join(tmp, os.path.basename(
+            bundles.core.adjustment_db_path(bundle, timestr,
+                                            environ=environ)))
+        SQLiteAdjustmentWriter(adjustments, daily, calendar.all_sessions,
+                               overwrite=False).write(
+            splits=ingester._adjustments(ingester.splits),
+            dividends=ingester._adjustments(ingester.dividends))
+
+        with open(os.path.join(tmp, APPENDS_MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp, dst)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    summary = ingester.summary()
+    summary.update({'append': True, 'start': entry['start'],
+                    'end': entry['end']})
+    return summary
@@ -0,0 +1,413 @@
+"""Backtest jobs scheduled on a pool of worker processes
+"""
+import contextlib
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+import time
+import traceback
+import numpy as np
+from zipline.utils.cli import Date
+from backtest import ZiplineRunThread
+from engine import getEngine
+from ingest import registerLocalBundles
+from records import PORTFOLIO_DTYPE, portfolioRecord
+from vectorized import VectorEngine
+
+DEFAULT_WORKERS = int(os.environ.get('TRADINGSHELL_WORKERS', 0)) or None
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Priority of runs the shell is waiting on
+INTERACTIVE_PRIORITY = 100
+
+_vectorEngines = {}
+# Workers are started from slot threads while the shell has pipelines
+# open; a forked worker would keep the write end of every one of them
+_context = multiprocessing.get_context('forkserver')
+
+
+def runBacktest(engine, code, start, end, capital_base=100000,
+                data_frequency='daily', sample='bar', bundle='quandl'):
+    """Run one backtest to completion; the function jobs execute
+
+    Returns:
+        np.ndarray: The PORTFOLIO_DTYPE records the run emitted
+    """
+    if engine == 'numpy':
+        if bundle not in _vectorEngines:
+            _vectorEngines[bundle] = VectorEngine(getEngine(bundle))
+        parse = Date(tz='utc', as_timestamp=True).parser
+        records, _ = _vectorEngines[bundle].run(code, parse(start),
+                                                parse(end), capital_base)
+        return records
+
+    records = []
+    ziplineTh = ZiplineRunThread(
+        code, start, end, capital_base,
+        lambda update: records.append(portfolioRecord(*update)),
+        engine=getEngine(bundle), data_frequency=data_frequency,
+        sample=sample)
+    # Already in a worker process, so simulate right here
+    ziplineTh.run()
+    return np.array(records, dtype=PORTFOLIO_DTYPE)
+
+
+def applyLimits(cpuTime=None, memory=None, cpus=None):
+    """Restrict the calling process for the duration of one job
+
+    The CPU limit counts from the time the process has used so far, so
+    a long-lived worker gives every job the same budget. Going over it
+    kills the process with SIGXCPU; going over the memory limit makes
+    allocations fail with MemoryError.
+
+    Args:
+        cpuTime (float): CPU seconds the job may use
+        memory (int): Bytes of address space the process may hold
+        cpus (set): CPUs the process may run on
+
+    Returns:
+        callable: Restores the previous limits
+    """
+    saved = []
+    if cpus:
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        saved.append(lambda: os.sched_setaffinity(0, previous))
+
+    for limit, value in ((resource.RLIMIT_CPU, cpuTime),
+                         (resource.RLIMIT_AS, memory)):
+        if not value:
+            continue
+        soft, hard = resource.getrlimit(limit)
+        if limit == resource.RLIMIT_CPU:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            value = math.ceil(usage.ru_utime + usage.ru_stime + value)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit, (int(value), hard))
+        saved.append(lambda limit=limit, soft=soft, hard=hard:
+                     resource.setrlimit(limit, (soft, hard)))
+
+    def restore():
+        for undo in reversed(saved):
+            undo()
+    return restore
+
+
+def workerMain(conn):
+    """Loop of a worker process: run jobs until told to stop
+    """
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args, cpuTime, memory, cpus = task
+        restore = applyLimits(cpuTime, memory, cpus)
+        try:
+            # Workers start from a fresh interpreter, which only knows
+            # zipline's own bundles; pick up those ingested since too
+            registerLocalBundles()
+            conn.send((DONE, func(*args)))
+        except Exception:
+            conn.send((FAILED, traceback.format_exc()))
+        finally:
+            restore()
+
+
+class Worker:
+    """One long-lived worker process and the pipe to it
+    """
+    def __init__(self):
+        self.conn, child = _context.Pipe()
+        self.process = _context.Process(target=workerMain, args=(child,),
+                                        daemon=True)
+        self.process.start()
+        child.close()
+
+    def run(self, job):
+        """Run a job in the process and wait for it
+
+        Returns:
+            tuple: (DONE, result) or (FAILED, error message)
+        """
+        task = (job.func, job.args, job.cpuTime, job.memory, job.cpus)
+        try:
+            self.conn.send(task)
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join()
+            if self.process.exitcode == -signal.SIGXCPU:
+                return FAILED, 'CPU time limit exceeded'
+            return FAILED, 'worker exited with code {}'.format(
+                self.process.exitcode)
+        except Exception:
+            # The task could not be pickled; the worker never saw it
+            return FAILED, traceback.format_exc()
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        self.process.kill()
+
+    def stop(self, timeout=1.0):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class Job:
+    """A unit of work submitted to a JobScheduler
+
+    Args:
+        id (int): Assigned by the scheduler
+        func (callable): Picklable function run in a worker, None for a
+                         lease
+        args (tuple): Its arguments
+        priority (int): Higher runs first; FIFO among equal priorities
+        name (str): Shown by status()
+        cpuTime (float): CPU seconds limit, or None
+        memory (int): Address space limit in bytes, or None
+        cpus (set): CPU affinity, or None for the worker's default
+    """
+    def __init__(self, id, func, args=(), priority=0, name=None,
+                 cpuTime=None, memory=None, cpus=None):
+        self.id = id
+        self.func = func
+        self.args = tuple(args)
+        self.priority = priority
+        self.name = name or getattr(func, '__name__', repr(func))
+        self.cpuTime = cpuTime
+        self.memory = memory
+        self.cpus = set(cpus) if cpus else None
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.worker = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def status(self):
+        now = time.time()
+        return {
+            'job': self.id,
+            'name': self.name,
+            'state': self.state,
+            'priority': self.priority,
+            'queued': (self.started or self.finished or now) -
+            self.submitted,
+            'elapsed': (self.finished or now) - self.started
+            if self.started else 0.0,
+        }
+
+
+class JobScheduler:
+    """Runs jobs by priority on a fixed number of worker processes
+
+    Every slot of the pool is a thread owning one worker process, which
+    is reused from job to job so bundle data a job loads stays warm for
+    the next. A slot takes the highest priority queued job, sends it to
+    its worker and waits. Cancelling a running job kills its worker; the
+    slot starts a fresh one for its next job.
+
+    Work the shell runs in its own process takes a slot with lease(), so
+    interactive runs, sweeps and walk-forwards all share the one budget
+    of workers with the queued jobs.
+
+    Args:
+        workers (int): Pool size, defaults to the usable cores
+    """
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.size = workers or len(os.sched_getaffinity(0))
+        self.jobs = {}
+        self.queue = []
+        self.ids = itertools.count(1)
+        self.order = itertools.count()
+        self.closed = False
+        self.cond = threading.Condition()
+        self.slots = [threading.Thread(target=self._slotLoop, daemon=True)
+                      for _ in range(self.size)]
+        for slot in self.slots:
+            slot.start()
+
+    def submit(self, func, args=(), priority=0, name=None, cpuTime=None,
+               memory=None, cpus=None):
+        """Queue a job
+
+        Returns:
+            Job: The queued job
+        """
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('scheduler is closed')
+            job = Job(next(self.ids), func, args, priority, name, cpuTime,
+                      memory, cpus)
+            self.jobs[job.id] = job
+            heapq.heappush(self.queue, (-priority, next(self.order), job))
+            # Slots, leases and completed() all wait on the condition
+            self.cond.notify_all()
+            return job
+
+    @contextlib.contextmanager
+    def lease(self, priority=INTERACTIVE_PRIORITY, name='interactive'):
+        """Hold a slot for work the caller runs in its own process
+
+        The lease is queued like a job and blocks until a slot takes it;
+        the slot then runs nothing else until the with block exits.
+
+        Raises:
+            RuntimeError: The lease was cancelled before it got a slot
+        """
+        job = self.submit(None, priority=priority, name=name)
+        with self.cond:
+            while job.state == QUEUED:
+                self.cond.wait()
+            if job.state != RUNNING:
+                raise RuntimeError('job {} was {}'.format(job.id, job.state))
+        try:
+            yield job
+        finally:
+            with self.cond:
+                self._finish(job, DONE)
+
+    def completed(self, jobs):
+        """Yield jobs as they are done, failed or cancelled
+        """
+        pending = list(jobs)
+        while pending:
+            with self.cond:
+                while all(not job.done.is_set() for job in pending):
+                    self.cond.wait()
+                done = [job for job in pending if job.done.is_set()]
+                pending = [job for job in pending if not job.done.is_set()]
+            yield from done
+
+    def get(self, id):
+        """Look up a job
+
+        Raises:
+            KeyError: No such job
+        """
+        with self.cond:
+            return self.jobs[id]
+
+    def list(self):
+        with self.cond:
+            return list(self.jobs.values())
+
+    def wait(self, id, timeout=None):
+        """Block until a job is done, failed or cancelled
+
+        Raises:
+            TimeoutError: The job is still queued or running
+        """
+        job = self.get(id)
+        if not job.done.wait(timeout):
+            raise TimeoutError('job {} is still {}'.format(id, job.state))
+        return job
+
+    def cancel(self, id):
+        """Cancel a queued or running job
+
+        Returns:
+            bool: False if the job had already finished
+        """
+        with self.cond:
+            job = self.jobs[id]
+            if job.state == QUEUED:
+                # Slots skip it when it comes off the queue
+                self._finish(job, CANCELLED)
+                return True
+            if job.state == RUNNING and job.func is None:
+                # A lease runs in the caller, which has to stop it
+                return False
+            if job.state == RUNNING:
+                job.state = CANCELLED
+                if job.worker is not None:
+                    job.worker.kill()
+                return True
+            return False
+
+    def close(self):
+        """Cancel whatever is queued or running and stop the workers
+        """
+        with self.cond:
+            self.closed = True
+            ids = list(self.jobs)
+            self.cond.notify_all()
+        for id in ids:
+            self.cancel(id)
+        for slot in self.slots:
+            slot.join()
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job.worker = None
+        job.finished = time.time()
+        job.done.set()
+        self.cond.notify_all()
+
+    def _slotLoop(self):
+        worker = None
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    break
+                _, _, job = heapq.heappop(self.queue)
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+                if job.func is None:
+                    # A lease: the slot is the holder's until it lets go
+                    self.cond.notify_all()
+                    while not job.done.is_set() and not self.closed:
+                        self.cond.wait()
+                    continue
+
+            if worker is None or not worker.alive():
+                worker = Worker()
+            with self.cond:
+                if job.state == CANCELLED:
+                    self._finish(job, CANCELLED)
+                    continue
+                job.worker = worker
+
+            state, value = worker.run(job)
+            with self.cond:
+                if job.state == CANCELLED:
+                    self._finish(job, CANCELLED)
+                elif state == DONE:
+                    self._finish(job, DONE, result=value)
+                else:
+                    self._finish(job, FAILED, error=value)
+            if not worker.alive():
+                worker = None
+
+        if worker is not None:
+            worker.stop()
@@ -0,0 +1,188 @@
+"""Always-on latency histograms of running backtests
+"""
+import functools
+import json
+import threading
+import time
+from base import MsgType
+
+# Values below 2 ** SUB_BUCKET_BITS ns are counted exactly; larger ones
+# keep SUB_BUCKET_BITS - 1 significant bits, i.e. a relative error
+# under 2 ** (1 - SUB_BUCKET_BITS)
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BUCKETS = SUB_BUCKETS >> 1
+BUCKETS = SUB_BUCKETS + 64 * HALF_BUCKETS
+
+
+def bucketOf(ns):
+    """Index of the histogram bucket counting a value in nanoseconds
+    """
+    if ns < SUB_BUCKETS:
+        return max(ns, 0)
+    shift = ns.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + \
+        (ns >> shift) - HALF_BUCKETS
+
+
+def bucketTop(index):
+    """Highest value counted by a bucket
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub = divmod(index - SUB_BUCKETS, HALF_BUCKETS)
+    shift += 1
+    return ((sub + HALF_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """HDR-style histogram of latencies in nanoseconds
+
+    Buckets are exact up to SUB_BUCKETS ns and log-linear above, so
+    recording is a few integer operations and the memory is fixed no
+    matter how many values or how wide their range.
+    """
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        self.counts[bucketOf(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Value at or below which q percent of the recorded values lie
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucketTop(i), self.max)
+        return self.max
+
+    def summary(self):
+        """count, mean, p50, p99 and max, in microseconds
+        """
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count / 1e3 if self.count else 0.0,
+            'p50_us': self.percentile(50) / 1e3,
+            'p99_us': self.percentile(99) / 1e3,
+            'max_us': self.max / 1e3,
+        }
+
+
+class LatencyStats:
+    """Named latency histograms of one run
+
+    Values go to interval histograms that snapshot() hands out and folds
+    into the run totals, so every report covers the time since the
+    previous one and the last can cover the whole run.
+
+    wrap() has the interface of profiling.CallbackTimer, so the same
+    object can time the algorithm's callbacks.
+    """
+    def __init__(self):
+        self.interval = {}
+        self.total = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, ns):
+        with self.lock:
+            hist = self.interval.get(name)
+            if hist is None:
+                hist = self.interval[name] = LatencyHistogram()
+            hist.record(ns)
+
+    def wrap(self, name, func):
+        """Return func, its latency recorded under name; None stays None
+        """
+        if func is None:
+            return None
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter_ns() - t0)
+        return timed
+
+    def snapshot(self, total=False):
+        """Summaries of the histograms since the previous snapshot
+
+        Args:
+            total (bool): Summarize the whole run instead
+
+        Returns:
+            dict: LatencyHistogram.summary() by name
+        """
+        with self.lock:
+            interval, self.interval = self.interval, {}
+            for name, hist in interval.items():
+                if name in self.total:
+                    self.total[name].merge(hist)
+                else:
+                    self.total[name] = hist
+            hists = self.total if total else interval
+            return {name: hist.summary()
+                    for name, hist in sorted(hists.items())}
+
+
+class StatsReporter:
+    """Writes the latency stats of a run as periodic STATS frames
+
+    Every interval seconds a frame with the histograms of that interval
+    is written; close() writes a last one marked final with the totals
+    of the whole run.
+
+    Args:
+        writer (base.FrameWriter): Where the frames go
+        stats (LatencyStats): What to report
+        interval (float): Seconds between frames
+    """
+    def __init__(self, writer, stats, interval=5.0):
+        self.writer = writer
+        self.stats = stats
+        self.interval = interval
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._reportLoop, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self._write(self.stats.snapshot(total=True), final=True)
+
+    def _write(self, histograms, final=False):
+        payload = json.dumps({
+            'type': 'latency',
+            'final': final,
+            'elapsed': time.monotonic() - self.started,
+            'histograms': histograms,
+        }).encode('utf8')
+        self.writer.write(payload, MsgType.STATS)
+
+    def _reportLoop(self):
+        while not self.stopped.wait(self.interval):
+            histograms = self.stats.snapshot()
+            if histograms:
+                self._write(histograms)
@@ -0,0 +1,350 @@
+"""Memory-mapped daily price history of a bundle ingestion
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+DEFAULT_STORE_DIR = os.environ.get(
+    'TRADINGSHELL_PRICES',
+    os.path.join(os.path.expanduser('~'), '.tradingshell', 'prices'))
+DEFAULT_WINDOW_CACHE_BYTES = 256 << 20
+# Stores written by other versions are rebuilt
+STORE_VERSION = 2
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+STORE_FIELDS = BAR_FIELDS + ('price',)
+# Stores of other ingestions are deleted once unused this many seconds
+STORE_RETENTION = 7 * 24 * 3600
+# Assets read from the bar reader at a time while building
+BUILD_CHUNK = 256
+# Adjustment tables of a bundle and whether they also scale volume
+ADJUSTMENT_TABLES = (('splits', True), ('mergers', False),
+                     ('dividends', False))
+
+
+def ffill(values):
+    """Forward fill the NaNs of every column of a 2-d array
+    """
+    rows = np.where(np.isnan(values), 0,
+                    np.arange(len(values))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])]
+
+
+def readAdjustments(reader, labels, columns):
+    """Splits, mergers and dividends of a bundle, located in a store
+
+    Args:
+        reader (SQLiteAdjustmentReader): The bundle's adjustments, or None
+        labels (np.ndarray): The store's sessions as int64 ns
+        columns (dict): The store's column of every sid
+
+    Returns:
+        list: (row, column, ratio, scales volume) of every adjustment,
+              row being the effective session
+    """
+    entries = []
+    for table, volume in ADJUSTMENT_TABLES if reader is not None else ():
+        query = 'SELECT sid, effective_date, ratio FROM {}'.format(table)
+        for sid, effective, ratio in reader.conn.execute(query):
+            column = columns.get(sid)
+            # Effective dates are stored in seconds
+            row = np.searchsorted(labels, effective * 10 ** 9)
+            if column is not None and 0 < row < len(labels):
+                entries.append((row, column, ratio, volume))
+    return entries
+
+
+def adjustmentFactors(entries, rows, columns, volume=False):
+    """Product of the adjustments effective after each row
+
+    Scaling a bar by the factor of its row adjusts it as of the last
+    session; dividing by the factor of a later row r takes back the
+    adjustments after r, leaving the bar adjusted as of r.
+
+    Args:
+        entries (list): From readAdjustments()
+        rows (int): Rows of the factors
+        columns (range): Store columns of the factors
+        volume (bool): Factors of volumes, the inverse split ratios
+
+    Returns:
+        np.ndarray: rows x columns factors
+    """
+    ratios = np.ones((rows, len(columns)))
+    for row, column, ratio, scalesVolume in entries:
+        if column not in columns:
+            continue
+        if volume:
+            if not scalesVolume:
+                continue
+            ratio = 1.0 / ratio
+        ratios[row - 1, column - columns.start] *= ratio
+    return np.cumprod(ratios[::-1], axis=0)[::-1]
+
+
+def mapped(values):
+    """Whether an array is a view of a mapped file
+    """
+    while isinstance(values, np.ndarray):
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+def prune(parent, keep, retention=STORE_RETENTION):
+    """Delete the stores in parent unused for retention seconds
+
+    Args:
+        parent (str): Directory of the stores of a bundle
+        keep (str): Directory name of the store to keep whatever its age
+    """
+    if not os.path.isdir(parent):
+        return
+    cutoff = time.time() - retention
+    for entry in os.scandir(parent):
+        if entry.is_dir() and not entry.name.startswith('.') and \
+                entry.name != keep and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class PriceStore:
+    """Date x asset arrays of a bundle's daily bars, memory-mapped
+
+    Every field is one C-ordered .npy file of sessions by assets holding
+    the bars adjusted as of the last session; 'price' is adjusted close,
+    forward-filled. Next to them are the adjustment factors of prices
+    and volumes, so a window as of an earlier session is the adjusted
+    rows divided by the factors of that session. Rows and columns are
+    looked up in dicts built when the store is opened.
+
+    The files are mapped copy-on-write, and every window that is a view
+    of them is a mapping of its own rows: reading it copies nothing,
+    while writing it, like an algorithm editing its history window in
+    place, only changes that window and never the files or the other
+    windows. Everything is opened once, up front, so an open store keeps
+    working after its directory is deleted.
+
+    Args:
+        root (str): Directory written by build()
+    """
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'meta.json')) as f:
+            self.sids = json.load(f)['sids']
+        labels = np.load(os.path.join(root, 'sessions.npy'))
+        self.sessions = pd.to_datetime(labels, utc=True)
+        self.rows = {label: i for i, label in enumerate(labels.tolist())}
+        self.columns = {sid: j for j, sid in enumerate(self.sids)}
+        self.arrays = {field: self._map(field) for field in STORE_FIELDS}
+        self.factors = {kind: self._map(kind + '_factor')
+                        for kind in ('price', 'volume')}
+        # Windows are mapped from these, not reopened by path
+        self.files = {field: open(os.path.join(root, field + '.npy'), 'rb')
+                      for field in STORE_FIELDS}
+
+    def _map(self, name):
+        return np.load(os.path.join(self.root, name + '.npy'), mmap_mode='c')
+
+    def _rows(self, field, first, count):
+        """A private copy-on-write mapping of count rows of a field
+        """
+        array = self.arrays[field]
+        return np.memmap(self.files[field], dtype=array.dtype, mode='c',
+                         offset=array.offset + first * array.strides[0],
+                         shape=(count,) + array.shape[1:])
+
+    @classmethod
+    def build(cls, root, reader, sessions, sids, adjustments=None,
+              chunk=BUILD_CHUNK):
+        """Write the store of a daily bar reader and open it
+
+        The files are written to a temporary directory renamed to root
+        when complete, so a store is never seen half-built.
+
+        Args:
+            root (str): Directory of the store
+            reader (BcolzDailyBarReader): Source of the bars
+            sessions (pd.DatetimeIndex): Sessions the store covers
+            sids (list): Assets the store covers
+            adjustments (SQLiteAdjustmentReader): The bundle's adjustments
+            chunk (int): Assets read from the reader at a time
+        """
+        parent = os.path.dirname(root)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.build-')
+        labels = sessions.values.astype('datetime64[ns]').view('i8')
+        entries = readAdjustments(adjustments, labels,
+                                  {sid: j for j, sid in enumerate(sids)})
+        try:
+            shape = (len(sessions), len(sids))
+            arrays = {name: np.lib.format.open_memmap(
+                os.path.join(tmp, name + '.npy'), mode='w+', dtype='f8',
+                shape=shape)
+                for name in STORE_FIELDS + ('price_factor', 'volume_factor')}
+            for lo in range(0, len(sids), chunk):
+                part = sids[lo:lo + chunk]
+                columns = range(lo, lo + len(part))
+                bars = reader.load_raw_arrays(list(BAR_FIELDS), sessions[0],
+                                              sessions[-1], part)
+                prices = adjustmentFactors(entries, len(sessions), columns)
+                volumes = adjustmentFactors(entries, len(sessions), columns,
+                                            volume=True)
+                arrays['price_factor'][:, lo:lo + len(part)] = prices
+                arrays['volume_factor'][:, lo:lo + len(part)] = volumes
+                for field, values in zip(BAR_FIELDS, bars):
+                    factors = volumes if field == 'volume' else prices
+                    arrays[field][:, lo:lo + len(part)] = values * factors
+                arrays['price'][:, lo:lo + len(part)] = \
+                    ffill(np.asarray(bars[3], dtype='f8') * prices)
+            for array in arrays.values():
+                array.flush()
+            del arrays
+
+            np.save(os.path.join(tmp, 'sessions.npy'), labels)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'version': STORE_VERSION,
+                           'sids': [int(sid) for sid in sids]}, f)
+            os.rename(tmp, root)
+        except OSError:
+            # Built concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(root):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return cls(root)
+
+    @classmethod
+    def open(cls, root, reader, sessions, sids, adjustments=None):
+        """Open the store at root, building it first if needed
+
+        A store at root written by another version is rebuilt. Opening a
+        store marks it used; stores of other ingestions next to root are
+        deleted once unused for STORE_RETENTION seconds, as runs still on
+        an older ingestion may have yet to open its store.
+        """
+        prune(os.path.dirname(root), os.path.basename(root))
+        try:
+            with open(os.path.join(root, 'meta.json')) as f:
+                current = json.load(f).get('version') == STORE_VERSION
+            if current:
+                os.utime(root)
+                return cls(root)
+            shutil.rmtree(root, ignore_errors=True)
+        except FileNotFoundError:
+            # Never built, or pruned by another process meanwhile
+            pass
+        return cls.build(root, reader, sessions, sids, adjustments)
+
+    def locate(self, session):
+        """Row of a session, or None if the store does not cover it
+        """
+        return self.rows.get(pd.Timestamp(session).value)
+
+    def columnsOf(self, sids):
+        """Columns of sids, or None if the store lacks any of them
+        """
+        try:
+            return [self.columns[int(sid)] for sid in sids]
+        except KeyError:
+            return None
+
+    def _select(self, array, columns):
+        if columns is None:
+            return array
+        if columns and columns[-1] - columns[0] == len(columns) - 1 and \
+                columns == list(range(columns[0], columns[-1] + 1)):
+            return array[..., columns[0]:columns[-1] + 1]
+        return array[..., columns]
+
+    def window(self, field, row, count, columns=None):
+        """The count rows of a field ending at row, adjusted as of row
+
+        A view of a mapping of the rows when no adjustment of the
+        columns is effective after row and columns is None or
+        consecutive; a copy otherwise. Either way it can be written
+        without changing the store.
+
+        Args:
+            field (str): One of STORE_FIELDS
+            row (int): Last row of the window, from locate()
+            count (int): Rows in the window
+            columns (list): Columns to keep, from columnsOf(), or None
+
+        Returns:
+            np.ndarray: count x columns array
+        """
+        kind = 'volume' if field == 'volume' else 'price'
+        factors = self._select(self.factors[kind][row], columns)
+        if (factors == 1.0).all():
+            return self._select(self._rows(field, row - count + 1, count),
+                                columns)
+        block = self._select(self.arrays[field][row - count + 1:row + 1],
+                             columns)
+        return block / factors
+
+    def frame(self, field, row, count, assets, values=None):
+        """The window of assets as a DataFrame sharing its values
+
+        Args:
+            values (np.ndarray): The window to wrap, defaults to
+                                 window(field, row, count, columns)
+        """
+        if values is None:
+            values = self.window(field, row, count, self.columnsOf(assets))
+        return pd.DataFrame(values, index=self.sessions[row - count + 1:
+                                                        row + 1],
+                            columns=list(assets), copy=False)
+
+
+class WindowCache:
+    """Adjusted windows of a PriceStore by as-of session
+
+    Runs of a warm engine over the same dates, like the points of a
+    sweep, ask for the same windows; the ones the store had to compute
+    are kept, least recently used first out once they take more than
+    maxBytes. Every caller gets its own copy of a cached window, so
+    editing it cannot change what the next caller gets.
+
+    Args:
+        store (PriceStore): Source of the windows
+        maxBytes (int): Size bound of the cached windows
+    """
+    def __init__(self, store, maxBytes=DEFAULT_WINDOW_CACHE_BYTES):
+        self.store = store
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def window(self, field, row, count, columns=None):
+        """PriceStore.window(), from the cache when possible
+        """
+        key = (field, row, count,
+               None if columns is None else tuple(columns))
+        with self.lock:
+            values = self.entries.get(key)
+            if values is not None:
+                self.entries.move_to_end(key)
+                return values.copy()
+
+        values = self.store.window(field, row, count, columns)
+        # Views of the store cost nothing to make again
+        if mapped(values) or values.nbytes > self.maxBytes:
+            return values
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = values
+                self.bytes += values.nbytes
+            while self.bytes > self.maxBytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return values.copy()
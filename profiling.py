@@ -0,0 +1,139 @@
+"""Profiling of backtest runs
+"""
+import cProfile
+import functools
+import os
+import pstats
+import time
+
+PROFILE_SORTS = ('tottime', 'cumtime', 'calls')
+
+
+def packageOf(filename):
+    """Name the package a profiled function belongs to
+
+    Functions of the algorithm script are 'algorithm', C functions are
+    'builtin' and installed packages are named after their top level
+    directory, so the report shows whether time goes to the strategy,
+    zipline, pandas or numpy.
+    """
+    if filename == '<algorithm>':
+        return 'algorithm'
+    if filename == '~':
+        return 'builtin'
+    parts = os.path.normpath(filename).split(os.sep)
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts:
+            i = len(parts) - 1 - parts[::-1].index(marker)
+            if i + 1 < len(parts):
+                return parts[i + 1].split('.')[0]
+    return 'other'
+
+
+class CallbackTimer:
+    """Wall time spent in each user callback of a run
+
+    Callbacks are timed individually through wrap(), so the per-callback
+    figures do not depend on how the profiler attributes nested calls.
+    """
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+    def wrap(self, name, func):
+        """Return func, timed under name; None stays None
+        """
+        if func is None:
+            return None
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[name] = self.totals.get(name, 0.0) + \
+                    time.perf_counter() - t0
+                self.calls[name] = self.calls.get(name, 0) + 1
+        return timed
+
+    def report(self):
+        """Callbacks by total time, with call count and mean time
+        """
+        return [{'callback': name,
+                 'calls': self.calls[name],
+                 'total': total,
+                 'mean': total / self.calls[name]}
+                for name, total in sorted(self.totals.items(),
+                                          key=lambda item: -item[1])]
+
+
+class RunProfiler:
+    """cProfile of one run plus the timings of its callbacks
+
+    Use as a context manager in the thread that runs the simulation;
+    cProfile only sees the thread it was enabled in.
+
+    Args:
+        top (int): Number of functions in the report
+        sort (str): One of PROFILE_SORTS
+    """
+    def __init__(self, top=25, sort='tottime'):
+        if sort not in PROFILE_SORTS:
+            raise ValueError('Invalid sort {!r}, expected one of {}'.format(
+                sort, ', '.join(PROFILE_SORTS)))
+        self.top = top
+        self.sort = sort
+        self.profile = cProfile.Profile()
+        self.callbacks = CallbackTimer()
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self.elapsed += time.perf_counter() - self.t0
+        return False
+
+    def report(self):
+        """Build the JSON-serializable report
+
+        Returns:
+            dict: elapsed seconds, the hottest functions, own time summed
+                  per package and the callback timings
+        """
+        functions = []
+        packages = {}
+        totalCalls = 0
+        for (filename, lineno, name), (cc, nc, tt, ct, _) in \
+                pstats.Stats(self.profile).stats.items():
+            package = packageOf(filename)
+            packages[package] = packages.get(package, 0.0) + tt
+            totalCalls += nc
+            functions.append({
+                'function': name,
+                'file': filename,
+                'line': lineno,
+                'package': package,
+                'calls': nc,
+                'primitive_calls': cc,
+                'tottime': tt,
+                'cumtime': ct,
+                'percall': ct / nc if nc else 0.0,
+            })
+        functions.sort(key=lambda f: -f[self.sort])
+
+        return {
+            'type': 'profile',
+            'elapsed': self.elapsed,
+            'total_calls': totalCalls,
+            'sort': self.sort,
+            'functions': functions[:self.top],
+            'packages': [{'package': package, 'tottime': tt}
+                         for package, tt in sorted(packages.items(),
+                                                   key=lambda p: -p[1])],
+            'callbacks': self.callbacks.report(),
+        }
@@ -0,0 +1,192 @@
+"""Binary portfolio records
+
+Portfolio updates travel between stages as packed arrays of a fixed
+NumPy structured dtype, carried in MsgType.RECORDS frames. Any number of
+records fit in one frame and a reader gets them back as an array without
+parsing. JSON is kept as an opt-in text mode for humans.
+"""
+import json
+import threading
+import time
+import numpy as np
+from base import MsgType
+
+PORTFOLIO_DTYPE = np.dtype([
+    ('timestamp', '<i8'),  # nanoseconds since the epoch, UTC
+    ('portfolio_value', '<f8'),
+    ('pnl', '<f8'),
+    ('returns', '<f8'),
+])
+
+RECORD_SIZE = PORTFOLIO_DTYPE.itemsize
+
+
+def portfolioRecord(dt, portfolio):
+    """Build one record tuple from a zipline Portfolio
+
+    Args:
+        dt (pd.Timestamp): The simulation time of the update
+        portfolio (Portfolio): The zipline portfolio, or any mapping with
+                               portfolio_value, pnl and returns
+
+    Returns:
+        tuple: A row of PORTFOLIO_DTYPE
+    """
+    return (dt.value,
+            portfolio['portfolio_value'],
+            portfolio['pnl'],
+            portfolio['returns'])
+
+
+def packRecords(records):
+    """Pack records into bytes
+
+    Args:
+        records: A PORTFOLIO_DTYPE array or a sequence of record tuples
+
+    Returns:
+        bytes: The little-endian packed records
+    """
+    return np.asarray(records, dtype=PORTFOLIO_DTYPE).tobytes()
+
+
+def unpackRecords(payload):
+    """Decode packed records without copying
+
+    Args:
+        payload (bytes): Output of packRecords
+
+    Returns:
+        np.ndarray: A read-only PORTFOLIO_DTYPE array over payload
+    """
+    return np.frombuffer(payload, dtype=PORTFOLIO_DTYPE)
+
+
+def recordsToDicts(records):
+    """Turn records into the dicts used by the JSON text mode
+
+    Args:
+        records: A PORTFOLIO_DTYPE array or a sequence of record tuples
+    """
+    records = np.asarray(records, dtype=PORTFOLIO_DTYPE)
+    dates = records['timestamp'].astype('datetime64[ns]')
+    return [{
+        'timestamp': str(date),
+        'portfolio_value': float(record['portfolio_value']),
+        'pnl': float(record['pnl']),
+        'return': float(record['returns'])
+    } for date, record in zip(dates, records)]
+
+
+def recordsToJSON(records):
+    """Render records as one JSON document per record
+
+    Returns:
+        list: A list of utf8 encoded JSON strings
+    """
+    return [json.dumps(d).encode('utf8') for d in recordsToDicts(records)]
+
+
+class RecordBatcher:
+    """Coalesces records into batched frames
+
+    Records are held until one of three limits is hit: maxCount records,
+    maxBytes of packed payload, or maxDelay seconds since the oldest
+    pending record. A flusher thread enforces the delay so that a slow
+    or stalled simulation still gets its last records out on time.
+
+    Args:
+        writer (base.FrameWriter): Where the batches go
+        maxCount (int): Flush once this many records are pending
+        maxBytes (int): Flush once the packed batch reaches this size
+        maxDelay (float): Flush once the oldest record is this old, in
+                          seconds
+        text (bool): Write JSON frames holding an array of records
+                     instead of RECORDS frames
+        latency (latency.LatencyStats): Records how long packing and
+                                        writing each batch takes, or None
+    """
+    def __init__(self, writer, maxCount=1024, maxBytes=64 * 1024,
+                 maxDelay=0.05, text=False, latency=None):
+        self.writer = writer
+        self.latency = latency
+        self.maxCount = max(1, min(maxCount, maxBytes // RECORD_SIZE))
+        self.maxDelay = maxDelay
+        self.text = text
+        self.pending = []
+        self.deadline = None
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.flusher = threading.Thread(target=self._flushLoop, daemon=True)
+        self.flusher.start()
+
+    def add(self, record):
+        with self.cond:
+            if self.error is not None:
+                raise self.error
+            self.pending.append(record)
+            if len(self.pending) == 1:
+                self.deadline = time.monotonic() + self.maxDelay
+                self.cond.notify()
+            if len(self.pending) >= self.maxCount or \
+               time.monotonic() >= self.deadline:
+                self._flush()
+
+    def extend(self, records):
+        """Write a whole array of records, maxCount at a time
+        """
+        with self.cond:
+            if self.error is not None:
+                raise self.error
+            self._flush()
+            for i in range(0, len(records), self.maxCount):
+                self.pending = records[i:i + self.maxCount]
+                self._flush()
+
+    def flush(self):
+        with self.cond:
+            self._flush()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.flusher.join()
+        if self.error is not None:
+            raise self.error
+        self.flush()
+
+    def _flush(self):
+        if len(self.pending) == 0:
+            return
+        records, self.pending = self.pending, []
+        self.deadline = None
+        t0 = time.perf_counter_ns()
+        if self.text:
+            payload = json.dumps(recordsToDicts(records)).encode('utf8')
+            msgType = MsgType.JSON
+        else:
+            payload = packRecords(records)
+            msgType = MsgType.RECORDS
+        t1 = time.perf_counter_ns()
+        self.writer.write(payload, msgType)
+        if self.latency is not None:
+            self.latency.record('pack', t1 - t0)
+            self.latency.record('write', time.perf_counter_ns() - t1)
+
+    def _flushLoop(self):
+        with self.cond:
+            while not self.closed:
+                if self.deadline is None:
+                    self.cond.wait()
+                    continue
+                timeout = self.deadline - time.monotonic()
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                    continue
+                try:
+                    self._flush()
+                except Exception as e:
+                    self.error = e
+                    return
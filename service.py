@@ -4,10 +4,9 @@ from abc import ABCMeta, abstractmethod
 from enum import Enum
 import subprocess
 import datetime
+import os
 import socket
-from displayserver import WebDisplayServerProcess
-
-WEBPORT = 9000
+from displayserver import WEBPORT, WebDisplayServerThread
 
 class Service(metaclass=ABCMeta):
     """The abstract class for a service
@@ -41,36 +40,41 @@ class WebDisplayService(Service):
         self.status = ServiceStatus.STOPPED
 
     def start(self):
-        self.backp = WebDisplayServerProcess(WEBPORT)
+        if self.status == ServiceStatus.RUNNING:
+            return
+        self.backp = WebDisplayServerThread(WEBPORT)
         self.backp.start()
         self.frontp = subprocess.Popen(['npm', 'start'], cwd='./display/web',
                                        stdin=subprocess.PIPE,
                                        stdout=subprocess.PIPE)
         self.status = ServiceStatus.RUNNING
-        self.start = datetime.datetime.now()
+        self.startTime = datetime.datetime.now()
         self.host = socket.gethostname()
 
-    def updateAddPlotter(self, dataSource, initParams):
-        self.backp.addPlotter(dataSource, initParams)
+    def updateAddPlotter(self, pipe, initParams):
+        return self.backp.addPlotter(pipe, initParams)
+
+    def addRun(self, records, initParams):
+        return self.backp.addRun(records, initParams)
 
     def stop(self):
         self.frontp.kill()
-        self.backp.terminate()
+        self.backp.stop()
         self.status = ServiceStatus.STOPPED
 
     def status(self):
         template = """
         {name} -- {desc}
-        Status: {status} since {start-ts}; {duration} ago
-        PIDs: Front PID ({fpid}), Backend PID ({bpid})
+        Status: {status} since {start}; {duration} ago
+        PIDs: Front PID ({fpid}), Backend PID ({bpid}), {plots} plots
         """
 
         statusLine = 'Inactive (dead)' if self.status == ServiceStatus.STOPPED\
                      else 'Active (running)'
-        startTS = self.start.strftime('%a %Y-%m-%d %H:%M:%S %Z;')
-        deltaTS = str((datetime.datetime.now() - self.start))
+        startTS = self.startTime.strftime('%a %Y-%m-%d %H:%M:%S %Z;')
+        deltaTS = str((datetime.datetime.now() - self.startTime))
         fpid = self.frontp.pid
-        bpid = self.backp.pid
+        bpid = os.getpid()
 
         return template.format(name=self.name,
                                desc=self.desc,
@@ -78,4 +82,5 @@ class WebDisplayService(Service):
                                start=startTS,
                                duration=deltaTS,
                                fpid=fpid,
-                               bpid=bpid)
+                               bpid=bpid,
+                               plots=len(self.backp.server.plots))
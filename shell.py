@@ -4,15 +4,62 @@ import os
 import json
 import argparse
 import pdb
+import numpy as np
 from base import (MyCmd,
                   with_argparser,
-                  pipeReader,
-                  MSG_SEP)
-from service import WebDisplayService
+                  FrameWriter,
+                  MsgType)
+from service import WEBPORT, WebDisplayService
 from backtest import ZiplineRunThread
+from sweep import sweep
+from walkforward import walkforward
+from vectorized import VectorEngine
+from engine import getEngine, resumable
+from ingest import appendBundle, registerLocalBundle, registerLocalBundles
+from zipline.data import bundles
+from zipline.utils.cli import Date
+from cache import ResultCache
+from checkpoint import Checkpointer, CheckpointStore
+from profiling import PROFILE_SORTS, RunProfiler
+from latency import LatencyStats, StatsReporter
+from jobs import CANCELLED, DONE, JobScheduler, runBacktest
+from records import (PORTFOLIO_DTYPE,
+                     RecordBatcher,
+                     portfolioRecord,
+                     recordsToJSON,
+                     unpackRecords)
 import time
 
 DEFAULT_PLOT_NAME = '<default_plot>'
+DEFAULT_START = '2012-01-01'
+DEFAULT_END = '2012-6-01'
+DEFAULT_CAPITAL = 100000
+DEFAULT_BUNDLE = 'quandl'
+
+
+def add_run_arguments(argparser):
+    """Add the options shared by every backtest mode
+    """
+    argparser.add_argument('engine', default='zipline')
+    argparser.add_argument('algofile', default='./algo.py')
+    argparser.add_argument('--start', default=DEFAULT_START,
+                           help='first session of the backtest')
+    argparser.add_argument('--end', default=DEFAULT_END,
+                           help='last session of the backtest')
+    argparser.add_argument('--capital', type=float, default=DEFAULT_CAPITAL,
+                           help='starting capital')
+    argparser.add_argument('--bundle', default=DEFAULT_BUNDLE,
+                           help='zipline bundle holding the price data')
+
+
+def parse_cpus(spec):
+    """Parse a CPU list like 0,2-3 into a set of CPU numbers
+    """
+    cpus = set()
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
 
 
 class TradingShell(MyCmd):
@@ -21,15 +68,29 @@ class TradingShell(MyCmd):
 
     def __init__(self):
         super(TradingShell, self).__init__()
-        self.backtest_engines = ['zipline']
+        self.backtest_engines = ['zipline', 'numpy']
+        self.backtest_modes = {
+            'submit': self.backtest_submit,
+            'sweep': self.backtest_sweep,
+            'walkforward': self.backtest_walkforward
+        }
         self.actions = {
             'backtest': self.backtest,
             'echo': self.echo,
             'plot': self.plot,
             'service': self.service,
-            'db': self.db
+            'db': self.db,
+            'jobs': self.jobs,
+            'wait': self.wait,
+            'cancel': self.cancel,
+            'ingest': self.ingest
         }
         self.services = {}
+        self.cache = None
+        self.checkpoints = None
+        self.vector_engines = {}
+        self.scheduler = None
+        registerLocalBundles()
 
     def get_service(self, name):
         try:
@@ -39,17 +100,83 @@ class TradingShell(MyCmd):
             self.services[name] = service
         return service
 
+    def get_scheduler(self):
+        if self.scheduler is None:
+            self.scheduler = JobScheduler()
+        return self.scheduler
+
+    def get_vector_engine(self, bundle=DEFAULT_BUNDLE):
+        if bundle not in self.vector_engines:
+            self.vector_engines[bundle] = VectorEngine(getEngine(bundle))
+        return self.vector_engines[bundle]
+
+    def get_checkpoints(self):
+        if self.checkpoints is None:
+            self.checkpoints = CheckpointStore()
+        return self.checkpoints
+
+    def get_cache(self):
+        if self.cache is None:
+            self.cache = ResultCache()
+        return self.cache
+
+    def renderFrame(self, frame):
+        if frame.msgType == MsgType.RECORDS:
+            return b''.join(line + b'\n' for line in
+                            recordsToJSON(unpackRecords(frame.payload)))
+        return super(TradingShell, self).renderFrame(frame)
+
     def do_b(self, arg):
         self.do_backtest(arg)
 
     def do_backtest(self, arg):
         self.piperun('backtest ' + arg)
 
+    def backtest(self, arg, inPipe=None, outPipe=1):
+        """Run a backtest, or one of the multi-run modes in backtest_modes
+        """
+        mode, _, rest = arg.strip().partition(' ')
+        if mode in self.backtest_modes:
+            return self.backtest_modes[mode](rest, inPipe=inPipe,
+                                             outPipe=outPipe)
+        return self.backtest_run(arg, inPipe=inPipe, outPipe=outPipe)
+
     argparser = argparse.ArgumentParser()
-    argparser.add_argument('engine', default='zipline')
-    argparser.add_argument('algofile', default='./algo.py')
+    add_run_arguments(argparser)
+    argparser.add_argument('--text', action='store_true',
+                           help='emit JSON text frames instead of records')
+    argparser.add_argument('--batch-count', type=int, default=1024,
+                           help='max records per output frame')
+    argparser.add_argument('--batch-bytes', type=int, default=64 * 1024,
+                           help='max packed bytes per output frame')
+    argparser.add_argument('--batch-delay', type=float, default=50,
+                           help='max milliseconds a record waits in a batch')
+    argparser.add_argument('--data-frequency', default='daily',
+                           choices=['daily', 'minute'],
+                           help='bar size of the simulation')
+    argparser.add_argument('--sample', default='bar',
+                           help="which bars to emit: 'bar', 'eod' or every "
+                                "N minutes like '15m'")
+    argparser.add_argument('--no-cache', action='store_true',
+                           help='always simulate, ignoring cached results')
+    argparser.add_argument('--checkpoint-every', type=int, default=21,
+                           help='sessions between checkpoints, 0 disables')
+    argparser.add_argument('--no-resume', action='store_true',
+                           help='simulate from the start date even if a '
+                                'checkpoint exists')
+    argparser.add_argument('--profile', action='store_true',
+                           help='emit a JSON profile report of the run '
+                                'instead of its records')
+    argparser.add_argument('--profile-top', type=int, default=25,
+                           help='functions in the profile report')
+    argparser.add_argument('--profile-sort', default='tottime',
+                           choices=PROFILE_SORTS,
+                           help='ranking of the profile report')
+    argparser.add_argument('--stats-interval', type=float, default=5.0,
+                           help='seconds between latency stats frames, '
+                                '0 disables them')
     @with_argparser(argparser)
-    def backtest(self, args, inPipe=None, outPipe=1):
+    def backtest_run(self, args, inPipe=None, outPipe=1):
         if args.engine not in self.backtest_engines:
             self.poutput('{} not a valid backtest engine'.format(args.engine))
             return
@@ -57,29 +184,355 @@ class TradingShell(MyCmd):
         with open(args.algofile, 'r') as f:
             code = f.read()
 
-        r, w = os.pipe()
+        if args.engine == 'numpy' and args.data_frequency != 'daily':
+            self.perror('The numpy engine only runs on daily bars')
+            return
+
+        if args.profile:
+            return self.backtest_profile(code, args, outPipe)
+
+        latency = None
+        if args.engine == 'zipline' and args.stats_interval > 0:
+            latency = LatencyStats()
+
+        writer = FrameWriter(outPipe)
+        batcher = RecordBatcher(writer,
+                                maxCount=args.batch_count,
+                                maxBytes=args.batch_bytes,
+                                maxDelay=args.batch_delay / 1000.0,
+                                text=args.text,
+                                latency=latency)
+
+        # Runs here in the shell still take a slot of the worker budget
+        lease = self.get_scheduler().lease(
+            name=os.path.basename(args.algofile))
+
+        if args.engine == 'numpy':
+            parse = Date(tz='utc', as_timestamp=True).parser
+            with lease:
+                records, _ = self.get_vector_engine(args.bundle).run(
+                    code, parse(args.start), parse(args.end), args.capital)
+            batcher.extend(records)
+            batcher.close()
+            return
+
+        def consume_portfolio(update):
+            if latency is None:
+                record = portfolioRecord(*update)
+            else:
+                t0 = time.perf_counter_ns()
+                record = portfolioRecord(*update)
+                latency.record('serialize', time.perf_counter_ns() - t0)
+            if recorder is not None:
+                recorder.add(record)
+            if checkpointer is not None:
+                checkpointer.add(record)
+            batcher.add(record)
+
+        ziplineTh = ZiplineRunThread(code, args.start, args.end,
+                                     args.capital, consume_portfolio,
+                                     engine=getEngine(args.bundle),
+                                     data_frequency=args.data_frequency,
+                                     sample=args.sample,
+                                     latency=latency)
+        bundle_timestamp = ziplineTh.engine.latestIngestion()
+
+        key = recorder = checkpointer = None
+        if not args.no_cache:
+            key = self.get_cache().key(
+                code, args.engine, ziplineTh.start_date, ziplineTh.end_date,
+                args.capital, args.data_frequency, bundle_timestamp,
+                args.sample, args.bundle)
+            records = self.get_cache().get(key)
+            if records is not None:
+                batcher.extend(records)
+                batcher.close()
+                return
+            recorder = self.get_cache().writer(key)
+
+        if args.checkpoint_every > 0:
+            store = self.get_checkpoints()
+            ckey = store.key(code, args.engine, ziplineTh.start_date,
+                             args.capital, args.data_frequency,
+                             bundle_timestamp, args.sample, args.bundle)
+            found = None if args.no_resume else \
+                store.latest(ckey, ziplineTh.start_date, ziplineTh.end_date)
+            if found is not None and not resumable(found[0]['state']):
+                self.pfeedback('Checkpoint lacks the metrics state, '
+                               'running from the start')
+                found = None
+            prev = None
+            if found is not None:
+                checkpoint, records = found
+                prev = checkpoint['session']
+                self.pfeedback('Resuming from checkpoint at {}'.format(
+                    prev.date()))
+                if recorder is not None:
+                    for record in records:
+                        recorder.add(record)
+                batcher.extend(records)
+                ziplineTh.start_date = prev
+                ziplineTh.resumeFrom = checkpoint['state']
+            checkpointer = Checkpointer(store, ckey, args.checkpoint_every,
+                                        prev)
+            ziplineTh.checkpoint = checkpointer
+
+        reporter = None
+        if latency is not None:
+            reporter = StatsReporter(writer, latency, args.stats_interval)
 
-        def consume_portfolio(portfolio):
-            update = json.dumps({
-                'portfolio_value': portfolio['portfolio_value'],
-                'pnl': portfolio['pnl'],
-                'return': portfolio['returns']
-            }).encode('utf8') + MSG_SEP
-            os.write(outPipe, update)
+        try:
+            with lease:
+                ziplineTh.start()
+                ziplineTh.join()
+            batcher.close()
+        finally:
+            if recorder is not None:
+                if ziplineTh.perf is not None:
+                    recorder.commit()
+                else:
+                    recorder.abort()
+            if reporter is not None:
+                reporter.close()
+
+    def backtest_profile(self, code, args, outPipe=1):
+        """Simulate from the start date under the profiler
+
+        Cached results and checkpoints are bypassed, so the report covers
+        one complete simulation and nothing else.
+        """
+        profiler = RunProfiler(top=args.profile_top, sort=args.profile_sort)
+        lease = self.get_scheduler().lease(
+            name=os.path.basename(args.algofile))
+
+        if args.engine == 'numpy':
+            parse = Date(tz='utc', as_timestamp=True).parser
+            with lease, profiler:
+                self.get_vector_engine(args.bundle).run(
+                    code, parse(args.start), parse(args.end), args.capital,
+                    timer=profiler.callbacks)
+        else:
+            ziplineTh = ZiplineRunThread(code, args.start, args.end,
+                                         args.capital,
+                                         engine=getEngine(args.bundle),
+                                         data_frequency=args.data_frequency,
+                                         sample=args.sample,
+                                         profiler=profiler)
+            with lease:
+                ziplineTh.start()
+                ziplineTh.join()
+            if ziplineTh.perf is None:
+                self.perror('Backtest failed, no profile report')
+                return
+
+        report = json.dumps(profiler.report()).encode('utf8')
+        FrameWriter(outPipe).write(report, MsgType.JSON)
 
-        ziplineTh = ZiplineRunThread(code, '2012-01-01', '2012-6-01', 100000,
-                                     consume_portfolio)
-        ziplineTh.start()
+    argparser = argparse.ArgumentParser()
+    add_run_arguments(argparser)
+    argparser.add_argument('--data-frequency', default='daily',
+                           choices=['daily', 'minute'],
+                           help='bar size of the simulation')
+    argparser.add_argument('--sample', default='bar',
+                           help="which bars to emit: 'bar', 'eod' or every "
+                                "N minutes like '15m'")
+    argparser.add_argument('--priority', type=int, default=0,
+                           help='higher priorities run first')
+    argparser.add_argument('--cpu-time', type=float, default=None,
+                           help='CPU seconds the job may use')
+    argparser.add_argument('--memory', type=int, default=None,
+                           help='megabytes of address space the job may use')
+    argparser.add_argument('--cpus', default=None,
+                           help='CPUs the job may run on, like 0,2-3')
+    @with_argparser(argparser)
+    def backtest_submit(self, args, inPipe=None, outPipe=1):
+        """Queue a backtest on the job scheduler's worker pool
+        """
+        if args.engine not in self.backtest_engines:
+            self.poutput('{} not a valid backtest engine'.format(args.engine))
+            return
+        if args.engine == 'numpy' and args.data_frequency != 'daily':
+            self.perror('The numpy engine only runs on daily bars')
+            return
+
+        with open(args.algofile, 'r') as f:
+            code = f.read()
+
+        job = self.get_scheduler().submit(
+            runBacktest,
+            (args.engine, code, args.start, args.end, args.capital,
+             args.data_frequency, args.sample, args.bundle),
+            priority=args.priority,
+            name=os.path.basename(args.algofile),
+            cpuTime=args.cpu_time,
+            memory=args.memory * 1024 * 1024 if args.memory else None,
+            cpus=parse_cpus(args.cpus) if args.cpus else None)
+        FrameWriter(outPipe).write(json.dumps(job.status()).encode('utf8'),
+                                   MsgType.JSON)
+
+    argparser = argparse.ArgumentParser()
+    add_run_arguments(argparser)
+    argparser.add_argument('--grid', nargs='+', required=True,
+                           help='axes like window=20,50,100 or '
+                                'threshold=1.0:2.0:0.25')
+    argparser.add_argument('--priority', type=int, default=0,
+                           help='higher priorities run first')
+    @with_argparser(argparser)
+    def backtest_sweep(self, args, inPipe=None, outPipe=1):
+        """Run the algorithm once per grid combination on the workers
+        """
+        if args.engine not in self.backtest_engines:
+            self.poutput('{} not a valid backtest engine'.format(args.engine))
+            return
+
+        with open(args.algofile, 'r') as f:
+            code = f.read()
+
+        writer = FrameWriter(outPipe)
+        for summary in sweep(code, args.grid, args.start, args.end,
+                             args.capital, scheduler=self.get_scheduler(),
+                             priority=args.priority, engine=args.engine,
+                             bundle=args.bundle):
+            writer.write(json.dumps(summary).encode('utf8'), MsgType.JSON)
+
+    argparser = argparse.ArgumentParser()
+    add_run_arguments(argparser)
+    argparser.add_argument('--train', type=int, default=252,
+                           help='in-sample sessions per window')
+    argparser.add_argument('--test', type=int, default=21,
+                           help='out-of-sample sessions per window')
+    argparser.add_argument('--warmup', type=int, default=0,
+                           help='sessions simulated before each test range')
+    argparser.add_argument('--priority', type=int, default=0,
+                           help='higher priorities run first')
+    @with_argparser(argparser)
+    def backtest_walkforward(self, args, inPipe=None, outPipe=1):
+        """Run rolling out-of-sample segments on the workers, then stitch
+        """
+        if args.engine != 'zipline':
+            self.poutput('walkforward needs the zipline engine')
+            return
+
+        with open(args.algofile, 'r') as f:
+            code = f.read()
+
+        parse = Date(tz='utc', as_timestamp=True).parser
+        records = walkforward(code, parse(args.start), parse(args.end),
+                              args.train, args.test, args.warmup,
+                              args.capital, scheduler=self.get_scheduler(),
+                              priority=args.priority, bundle=args.bundle)
+        batcher = RecordBatcher(FrameWriter(outPipe))
+        batcher.extend(records)
+        batcher.close()
+
+    def do_jobs(self, arg):
+        self.piperun('jobs ' + arg)
+
+    argparser = argparse.ArgumentParser()
+    @with_argparser(argparser)
+    def jobs(self, args, inPipe=None, outPipe=1):
+        """List the submitted jobs and their state
+        """
+        writer = FrameWriter(outPipe)
+        for job in self.get_scheduler().list():
+            writer.write(json.dumps(job.status()).encode('utf8'),
+                         MsgType.JSON)
+
+    def do_wait(self, arg):
+        self.piperun('wait ' + arg)
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('job', type=int)
+    argparser.add_argument('--timeout', type=float, default=None,
+                           help='seconds to wait before giving up')
+    @with_argparser(argparser)
+    def wait(self, args, inPipe=None, outPipe=1):
+        """Wait for a job and emit the records of its backtest
+        """
+        try:
+            job = self.get_scheduler().wait(args.job, args.timeout)
+        except KeyError:
+            self.perror('No job {}'.format(args.job))
+            return
+        except TimeoutError as e:
+            self.perror(str(e))
+            return
+
+        if job.state == DONE:
+            batcher = RecordBatcher(FrameWriter(outPipe))
+            batcher.extend(job.result)
+            batcher.close()
+        elif job.state == CANCELLED:
+            self.perror('Job {} was cancelled'.format(job.id))
+        else:
+            self.perror('Job {} failed:\n{}'.format(job.id, job.error))
+
+    def do_cancel(self, arg):
+        self.piperun('cancel ' + arg)
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('job', type=int)
+    @with_argparser(argparser)
+    def cancel(self, args, inPipe=None, outPipe=1):
+        """Cancel a queued or running job
+        """
+        try:
+            cancelled = self.get_scheduler().cancel(args.job)
+        except KeyError:
+            self.perror('No job {}'.format(args.job))
+            return
+        if not cancelled:
+            self.perror('Job {} already finished'.format(args.job))
+
+    def do_ingest(self, arg):
+        self.piperun('ingest ' + arg)
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('bundle', help='name to ingest the bundle as')
+    argparser.add_argument('directory',
+                           help='directory with daily/ and minute/ bar files')
+    argparser.add_argument('--calendar', default='XNYS',
+                           help='trading calendar of the bars')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='parsing processes, defaults to all cores')
+    argparser.add_argument('--append', action='store_true',
+                           help='only add the sessions after the last '
+                                'ingestion of the bundle')
+    @with_argparser(argparser)
+    def ingest(self, args, inPipe=None, outPipe=1):
+        """Ingest local CSV or Parquet bar files as a zipline bundle
+        """
+        writer = FrameWriter(outPipe)
+        if args.append:
+            report = appendBundle(args.bundle,
+                                  os.path.abspath(args.directory),
+                                  args.calendar, os.environ, args.workers)
+            if report is None:
+                self.poutput('No new sessions in {}'.format(args.directory))
+            else:
+                writer.write(json.dumps(report).encode('utf8'),
+                             MsgType.JSON)
+            return
+
+        reports = []
+        registerLocalBundle(args.bundle, args.directory, args.calendar,
+                            args.workers, reports.append)
+        bundles.ingest(args.bundle, os.environ, show_progress=False)
+
+        for report in reports:
+            writer.write(json.dumps(report).encode('utf8'), MsgType.JSON)
 
     def do_p(self, arg):
         self.do_plot(arg)
 
     def do_plot(self, arg):
-        pdb.set_trace()
         self.piperun('plot ' + arg)
 
     argparser = argparse.ArgumentParser()
     argparser.add_argument('frontend', default='web')
+    argparser.add_argument('--load', metavar='PATH',
+                           help='plot a stored run, a file of records '
+                           'such as a result cache entry')
     @with_argparser(argparser)
     def plot(self, arg, inPipe=None, outPipe=1):
         """Plot the current data according to its type
@@ -87,25 +540,25 @@ class TradingShell(MyCmd):
 
         if arg.frontend == 'web':
             service = self.get_service('webdisplay')
-
-            if inPipe is not None:
-                initParams = {
-                    'title': 'Default Plot',
-                    'xlabel': 'Date',
-                    'startDate': '2012-01-01'
-                }
-
+            initParams = {
+                'title': 'Default Plot',
+                'xlabel': 'Date',
+                'startDate': '2012-01-01'
+            }
+
+            if arg.load is not None:
+                records = np.fromfile(arg.load, dtype=PORTFOLIO_DTYPE)
                 service.start()
-                self.poutput('Waiting for service to start...')
-                time.sleep(3)
+                plot = service.addRun(records, dict(
+                    initParams, title=os.path.basename(arg.load)))
+                self.poutput('Plot {} on port {}'.format(plot.id, WEBPORT))
+                plot.wait()
 
-                initParams = {
-                    'title': 'Default Plot',
-                    'xlabel': 'Date',
-                    'startDate': '2012-01-01'
-                }
-                service.updateAddPlotter(pipeReader(inPipe, MSG_SEP),
-                                         initParams)
+            elif inPipe is not None:
+                service.start()
+                plot = service.updateAddPlotter(inPipe, initParams)
+                self.poutput('Plot {} on port {}'.format(plot.id, WEBPORT))
+                plot.wait()
 
             else:
                 raise Exception('Non-pipe data model not implemented!')
@@ -150,8 +603,8 @@ class TradingShell(MyCmd):
                     'xlabel': 'Date',
                     'startDate': '2012-01-01'
                 }
-                service.updateAddPlotter(pipeReader(inPipe, MSG_SEP),
-                                         initParams)
+                plot = service.updateAddPlotter(inPipe, initParams)
+                plot.wait()
 
             else:
                 self.perror('Invalid action {}.'.format(arg.action))
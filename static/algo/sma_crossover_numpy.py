@@ -0,0 +1,26 @@
+"""SMA crossover for the numpy engine
+
+Hold each asset with equal weight while its fast moving average is above
+its slow one. Run with: backtest numpy static/algo/sma_crossover_numpy.py
+Sweep with: backtest sweep numpy ... --grid fast=10:50:10 slow=100,150,200
+"""
+import numpy as np
+
+symbols = ['SPY', 'EFA', 'TLT', 'GLD']
+fast = 20
+slow = 100
+cost = 0.0005
+
+
+def moving_average(close, window):
+    csum = np.cumsum(np.nan_to_num(close), axis=0)
+    avg = np.full_like(close, np.nan)
+    avg[window - 1:] = csum[window - 1:]
+    avg[window:] -= csum[:-window]
+    return avg / window
+
+
+def weights(close):
+    signal = moving_average(close, fast) > moving_average(close, slow)
+    held = signal.sum(axis=1, keepdims=True)
+    return np.where(held > 0, signal / np.maximum(held, 1), 0.0)
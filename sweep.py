@@ -0,0 +1,177 @@
+"""Parameter sweeps on the job scheduler's workers
+"""
+import ast
+import itertools
+import math
+import time
+from zipline.utils.cli import Date
+from engine import getEngine
+from jobs import DONE, JobScheduler
+from vectorized import VectorEngine, summarize
+
+
+def parseValue(text):
+    """Parse a grid value as a python literal, falling back to a string
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parseAxis(spec):
+    """Parse one grid axis
+
+    Two forms are understood: ``name=v1,v2,v3`` lists the values, and
+    ``name=start:stop:step`` is an inclusive range, its last value being
+    the last step not past stop.
+
+    Returns:
+        tuple: (name, list of values)
+    """
+    name, sep, values = spec.partition('=')
+    if not sep or not name or not values:
+        raise ValueError('Invalid grid axis {!r}, expected name=values'
+                         .format(spec))
+
+    if ':' not in values:
+        return name, [parseValue(v) for v in values.split(',')]
+
+    start, stop, step = (parseValue(v) for v in values.split(':'))
+    if step <= 0:
+        raise ValueError('Invalid step in grid axis {!r}'.format(spec))
+    if stop < start:
+        raise ValueError('Invalid range in grid axis {!r}, stop is before '
+                         'start'.format(spec))
+    count = int(math.floor((stop - start) / step + 1e-9)) + 1
+    points = [start + i * step for i in range(count)]
+    if all(isinstance(v, int) for v in (start, stop, step)):
+        return name, points
+    return name, [round(p, 12) for p in points]
+
+
+def expandGrid(specs):
+    """Turn grid axes into the list of every parameter combination
+
+    Args:
+        specs (list): Axis specs as accepted by parseAxis
+
+    Returns:
+        list: One dict of parameters per combination
+    """
+    axes = [parseAxis(spec) for spec in specs]
+    names = [name for name, _ in axes]
+    return [dict(zip(names, combo))
+            for combo in itertools.product(*(v for _, v in axes))]
+
+
+def defineParams(params):
+    return ['{}={!r}'.format(k, v) for k, v in params.items()]
+
+
+def runPoint(code, start, end, capital_base, params, bundle='quandl'):
+    """Run one combination of a sweep; executed in a worker process
+
+    The parameters are injected into the algorithm namespace before the
+    script runs, like zipline's --define.
+
+    Returns:
+        dict: A summary record of the run
+    """
+    begin = time.perf_counter()
+    parse = Date(tz='utc', as_timestamp=True).parser
+    perf = getEngine(bundle).run(
+        code,
+        start=parse(start),
+        end=parse(end),
+        capital_base=capital_base,
+        defines=defineParams(params),
+    )
+    last = perf.iloc[-1]
+    return {
+        'params': params,
+        'portfolio_value': float(last['portfolio_value']),
+        'return': float(last['portfolio_value'] / capital_base - 1),
+        'sharpe': float(last['sharpe']),
+        'max_drawdown': float(last['max_drawdown']),
+        'elapsed': time.perf_counter() - begin,
+    }
+
+
+def sweepVectorized(code, combos, start, end, capital_base,
+                    bundle='quandl'):
+    """Run every combination on the numpy engine in this process
+
+    Vectorized runs take milliseconds once the prices are loaded, so
+    they share one VectorEngine and its price cache instead of a pool.
+    """
+    vector = VectorEngine(getEngine(bundle))
+    parse = Date(tz='utc', as_timestamp=True).parser
+    start, end = parse(start), parse(end)
+    for params in combos:
+        begin = time.perf_counter()
+        try:
+            _, values = vector.run(code, start, end, capital_base,
+                                   defineParams(params))
+        except Exception as e:
+            yield {'params': params, 'error': str(e)}
+            continue
+        summary = {'params': params}
+        summary.update(summarize(values, capital_base))
+        summary['elapsed'] = time.perf_counter() - begin
+        yield summary
+
+
+def sweep(code, grid, start, end, capital_base=100000, scheduler=None,
+          priority=0, engine='zipline', bundle='quandl'):
+    """Run every combination of grid
+
+    zipline runs are queued as jobs on the scheduler's workers; numpy
+    engine runs are fast enough to run in place, under a lease.
+
+    Args:
+        code (str): The algorithm source
+        grid (list): Axis specs as accepted by parseAxis
+        start (str): First session
+        end (str): Last session
+        capital_base (float): Starting capital of every run
+        scheduler (JobScheduler): Where the runs go, by default a
+                                  scheduler of their own
+        priority (int): Priority of the runs
+        engine (str): 'zipline' or 'numpy'
+        bundle (str): The zipline bundle to run on
+
+    Yields:
+        dict: One summary record per combination, as each one finishes
+    """
+    combos = expandGrid(grid)
+    if not combos:
+        return
+    own = scheduler is None
+    if own:
+        scheduler = JobScheduler()
+    jobs = {}
+    try:
+        if engine == 'numpy':
+            with scheduler.lease(priority, 'sweep'):
+                yield from sweepVectorized(code, combos, start, end,
+                                           capital_base, bundle)
+            return
+
+        for params in combos:
+            job = scheduler.submit(
+                runPoint, (code, start, end, capital_base, params, bundle),
+                priority=priority, name='sweep {}'.format(params))
+            jobs[job] = params
+        for job in scheduler.completed(jobs):
+            if job.state == DONE:
+                yield job.result
+            else:
+                yield {'params': jobs[job],
+                       'error': job.error or job.state}
+    finally:
+        # Stop queued runs if the reader goes away early
+        for job in jobs:
+            scheduler.cancel(job.id)
+        if own:
+            scheduler.close()
@@ -0,0 +1,64 @@
+import unittest
+import os
+import tempfile
+import time
+from cache import ResultCache
+from records import RECORD_SIZE
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Test the on-disk backtest result cache
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.tmpdir.name, maxBytes=25 * RECORD_SIZE)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def store(self, key, n):
+        writer = self.cache.writer(key)
+        for i in range(n):
+            writer.add((i, 100.0 + i, float(i), 0.0))
+        writer.commit()
+
+    def testKey(self):
+        args = ('code', 'zipline', '2012-01-01', '2012-06-01', 100000,
+                'daily', '2018-01-01')
+        self.assertEqual(ResultCache.key(*args), ResultCache.key(*args))
+        self.assertNotEqual(ResultCache.key(*args),
+                            ResultCache.key('code ', *args[1:]))
+        self.assertNotEqual(ResultCache.key(*args),
+                            ResultCache.key(*args[:-1], '2018-01-02'))
+
+    def testRoundTrip(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.store('a', 10)
+        records = self.cache.get('a')
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records['portfolio_value'][3], 103.0)
+
+    def testAbort(self):
+        writer = self.cache.writer('a')
+        writer.add((0, 1.0, 2.0, 3.0))
+        writer.abort()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def testEviction(self):
+        self.store('a', 10)
+        self.store('b', 10)
+        past = time.time() - 100
+        os.utime(self.cache.path('a'), (past, past))
+        os.utime(self.cache.path('b'), (past + 1, past + 1))
+        # A hit makes 'a' the most recently used entry
+        self.cache.get('a')
+        self.store('c', 10)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
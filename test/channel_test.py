@@ -0,0 +1,122 @@
+import unittest
+import threading
+import pandas as pd
+from backtest import BarSampler, Channel, Overflow
+
+
+class FakeCalendar:
+    """Sessions open at 14:31 and close at 21:00 UTC
+    """
+    def minute_to_session_label(self, dt):
+        return dt.normalize()
+
+    def session_close(self, label):
+        return label + pd.Timedelta(hours=21)
+
+
+class ChannelTest(unittest.TestCase):
+    """Test the bounded multi-subscriber channel
+    """
+
+    def testNoSubscribers(self):
+        seen = []
+        channel = Channel(consumer=seen.append, capacity=4)
+        for i in range(100):
+            channel.give(i)
+        self.assertEqual(seen, list(range(100)))
+        self.assertEqual(channel.ring, [None] * 4)
+
+    def testIndependentSubscribers(self):
+        channel = Channel(capacity=8)
+        subs = [channel.subscribe() for _ in range(3)]
+        results = [[] for _ in subs]
+        readers = [threading.Thread(target=lambda s=s, r=r: r.extend(s))
+                   for s, r in zip(subs, results)]
+        for reader in readers:
+            reader.start()
+        for i in range(1000):
+            channel.give(i)
+        channel.close()
+        for reader in readers:
+            reader.join()
+
+        for result in results:
+            self.assertEqual(result, list(range(1000)))
+        self.assertEqual(channel.stats()['delivered'], 3000)
+        self.assertEqual(channel.dropped, 0)
+        self.assertEqual(channel.ring, [None] * 8)
+
+    def testDropOldest(self):
+        channel = Channel(capacity=4, overflow=Overflow.DROP_OLDEST)
+        sub = channel.subscribe()
+        for i in range(10):
+            channel.give(i)
+        channel.close()
+        self.assertEqual(list(sub), [6, 7, 8, 9])
+        self.assertEqual(sub.dropped, 6)
+        self.assertEqual(channel.dropped, 6)
+
+    def testCoalesceLatest(self):
+        channel = Channel(capacity=4, overflow=Overflow.COALESCE_LATEST)
+        slow, fast = channel.subscribe(), channel.subscribe()
+        got = []
+        for i in range(10):
+            channel.give(i)
+            got.append(fast.take())
+        # Items skipped by the slow subscriber are not kept
+        self.assertEqual(channel.ring, [8, 9, None, None])
+        channel.close()
+        self.assertEqual(got, list(range(10)))
+        self.assertEqual(list(slow), [8, 9])
+        self.assertEqual(slow.dropped, 8)
+        self.assertEqual(fast.dropped, 0)
+
+    def testBlockAndUnsubscribe(self):
+        channel = Channel(capacity=2)
+        sub = channel.subscribe()
+        channel.give(0)
+        channel.give(1)
+        giver = threading.Thread(target=channel.give, args=(2,))
+        giver.start()
+        giver.join(0.05)
+        self.assertTrue(giver.is_alive())
+
+        sub.close()
+        giver.join()
+        self.assertEqual(channel.stats()['pending'], 0)
+
+
+class BarSamplerTest(unittest.TestCase):
+    """Test which bars get emitted
+    """
+
+    def minutes(self, days=2):
+        day = pd.Timestamp('2012-01-03 14:31', tz='UTC')
+        return [day + pd.Timedelta(days=d, minutes=m)
+                for d in range(days) for m in range(390)]
+
+    def testEveryBar(self):
+        sampler = BarSampler('bar')
+        self.assertTrue(all(sampler(dt) for dt in self.minutes()))
+
+    def testEndOfDay(self):
+        sampler = BarSampler('eod', FakeCalendar())
+        emitted = [dt for dt in self.minutes() if sampler(dt)]
+        self.assertEqual([str(dt.time()) for dt in emitted],
+                         ['21:00:00', '21:00:00'])
+
+    def testMinutes(self):
+        sampler = BarSampler('15m')
+        emitted = [dt for dt in self.minutes(days=1) if sampler(dt)]
+        self.assertEqual(len(emitted), 27)
+        self.assertEqual(emitted[1] - emitted[0], pd.Timedelta(minutes=14))
+        self.assertEqual(emitted[2] - emitted[1], pd.Timedelta(minutes=15))
+
+    def testInvalid(self):
+        for spec in ['hourly', '0m', 'eod']:
+            with self.assertRaises(ValueError):
+                BarSampler(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
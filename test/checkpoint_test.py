@@ -0,0 +1,70 @@
+import unittest
+import os
+import tempfile
+import pandas as pd
+from checkpoint import Checkpointer, CheckpointStore
+
+
+def session(day):
+    return pd.Timestamp('2012-01-01', tz='UTC') + pd.Timedelta(days=day)
+
+
+class CheckpointTest(unittest.TestCase):
+    """Test checkpoint chains and their lookup
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = CheckpointStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_sessions(self, checkpointer, first, last):
+        for day in range(first, last + 1):
+            checkpointer(session(day), lambda day=day: {'day': day})
+            checkpointer.add((day, 100.0 + day, 0.0, 0.0))
+
+    def testKeyIgnoresEnd(self):
+        args = ('code', 'zipline', '2012-01-01', 100000, 'daily', 'ts')
+        self.assertEqual(CheckpointStore.key(*args),
+                         CheckpointStore.key(*args))
+        self.assertNotEqual(CheckpointStore.key(*args),
+                            CheckpointStore.key('code2', *args[1:]))
+
+    def testLatest(self):
+        self.run_sessions(Checkpointer(self.store, 'k', every=5), 0, 12)
+        self.assertEqual(self.store.sessions('k'), [session(5), session(10)])
+
+        checkpoint, records = self.store.latest('k', session(0), session(30))
+        self.assertEqual(checkpoint['session'], session(10))
+        self.assertEqual(checkpoint['state'], {'day': 10})
+        self.assertEqual(list(records['timestamp']), list(range(10)))
+
+        # A run ending earlier can only use the earlier checkpoint
+        checkpoint, records = self.store.latest('k', session(0), session(7))
+        self.assertEqual(checkpoint['session'], session(5))
+        self.assertEqual(len(records), 5)
+
+        self.assertIsNone(self.store.latest('k', session(0), session(3)))
+        self.assertIsNone(self.store.latest('other', session(0), session(30)))
+
+    def testResumeExtendsChain(self):
+        self.run_sessions(Checkpointer(self.store, 'k', every=5), 0, 7)
+        checkpoint, _ = self.store.latest('k', session(0), session(30))
+
+        resumed = Checkpointer(self.store, 'k', every=5,
+                               prev=checkpoint['session'])
+        self.run_sessions(resumed, 5, 16)
+        checkpoint, records = self.store.latest('k', session(0), session(30))
+        self.assertEqual(checkpoint['session'], session(15))
+        self.assertEqual(list(records['timestamp']), list(range(15)))
+
+    def testBrokenChain(self):
+        self.run_sessions(Checkpointer(self.store, 'k', every=5), 0, 12)
+        os.remove(self.store.path('k', session(5)))
+        self.assertIsNone(self.store.latest('k', session(0), session(30)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import unittest
+import asyncio
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+import tornado.websocket
+from base import FrameWriter, MsgType
+from displayserver import ClientQueue, PlotHistory, SlowClient, \
+    WebDisplayServerThread
+from records import PORTFOLIO_DTYPE
+from util import getFreePort
+
+
+class StalledSocket:
+    """A connection whose writes complete only when released
+    """
+    def __init__(self):
+        self.sent = []
+        self.writes = []
+        self.closedWith = None
+
+    def write_message(self, text):
+        self.sent.append(json.loads(text))
+        future = asyncio.get_running_loop().create_future()
+        self.writes.append(future)
+        return future
+
+    def close(self, code=None, reason=None):
+        self.closedWith = code
+
+    def release(self):
+        for future in self.writes:
+            if not future.done():
+                future.set_result(None)
+
+
+def updates(plot, *values):
+    return {'type': 'Updates', 'plot': plot,
+            'points': [{'v': v} for v in values]}
+
+
+class ClientQueueTest(unittest.TestCase):
+    """Test the per-client queues of slow browser connections
+    """
+
+    def testCoalesce(self):
+        async def main():
+            socket = StalledSocket()
+            stats = {}
+            queue = ClientQueue(socket, SlowClient.COALESCE, maxPending=3,
+                                stats=stats)
+            shared = updates(1, 0)
+            queue.push(shared)
+            while not socket.sent:
+                await asyncio.sleep(0)
+            # The first message is out, the rest wait behind it
+            queue.push({'type': 'Init', 'plot': 2})
+            for v in range(1, 4):
+                queue.push(updates(1, v))
+                queue.push(updates(2, v))
+            self.assertEqual(stats['coalesced'], 4)
+            self.assertEqual(len(socket.sent), 1)
+
+            while queue.pending or queue.sending:
+                socket.release()
+                await asyncio.sleep(0)
+            socket.release()
+            return socket, shared
+
+        socket, shared = asyncio.run(main())
+        self.assertIsNone(socket.closedWith)
+        self.assertEqual(shared['points'], [{'v': 0}])
+        points = {}
+        for msg in socket.sent:
+            points.setdefault(msg['plot'], []).extend(
+                p['v'] for p in msg.get('points', ()))
+        self.assertEqual(points, {1: [0, 1, 2, 3], 2: [1, 2, 3]})
+        self.assertEqual(len(socket.sent), 4)
+
+    def testCoalesceViews(self):
+        async def main():
+            socket = StalledSocket()
+            queue = ClientQueue(socket, SlowClient.COALESCE, maxPending=2)
+            queue.push({'type': 'Init', 'plot': 1})
+            for offset, values in ((0, [1, 2, 3]), (2, [4, 5]), (1, [6])):
+                queue.push({'type': 'View', 'plot': 1, 'from': offset,
+                            'seqs': values, 'points': values})
+            queue.push({'type': 'View', 'plot': 1, 'from': 2,
+                        'seqs': [7], 'points': [7]})
+            return list(queue.pending)
+
+        pending = asyncio.run(main())
+        self.assertEqual([m['type'] for m, _ in pending], ['Init', 'View'])
+        view, _ = pending[1]
+        self.assertEqual((view['from'], view['points']), (0, [1, 6, 7]))
+
+    def testDrop(self):
+        async def main():
+            socket = StalledSocket()
+            queue = ClientQueue(socket, SlowClient.COALESCE, maxPoints=5)
+            for v in range(10):
+                queue.push(updates(1, v))
+            return socket, queue
+
+        socket, queue = asyncio.run(main())
+        self.assertEqual(socket.closedWith, 1013)
+        self.assertTrue(queue.closed)
+        self.assertEqual(len(queue.pending), 0)
+
+
+class PlotHistoryTest(unittest.TestCase):
+    """Test the capped columnar history of a plot
+    """
+
+    def testCap(self):
+        history = PlotHistory(cap=4)
+        for v in range(10):
+            point = {'v': v}
+            if v % 2:
+                point['date'] = 'd{}'.format(v)
+            self.assertEqual(history.extend([point]), (v + 1, v + 1))
+        self.assertEqual((history.first, history.last), (7, 10))
+        self.assertLessEqual(history.capacity, 8)
+        snapshot = history.snapshot()
+        self.assertEqual(snapshot['columns'], {'v': [6, 7, 8, 9],
+                                               'date': [None, 'd7', None,
+                                                        'd9']})
+        self.assertEqual(history.snapshot(8)['columns']['v'], [8, 9])
+
+        # A column turns into objects once it holds a string
+        self.assertEqual(history.extend([{'v': 'x'}, 5.5]), (11, 12))
+        self.assertEqual(history.snapshot(10)['columns'],
+                         {'v': ['x', None], 'date': [None, None],
+                          'value': [None, 5.5]})
+
+
+class DisplayServerTest(unittest.TestCase):
+    """Test plots multiplexed over the display server's websocket
+    """
+
+    def setUp(self):
+        self.server = WebDisplayServerThread(getFreePort())
+        self.server.start()
+        self.pipes = []
+
+    def tearDown(self):
+        self.server.stop()
+        for fd in self.pipes:
+            os.close(fd)
+
+    def addPlot(self, title):
+        r, w = os.pipe()
+        self.pipes.append(r)
+        plot = self.server.addPlotter(r, {'title': title})
+        return plot, w
+
+    def run_client(self, client):
+        url = 'ws://localhost:{}/ws'.format(self.server.port)
+
+        async def main():
+            conn = await tornado.websocket.websocket_connect(url)
+
+            async def receive():
+                return json.loads(await conn.read_message())
+            try:
+                return await asyncio.wait_for(client(conn, receive), 10)
+            finally:
+                conn.close()
+        return asyncio.run(main())
+
+    def testMultiplexedPlots(self):
+        first, w1 = self.addPlot('first')
+        second, w2 = self.addPlot('second')
+        threads = threading.active_count()
+
+        async def client(conn, receive):
+            msg = await receive()
+            while len(msg['plots']) < 2:
+                msg = await receive()
+            self.assertEqual(msg['type'], 'Plots')
+            for plot in (first, second):
+                conn.write_message(json.dumps({'type': 'Subscribe',
+                                               'plot': plot.id}))
+            inits = [await receive() for _ in range(4)]
+            self.assertEqual([m['type'] for m in inits],
+                             ['Init', 'Snapshot'] * 2)
+            self.assertEqual([m['title'] for m in inits[::2]],
+                             ['first', 'second'])
+
+            FrameWriter(w1).write(json.dumps({'v': 1}).encode('utf8'))
+            FrameWriter(w2).write(json.dumps([{'v': 2}, {'v': 3}])
+                                  .encode('utf8'))
+            FrameWriter(w2).write(b'ignored', MsgType.TEXT)
+            os.close(w1)
+            os.close(w2)
+            received = {}
+            ended = set()
+            while len(ended) < 2:
+                msg = await receive()
+                if msg['type'] == 'Updates':
+                    received.setdefault(msg['plot'], []).extend(
+                        msg['points'])
+                elif msg['type'] == 'End':
+                    ended.add(msg['plot'])
+            return received
+
+        received = self.run_client(client)
+        self.assertEqual(received, {first.id: [{'v': 1}],
+                                    second.id: [{'v': 2}, {'v': 3}]})
+        self.assertTrue(first.wait(5) and second.wait(5))
+        # No thread per plot
+        self.assertEqual(threading.active_count(), threads)
+
+    def testSubscribeAfterEnd(self):
+        plot, w = self.addPlot('done')
+        os.close(w)
+        self.assertTrue(plot.wait(5))
+
+        async def client(conn, receive):
+            await receive()
+            conn.write_message(json.dumps({'type': 'Subscribe',
+                                           'plot': plot.id}))
+            return [(await receive())['type'] for _ in range(3)]
+
+        self.assertEqual(self.run_client(client), ['Init', 'Snapshot', 'End'])
+
+    def testEvictEnded(self):
+        self.server.server.endedPlots = 2
+        records = np.zeros(10, dtype=PORTFOLIO_DTYPE)
+        plots = [self.server.addRun(records, {'title': str(i)})
+                 for i in range(3)]
+        live, w = self.addPlot('live')
+        for plot in plots:
+            self.assertTrue(plot.wait(5))
+
+        url = 'http://localhost:{}/plot'.format(self.server.port)
+        with urllib.request.urlopen(url) as response:
+            listed = json.loads(response.read())['plots']
+        # The oldest ended plot is gone, the one still running stays
+        self.assertEqual(sorted(plot['plot'] for plot in listed),
+                         sorted([plots[1].id, plots[2].id, live.id]))
+        os.close(w)
+        self.assertTrue(live.wait(5))
+        self.assertEqual(sorted(self.server.server.plots),
+                         sorted([plots[2].id, live.id]))
+
+    def testCatchUp(self):
+        plot, w = self.addPlot('resumed')
+        FrameWriter(w).write(json.dumps([{'v': v} for v in range(5)])
+                             .encode('utf8'))
+        os.close(w)
+        self.assertTrue(plot.wait(5))
+
+        async def client(conn, receive):
+            await receive()
+            snapshots = []
+            for since in (None, 3, 10):
+                conn.write_message(json.dumps({'type': 'Subscribe',
+                                               'plot': plot.id,
+                                               'since': since}))
+                await receive()
+                snapshots.append(await receive())
+                await receive()
+                conn.write_message(json.dumps({'type': 'Unsubscribe',
+                                               'plot': plot.id}))
+            return snapshots
+
+        full, resumed, unknown = self.run_client(client)
+        self.assertEqual(full['columns'], {'v': [0, 1, 2, 3, 4]})
+        self.assertEqual((full['first'], full['seq'], full['reset']),
+                         (1, 5, True))
+        self.assertEqual(resumed['columns'], {'v': [3, 4]})
+        self.assertFalse(resumed['reset'])
+        # A sequence number from elsewhere gets everything
+        self.assertTrue(unknown['reset'])
+        self.assertEqual(unknown['count'], 5)
+
+    def testDownsampled(self):
+        plot, w = self.addPlot('long')
+        FrameWriter(w).write(json.dumps([{'v': v % 7} for v in range(100)])
+                             .encode('utf8'))
+
+        async def client(conn, receive):
+            await receive()
+            conn.write_message(json.dumps({'type': 'Subscribe',
+                                           'plot': plot.id, 'width': 4}))
+            self.assertEqual((await receive())['type'], 'Init')
+            view = []
+            msg = await receive()
+            while msg['type'] != 'End':
+                self.assertEqual(msg['type'], 'View')
+                view[msg['from']:] = msg['points']
+                if msg['seq'] == 100:
+                    os.close(w)
+                msg = await receive()
+            return view
+
+        view = self.run_client(client)
+        self.assertLessEqual(len(view), 8)
+        self.assertEqual(min(p['v'] for p in view), 0)
+        self.assertEqual(max(p['v'] for p in view), 6)
+
+    def testStoredRange(self):
+        records = np.zeros(1000, dtype=PORTFOLIO_DTYPE)
+        records['timestamp'] = (np.datetime64('2012-01-02', 'ns') +
+                                np.arange(1000) * np.timedelta64(1, 'D')
+                                ).view('i8')
+        records['portfolio_value'] = np.arange(1000)
+        plot = self.server.addRun(records, {'title': 'stored'})
+        self.assertTrue(plot.wait(5))
+
+        def get(query):
+            url = 'http://localhost:{}/plot/{}?{}'.format(
+                self.server.port, plot.id, query)
+            with urllib.request.urlopen(url) as response:
+                return json.loads(response.read())
+
+        whole = get('width=10')
+        self.assertEqual((whole['field'], whole['seq']),
+                         ('portfolio_value', 1000))
+        self.assertLessEqual(len(whole['seqs']), 10)
+        self.assertEqual(whole['high'][-1], 999)
+        week = get('from=2013-01-01&to=2013-01-07&width=100')
+        self.assertEqual(week['level'], 0)
+        self.assertEqual(week['value'], list(range(365, 372)))
+        self.assertEqual(get('from=10&to=20')['seqs'], list(range(10, 21)))
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            get('from=someday')
+        self.assertEqual(raised.exception.code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
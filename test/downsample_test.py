@@ -0,0 +1,105 @@
+import unittest
+import numpy as np
+from downsample import MinMaxView, Pyramid, viewBuckets
+
+
+class MinMaxViewTest(unittest.TestCase):
+    """Test min/max downsampling of a growing series
+    """
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).randn(1000).cumsum()
+
+    def build(self, buckets, batch=7):
+        view = MinMaxView(buckets)
+        for lo in range(0, len(self.values), batch):
+            view.add(lo + 1, [{'date': str(i), 'v': float(v)}
+                              for i, v in enumerate(self.values[lo:lo + batch],
+                                                    lo)])
+        return view
+
+    def testBuckets(self):
+        view = self.build(10)
+        self.assertEqual(view.field, 'v')
+        self.assertEqual(view.size, 128)
+        self.assertLessEqual(len(view.buckets), 10)
+        _, seqs, points = view.points()
+        self.assertEqual(seqs, sorted(seqs))
+        for k in range(len(view.buckets)):
+            chunk = self.values[k * view.size:(k + 1) * view.size]
+            shown = [p['v'] for s, p in zip(seqs, points)
+                     if (s - 1) // view.size == k]
+            self.assertEqual(sorted(shown), [chunk.min(), chunk.max()])
+        self.assertIn(self.values.max(), [p['v'] for p in points])
+
+    def testIncremental(self):
+        view = MinMaxView(4)
+        self.assertEqual(view.add(1, [1.0, 5.0]), 0)
+        self.assertEqual(view.add(3, [2.0, None, 'x']), 2)
+        self.assertEqual(view.points(2), (2, [3], [2.0]))
+        # Points past the last bucket merge the buckets
+        self.assertEqual(view.add(6, [0.0, 9.0, 3.0]), 0)
+        self.assertEqual(view.size, 2)
+        self.assertEqual(view.points(), (0, [1, 2, 3, 6, 7, 8],
+                                         [1.0, 5.0, 2.0, 0.0, 9.0, 3.0]))
+
+    def testCoarsened(self):
+        coarse = self.build(64).coarsened(10)
+        self.assertEqual(coarse.points(), self.build(10).points())
+        self.assertEqual(viewBuckets(500), 500)
+        self.assertEqual(viewBuckets(10 ** 6, 1), 2048)
+
+
+class PyramidTest(unittest.TestCase):
+    """Test the levels of detail of a series
+    """
+
+    def setUp(self):
+        self.values = np.random.RandomState(1).randn(5000).cumsum()
+        self.times = (np.datetime64('2012-01-03', 'ns') +
+                      np.arange(5000) * np.timedelta64(1, 'm')).view('i8')
+
+    def testIncremental(self):
+        live = Pyramid()
+        lo = 0
+        for n in (1, 3, 500, 7, 2000, 2489):
+            live.extend(lo + 1, self.values[lo:lo + n],
+                        self.times[lo:lo + n])
+            lo += n
+        stored = Pyramid()
+        stored.extend(1, self.values, self.times)
+        self.assertEqual([level.size for level in live.levels],
+                         [5000, 1250, 313, 79, 20, 5, 2])
+        for a, b in zip(live.levels, stored.levels):
+            for name, _ in a.fields:
+                np.testing.assert_array_equal(a[name], b[name])
+
+    def testRange(self):
+        pyramid = Pyramid()
+        pyramid.extend(1, self.values, self.times)
+        result = pyramid.range(1, 5000, 100)
+        self.assertEqual((result['level'], result['factor']), (3, 64))
+        self.assertEqual(len(result['seqs']), 79)
+        bucket = self.values[64:128]
+        self.assertEqual([result[name][1] for name in
+                          ('open', 'high', 'low', 'close')],
+                         [bucket[0], bucket.max(), bucket.min(), bucket[-1]])
+        self.assertEqual(result['times'][1], '2012-01-03T01:04:00.000000000')
+
+        # A narrow range comes from level 0
+        result = pyramid.range(101, 110, 100)
+        self.assertEqual(result['seqs'], list(range(101, 111)))
+        self.assertEqual(result['value'], self.values[100:110].tolist())
+        self.assertEqual(pyramid.range(6000, 7000, 10)['seqs'], [])
+
+        self.assertEqual(pyramid.locate(self.times[50]), 51)
+        self.assertEqual(pyramid.locate(self.times[50] + 1), 52)
+        self.assertEqual(pyramid.locate(self.times[50] + 1, after=False), 51)
+        untimed = Pyramid()
+        untimed.extend(1, [1.0, np.nan])
+        self.assertEqual(untimed.range(1, 2, 10)['value'], [1.0, None])
+        self.assertRaises(ValueError, untimed.locate, self.times[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
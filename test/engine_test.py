@@ -0,0 +1,162 @@
+import unittest
+import functools
+import operator
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+from zipline.data import bundles
+from zipline.finance.trading import TradingEnvironment
+import engine
+from engine import ZiplineEngine, metricKey, restoreMetric, resumable
+from ingest import localBundle
+
+# Holds 100 shares and a buy limit order too low to ever fill
+SPLIT_ALGO = """
+from zipline.api import order, symbol
+
+
+def initialize(context):
+    context.ordered = False
+
+
+def handle_data(context, data):
+    if not context.ordered:
+        order(symbol('AAA'), 100)
+        order(symbol('AAA'), 50, limit_price=1.0)
+        context.ordered = True
+"""
+
+
+class MaxLeverage:
+    """A metric keeping a scalar and an array per session
+    """
+    def __init__(self, field):
+        self._get = operator.attrgetter(field)
+        self._function = np.nanmax
+
+    def start_of_simulation(self, sessions):
+        self._max = 0.0
+        self._leverages = np.full(sessions, np.nan)
+        self._returns = pd.Series(np.nan, index=range(sessions))
+
+
+class MetricStateTest(unittest.TestCase):
+    """Test carrying metrics over to a resumed run
+    """
+
+    def testKey(self):
+        self.assertEqual(metricKey(MaxLeverage('account.leverage')),
+                         metricKey(MaxLeverage('account.leverage')))
+        self.assertNotEqual(metricKey(MaxLeverage('account.leverage')),
+                            metricKey(MaxLeverage('portfolio.pnl')))
+
+    def testRestore(self):
+        old = MaxLeverage('account.leverage')
+        old.start_of_simulation(4)
+        old._max = 2.0
+        old._leverages[:2] = [1.0, 2.0]
+        old._returns[:2] = [0.1, 0.2]
+
+        # The resumed run ends later
+        new = MaxLeverage('account.leverage')
+        new.start_of_simulation(6)
+        restoreMetric(new, dict(vars(old)), 2)
+        self.assertEqual(new._max, 2.0)
+        np.testing.assert_array_equal(new._leverages[:3], [1.0, 2.0, np.nan])
+        self.assertEqual(len(new._leverages), 6)
+        self.assertEqual(list(new._returns[:2]), [0.1, 0.2])
+
+    def testResumable(self):
+        self.assertTrue(resumable({'metrics': {}}))
+        self.assertFalse(resumable({'metrics': None}))
+        self.assertFalse(resumable({'portfolio': {}}))
+
+
+
+def flatMarketData(trading_day, trading_days, bm_symbol):
+    """A benchmark that never moves and zero rates, instead of downloads
+    """
+    returns = pd.Series(0.0, index=trading_days)
+    curves = pd.DataFrame(0.0, index=trading_days,
+                          columns=['1month', '3month', '6month', '1year',
+                                   '2year', '3year', '5year', '7year',
+                                   '10year', '20year', '30year'])
+    return returns, curves
+
+
+class ResumeTest(unittest.TestCase):
+    """Test resuming a run from a checkpoint taken before a split and an
+    ex-dividend date
+    """
+    BUNDLE = 'engine-test'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        environ = {'ZIPLINE_ROOT': os.path.join(self.root, 'zipline')}
+        directory = os.path.join(self.root, 'bundle')
+        os.makedirs(os.path.join(directory, 'daily'))
+
+        self.engine = ZiplineEngine(self.BUNDLE, 'XNYS', environ)
+        calendar = self.engine.trading_calendar
+        self.sessions = calendar.sessions_in_range(
+            pd.Timestamp('2012-01-03', tz='UTC'),
+            pd.Timestamp('2012-01-31', tz='UTC'))
+        # 2:1 split and a dividend on the tenth session
+        close = np.where(np.arange(len(self.sessions)) < 10, 10.0, 5.0)
+        bars = pd.DataFrame({'date': self.sessions.tz_localize(None),
+                             'open': close, 'high': close, 'low': close,
+                             'close': close, 'volume': 1e6,
+                             'split': 1.0, 'dividend': 0.0})
+        bars.loc[10, 'split'] = 2.0
+        bars.loc[10, 'dividend'] = 0.25
+        bars.to_csv(os.path.join(directory, 'daily', 'AAA.csv'),
+                    index=False)
+
+        bundles.register(self.BUNDLE, localBundle(directory, 1),
+                         calendar_name='XNYS',
+                         start_session=self.sessions[0],
+                         end_session=self.sessions[-1])
+        bundles.ingest(self.BUNDLE, environ, show_progress=False)
+        patcher = mock.patch.object(
+            engine, 'TradingEnvironment',
+            functools.partial(TradingEnvironment, load=flatMarketData))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        bundles.unregister(self.BUNDLE)
+        shutil.rmtree(self.root)
+
+    def testSplitOnCheckpointSession(self):
+        split = self.sessions[10]
+        saved = {}
+
+        def checkpoint(session, getState):
+            if session == split:
+                saved['state'] = pickle.loads(pickle.dumps(getState()))
+
+        full = self.engine.run(SPLIT_ALGO, self.sessions[0],
+                               self.sessions[-1], checkpoint=checkpoint)
+        state = saved['state']
+        # Taken before the split: 100 shares at 10, the order at 1.0
+        position, = state['position_tracker'].positions.values()
+        self.assertEqual(position.amount, 100)
+        (limit,), = state['open_orders'].values()
+        self.assertEqual(limit.limit, 1.0)
+
+        resumed = self.engine.run(SPLIT_ALGO, split, self.sessions[-1],
+                                  resumeFrom=state)
+        for column in ('portfolio_value', 'ending_cash', 'pnl',
+                       'returns', 'sharpe'):
+            self.assertAlmostEqual(resumed[column].iloc[-1],
+                                   full[column].iloc[-1], msg=column)
+        self.assertEqual(resumed['positions'].iloc[-1],
+                         full['positions'].iloc[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
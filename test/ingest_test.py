@@ -0,0 +1,272 @@
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from trading_calendars import get_calendar
+from zipline.data import bundles
+from ingest import AppendedBarReader, LocalIngester, Segment, appendBundle, \
+    assetFiles, loadBundle, localBundle, readBars, registerLocalBundle
+
+OHLCV_CSV = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class FakeCalendar:
+    """Weekday sessions, trading 14:31 to 14:35 UTC
+    """
+    name = 'FAKE'
+
+    def sessions_in_range(self, start, end):
+        return pd.bdate_range(start, end, tz='UTC')
+
+    def minutes_for_sessions_in_range(self, start, end):
+        return pd.DatetimeIndex([
+            session + pd.Timedelta(hours=14, minutes=m)
+            for session in self.sessions_in_range(start, end)
+            for m in range(31, 36)])
+
+
+class FakeReader:
+    """Daily bars where every close is the reader's value
+    """
+    def __init__(self, value, last):
+        self.value = value
+        self.last = last
+        self.first_trading_day = pd.Timestamp('2012-01-02', tz='UTC')
+        self.last_available_dt = last
+
+    def load_raw_arrays(self, columns, start, end, assets):
+        rows = len(FakeCalendar().sessions_in_range(start, end))
+        return [np.full((rows, len(assets)), self.value) for _ in columns]
+
+    def get_value(self, sid, dt, field):
+        return self.value
+
+    def get_last_traded_dt(self, asset, dt):
+        return min(dt, self.last)
+
+
+class Writer:
+    def write(self, data=None, show_progress=False, **kwargs):
+        self.data = list(data) if data is not None else None
+        self.kwargs = kwargs
+
+
+class IngestTest(unittest.TestCase):
+    """Test the local CSV bundle ingester
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'daily'))
+        os.makedirs(os.path.join(self.root, 'minute'))
+
+        dates = pd.bdate_range('2012-01-02', periods=10)
+        bars = pd.DataFrame({'Date': dates, 'Open': 10.0, 'High': 11.0,
+                             'Low': 9.0, 'Close': np.arange(10) + 10.0,
+                             'Volume': 1000})
+        bars['split'] = 1.0
+        bars.loc[5, 'split'] = 2.0
+        bars['dividend'] = 0.0
+        bars.loc[7, 'dividend'] = 0.5
+        # A gap and a weekend row that is not a session
+        weekend = bars.iloc[[0]].assign(Date=pd.Timestamp('2012-01-07'))
+        pd.concat([bars.drop(3), weekend]).to_csv(
+            os.path.join(self.root, 'daily', 'aaa.csv'), index=False)
+        bars[OHLCV_CSV].iloc[2:].to_csv(
+            os.path.join(self.root, 'daily', 'BBB.csv.gz'), index=False)
+
+        minutes = pd.DatetimeIndex(['2012-01-03 14:31', '2012-01-03 14:33',
+                                    '2012-01-03 20:00'])
+        pd.DataFrame({'dt': minutes, 'open': 1.0, 'high': 1.0, 'low': 1.0,
+                      'close': 1.0, 'volume': 5}).to_csv(
+            os.path.join(self.root, 'minute', 'CCC.csv'), index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testAssetFiles(self):
+        files = assetFiles(os.path.join(self.root, 'daily'))
+        self.assertEqual(sorted(files), ['AAA', 'BBB'])
+        self.assertEqual(assetFiles(os.path.join(self.root, 'none')), {})
+
+    def testMissingColumn(self):
+        path = os.path.join(self.root, 'bad.csv')
+        pd.DataFrame({'date': ['2012-01-03'], 'close': [1.0]}).to_csv(path)
+        with self.assertRaises(ValueError):
+            readBars(path)
+
+    def testIngest(self):
+        writers = [Writer() for _ in range(4)]
+        assets, minute, daily, adjustments = writers
+        summary = LocalIngester(self.root, workers=2).ingest(
+            assets, minute, daily, adjustments, FakeCalendar(),
+            pd.Timestamp('2012-01-02', tz='UTC'),
+            pd.Timestamp('2012-03-01', tz='UTC'))
+
+        self.assertEqual(summary['assets'], 3)
+        self.assertEqual(summary['daily_rows'], 10 + 8)
+        self.assertEqual(summary['minute_rows'], 3)
+        self.assertGreater(summary['rows_per_second'], 0)
+
+        (sidA, aaa), (sidB, bbb) = daily.data
+        self.assertEqual((sidA, sidB), (0, 1))
+        self.assertEqual(len(aaa), 10)
+        self.assertEqual(aaa['close'].iloc[3], 0.0)
+        self.assertEqual(aaa['close'].iloc[4], 14.0)
+        self.assertEqual(bbb.index[0], pd.Timestamp('2012-01-04', tz='UTC'))
+
+        (sidC, ccc), = minute.data
+        self.assertEqual(sidC, 2)
+        self.assertEqual(len(ccc), 2)
+
+        equities = assets.kwargs['equities']
+        self.assertEqual(list(equities['symbol']), ['AAA', 'BBB', 'CCC'])
+        self.assertEqual(equities.loc[2, 'start_date'],
+                         pd.Timestamp('2012-01-03', tz='UTC'))
+
+        splits = adjustments.kwargs['splits']
+        self.assertEqual(list(splits['ratio']), [0.5])
+        self.assertEqual(splits['effective_date'][0],
+                         pd.Timestamp('2012-01-09', tz='UTC'))
+        dividends = adjustments.kwargs['dividends']
+        self.assertEqual(list(dividends['amount']), [0.5])
+
+    def testKeepSids(self):
+        ingester = LocalIngester(self.root, workers=1, sids={'BBB': 7})
+        self.assertEqual(ingester.sids, {'AAA': 8, 'BBB': 7, 'CCC': 9})
+        self.assertEqual(ingester.names[7], 'BBB')
+
+
+class AppendedBarReaderTest(unittest.TestCase):
+    """Test reads across an ingestion and its appended delta
+    """
+
+    def setUp(self):
+        day = lambda d: pd.Timestamp(d, tz='UTC')
+        self.reader = AppendedBarReader([
+            Segment(FakeReader(1.0, day('2012-01-06')), None,
+                    day('2012-01-02'), day('2012-01-06')),
+            Segment(FakeReader(2.0, day('2012-01-10')), frozenset([0]),
+                    day('2012-01-09'), day('2012-01-10')),
+        ], FakeCalendar())
+
+    def testLoadRawArrays(self):
+        close, volume = self.reader.load_raw_arrays(
+            ['close', 'volume'], pd.Timestamp('2012-01-05', tz='UTC'),
+            pd.Timestamp('2012-01-11', tz='UTC'), [0, 1])
+        np.testing.assert_array_equal(close[:, 0],
+                                      [1.0, 1.0, 2.0, 2.0, np.nan])
+        # The delta does not hold sid 1
+        np.testing.assert_array_equal(close[:, 1],
+                                      [1.0, 1.0, np.nan, np.nan, np.nan])
+        self.assertEqual(volume[-1, 0], 0.0)
+
+    def testGetValue(self):
+        at = pd.Timestamp('2012-01-10', tz='UTC')
+        self.assertEqual(self.reader.get_value(0, at, 'close'), 2.0)
+        self.assertTrue(np.isnan(self.reader.get_value(1, at, 'close')))
+        self.assertEqual(self.reader.get_value(1, at, 'volume'), 0)
+        self.assertEqual(self.reader.get_last_traded_dt(1, at),
+                         pd.Timestamp('2012-01-06', tz='UTC'))
+        self.assertEqual(self.reader.last_available_dt,
+                         pd.Timestamp('2012-01-10', tz='UTC'))
+
+
+
+class LoadBundleTest(unittest.TestCase):
+    """Test loading a local bundle ingested, then appended to
+    """
+    BUNDLE = 'ingest-test'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.environ = {'ZIPLINE_ROOT': os.path.join(self.root, 'zipline')}
+        self.directory = os.path.join(self.root, 'bundle')
+        os.makedirs(os.path.join(self.directory, 'daily'))
+        self.calendar = get_calendar('XNYS')
+        self.sessions = self.calendar.sessions_in_range(
+            pd.Timestamp('2012-01-03', tz='UTC'),
+            pd.Timestamp('2012-01-31', tz='UTC'))
+
+        self.writeBars(self.sessions[:10])
+        bundles.register(self.BUNDLE, localBundle(self.directory, 1),
+                         calendar_name='XNYS',
+                         start_session=self.sessions[0],
+                         end_session=self.sessions[9])
+        bundles.ingest(self.BUNDLE, self.environ, show_progress=False)
+
+    def tearDown(self):
+        bundles.unregister(self.BUNDLE)
+        shutil.rmtree(self.root)
+
+    def writeBars(self, sessions):
+        pd.DataFrame({'date': sessions.tz_localize(None), 'open': 10.0,
+                      'high': 11.0, 'low': 9.0,
+                      'close': np.arange(len(sessions)) + 10.0,
+                      'volume': 1000}).to_csv(
+            os.path.join(self.directory, 'daily', 'AAA.csv'), index=False)
+
+    def testAppended(self):
+        base, = bundles.ingestions_for_bundle(self.BUNDLE, self.environ)
+        self.writeBars(self.sessions)
+        summary = appendBundle(self.BUNDLE, self.directory, 'XNYS',
+                               self.environ, workers=1)
+        self.assertEqual(summary['start'], str(self.sessions[10].date()))
+
+        data = loadBundle(self.BUNDLE, self.calendar, self.environ)
+        daily = data.equity_daily_bar_reader
+        self.assertIsInstance(daily, AppendedBarReader)
+        self.assertEqual(daily.last_available_dt, self.sessions[-1])
+        close, = daily.load_raw_arrays(
+            ['close'], self.sessions[0], self.sessions[-1],
+            data.asset_finder.retrieve_all([0]))
+        np.testing.assert_array_equal(
+            close[:, 0], np.arange(len(self.sessions)) + 10.0)
+
+        # The ingestion appended to still loads as it was
+        data = loadBundle(self.BUNDLE, self.calendar, self.environ, base)
+        self.assertNotIsInstance(data.equity_daily_bar_reader,
+                                 AppendedBarReader)
+        self.assertEqual(data.equity_daily_bar_reader.last_available_dt,
+                         self.sessions[9])
+
+
+
+class LocalBundlesTest(unittest.TestCase):
+    """Test that local bundles stay registered in later processes
+    """
+    BUNDLE = 'ingest-test-local'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'bundles.json')
+
+    def tearDown(self):
+        if self.BUNDLE in bundles.bundles:
+            bundles.unregister(self.BUNDLE)
+        shutil.rmtree(self.root)
+
+    def testFreshProcess(self):
+        registerLocalBundle(self.BUNDLE, self.root, 'XLON', path=self.path)
+        self.assertEqual(bundles.bundles[self.BUNDLE].calendar_name, 'XLON')
+
+        script = '\n'.join([
+            'from zipline.data import bundles',
+            'from ingest import registerLocalBundles',
+            'print(registerLocalBundles({!r}))'.format(self.path),
+            'print(bundles.bundles[{!r}].calendar_name)'.format(self.BUNDLE),
+        ])
+        out = subprocess.run(
+            [sys.executable, '-c', script], check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertEqual(out.splitlines(),
+                         [repr([self.BUNDLE]), 'XLON'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import os
+import select
+import time
+from jobs import CANCELLED, DONE, FAILED, JobScheduler
+
+
+def square(x):
+    return x * x
+
+
+def started(delay=0.0):
+    time.sleep(delay)
+    return time.time()
+
+
+def spin():
+    while True:
+        pass
+
+
+def allocate(size):
+    return len(bytearray(size))
+
+
+def affinity():
+    return os.sched_getaffinity(0)
+
+
+class JobSchedulerTest(unittest.TestCase):
+    """Test the backtest job scheduler
+    """
+
+    def setUp(self):
+        self.scheduler = JobScheduler(workers=1)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def testResults(self):
+        jobs = [self.scheduler.submit(square, (i,)) for i in range(5)]
+        for i, job in enumerate(jobs):
+            self.assertIs(self.scheduler.wait(job.id, timeout=30), job)
+            self.assertEqual(job.state, DONE)
+            self.assertEqual(job.result, i * i)
+        self.assertEqual(len(self.scheduler.list()), 5)
+
+        failed = self.scheduler.wait(
+            self.scheduler.submit(square, ('x',)).id, timeout=30)
+        self.assertEqual(failed.state, FAILED)
+        self.assertIn('TypeError', failed.error)
+
+    def testPriority(self):
+        blocker = self.scheduler.submit(started, (0.5,))
+        low = self.scheduler.submit(started, priority=-1)
+        normal = self.scheduler.submit(started)
+        high = self.scheduler.submit(started, priority=5)
+        for job in (blocker, low, normal, high):
+            self.scheduler.wait(job.id, timeout=30)
+        self.assertLess(high.result, normal.result)
+        self.assertLess(normal.result, low.result)
+
+    def testCancel(self):
+        running = self.scheduler.submit(spin)
+        queued = self.scheduler.submit(square, (3,))
+        while running.state != 'running':
+            time.sleep(0.01)
+        time.sleep(0.2)
+
+        self.assertTrue(self.scheduler.cancel(queued.id))
+        self.assertTrue(self.scheduler.cancel(running.id))
+        self.assertEqual(self.scheduler.wait(running.id, 10).state,
+                         CANCELLED)
+        self.assertEqual(queued.state, CANCELLED)
+        self.assertFalse(self.scheduler.cancel(queued.id))
+
+        # The slot replaces the killed worker
+        after = self.scheduler.submit(square, (4,))
+        self.assertEqual(self.scheduler.wait(after.id, 30).result, 16)
+
+    def testLease(self):
+        blocker = self.scheduler.submit(started, (0.3,))
+        while blocker.state != 'running':
+            time.sleep(0.01)
+        with self.scheduler.lease(name='shell') as lease:
+            # Granted only once the job gave the slot back
+            self.assertEqual(blocker.state, DONE)
+            self.assertEqual(lease.state, 'running')
+            job = self.scheduler.submit(square, (2,))
+            time.sleep(0.2)
+            self.assertEqual(job.state, 'queued')
+            self.assertFalse(self.scheduler.cancel(lease.id))
+        self.assertEqual(lease.state, DONE)
+        self.assertEqual(self.scheduler.wait(job.id, 30).result, 4)
+
+    def testCompleted(self):
+        jobs = [self.scheduler.submit(square, (i,)) for i in range(3)]
+        jobs.append(self.scheduler.submit(square, ('x',)))
+        done = list(self.scheduler.completed(jobs))
+        self.assertCountEqual(done, jobs)
+        self.assertEqual([job.state for job in done],
+                         [DONE, DONE, DONE, FAILED])
+
+    def testCpuTimeLimit(self):
+        job = self.scheduler.submit(spin, cpuTime=1)
+        self.scheduler.wait(job.id, timeout=30)
+        self.assertEqual(job.state, FAILED)
+        self.assertIn('CPU time', job.error)
+
+    def testMemoryLimit(self):
+        job = self.scheduler.submit(allocate, (1 << 34,), memory=1 << 32)
+        self.scheduler.wait(job.id, timeout=30)
+        self.assertEqual(job.state, FAILED)
+        self.assertIn('MemoryError', job.error)
+
+        # Limits only hold for the job they were given to
+        job = self.scheduler.submit(allocate, (1 << 20,))
+        self.assertEqual(self.scheduler.wait(job.id, 30).result, 1 << 20)
+
+    def testAffinity(self):
+        cpu = min(os.sched_getaffinity(0))
+        job = self.scheduler.submit(affinity, cpus={cpu})
+        self.assertEqual(self.scheduler.wait(job.id, 30).result, {cpu})
+        job = self.scheduler.submit(affinity)
+        self.assertEqual(self.scheduler.wait(job.id, 30).result,
+                         os.sched_getaffinity(0))
+
+    def testPipeReachesEof(self):
+        # Workers must not hold on to pipes the shell opened, or the
+        # reader of a pipeline never sees the end of it
+        r, w = os.pipe()
+        try:
+            job = self.scheduler.submit(square, (3,))
+            self.assertEqual(self.scheduler.wait(job.id, 30).result, 9)
+            os.close(w)
+            ready, _, _ = select.select([r], [], [], 5)
+            self.assertEqual(ready, [r])
+            self.assertEqual(os.read(r, 1), b'')
+        finally:
+            os.close(r)
+
+
+if __name__ == '__main__':
+    unittest.main()
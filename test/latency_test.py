@@ -0,0 +1,67 @@
+import unittest
+import json
+import os
+import random
+from base import FrameWriter, MsgType, frameReader
+from latency import (LatencyHistogram, LatencyStats, StatsReporter,
+                     bucketOf, bucketTop)
+
+
+class LatencyTest(unittest.TestCase):
+    """Test the latency histograms
+    """
+
+    def testBuckets(self):
+        for ns in list(range(200)) + [random.randrange(1, 1 << 50)
+                                      for _ in range(1000)]:
+            i = bucketOf(ns)
+            self.assertLessEqual(ns, bucketTop(i))
+            self.assertLessEqual(bucketTop(i) - ns, ns / 32)
+            if i:
+                self.assertGreater(ns, bucketTop(i - 1))
+
+    def testPercentiles(self):
+        hist = LatencyHistogram()
+        for ns in range(1, 100001):
+            hist.record(ns * 1000)
+        self.assertAlmostEqual(hist.percentile(50), 50e6, delta=50e6 / 32)
+        self.assertAlmostEqual(hist.percentile(99), 99e6, delta=99e6 / 32)
+        self.assertEqual(hist.percentile(100), 100e6)
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 100000)
+        self.assertEqual(summary['max_us'], 1e5)
+
+    def testIntervals(self):
+        stats = LatencyStats()
+        handle_data = stats.wrap('handle_data', lambda x: x + 1)
+        self.assertEqual(handle_data(1), 2)
+        stats.record('write', 5000)
+
+        first = stats.snapshot()
+        self.assertEqual(set(first), {'handle_data', 'write'})
+        stats.record('write', 7000)
+        self.assertEqual(stats.snapshot()['write']['max_us'], 7.0)
+        total = stats.snapshot(total=True)
+        self.assertEqual(total['write']['count'], 2)
+        self.assertEqual(total['handle_data']['count'], 1)
+
+    def testReporter(self):
+        r, w = os.pipe()
+        stats = LatencyStats()
+        reporter = StatsReporter(FrameWriter(w), stats, interval=0.01)
+        for _ in range(10):
+            stats.record('snapshot', 1500)
+        reporter.close()
+        os.close(w)
+
+        frames = list(frameReader(r))
+        os.close(r)
+        self.assertTrue(all(f.msgType == MsgType.STATS for f in frames))
+        reports = [json.loads(f.payload.decode('utf8')) for f in frames]
+        self.assertTrue(reports[-1]['final'])
+        self.assertEqual(
+            reports[-1]['histograms']['snapshot']['count'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
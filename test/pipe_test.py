@@ -1,7 +1,8 @@
 import unittest
 import os
 import json
-from base import MSG_SEP, pipeReader
+from base import (MSG_SEP, FrameDecoder, FrameWriter, MsgType, MyCmd,
+                  frameReader, pipeReader)
 
 
 def fakeDataSource():
@@ -43,3 +44,130 @@ class PipeTest(unittest.TestCase):
                                                                 s,
                                                                 recvs.index(r),
                                                                 r))
+
+    def testReaderSmallReads(self):
+        r, w = os.pipe()
+        sep = b'<>'
+        sends = [b'a' * 10, b'', b'b' * 3000, b'c<', b'>d']
+        os.write(w, b''.join(packet.replace(sep, b'') + sep
+                             for packet in sends) + b'trailing')
+        os.close(w)
+
+        recvs = list(pipeReader(r, sep, readSize=7))
+        os.close(r)
+        self.assertEqual(recvs, [packet.replace(sep, b'') for packet in sends])
+
+    def testReaderManyFramesPerRead(self):
+        r, w = os.pipe()
+        sends = [str(i).encode('utf8') for i in range(1000)]
+        os.write(w, MSG_SEP.join(sends) + MSG_SEP)
+        os.close(w)
+
+        recvs = list(pipeReader(r, MSG_SEP, readSize=1 << 16))
+        os.close(r)
+        self.assertEqual(recvs, sends)
+
+    def testFrames(self):
+        r, w = os.pipe()
+
+        # Payloads may carry the old separator byte and be empty
+        sends = [packet + MSG_SEP for packet in fakeDataSource()]
+        sends += [b'', 'caf\u00e9 \u00ab'.encode('utf8')]
+        writer = FrameWriter(w)
+        for packet in sends:
+            writer.write(packet, MsgType.JSON)
+        writer.write(b'done', MsgType.TEXT)
+        os.close(w)
+
+        recvs = list(frameReader(r, readSize=64))
+        os.close(r)
+        self.assertEqual([f.payload for f in recvs], sends + [b'done'])
+        self.assertEqual([f.seq for f in recvs], list(range(len(sends) + 1)))
+        self.assertEqual(recvs[-1].msgType, MsgType.TEXT)
+
+    def testFramesTruncated(self):
+        r, w = os.pipe()
+        writer = FrameWriter(w)
+        writer.write(b'whole')
+        os.write(w, b'\x00\x00\x00\x10\x01')
+        os.close(w)
+
+        recvs = list(frameReader(r))
+        os.close(r)
+        self.assertEqual([f.payload for f in recvs], [b'whole'])
+
+    def testDecoder(self):
+        r, w = os.pipe()
+        writer = FrameWriter(w)
+        for _ in range(50):
+            writer.write(b'x' * 40)
+        writer.write(b'', MsgType.TEXT)
+        os.close(w)
+        data = os.read(r, 1 << 20)
+        os.close(r)
+
+        decoder = FrameDecoder()
+        recvs = []
+        for i in range(0, len(data), 7):
+            recvs += decoder.feed(data[i:i + 7])
+        self.assertEqual([f.seq for f in recvs], list(range(51)))
+        self.assertEqual(recvs[0].payload, b'x' * 40)
+        self.assertEqual(recvs[-1].msgType, MsgType.TEXT)
+        self.assertEqual(decoder.buf, b'')
+
+
+class PipelineCmd(MyCmd):
+    """A shell with a few toy actions, capturing what reaches stdout
+    """
+    def __init__(self):
+        super(PipelineCmd, self).__init__()
+        self.actions = {
+            'count': self.count,
+            'double': self.double,
+            'fail': self.fail
+        }
+        self.out = []
+        self.errors = []
+
+    def writeTo(self, pipe, buf):
+        self.out.append(buf)
+
+    def perror(self, msg, *args, **kwargs):
+        self.errors.append(msg)
+
+    def count(self, arg, inPipe=None, outPipe=1):
+        writer = FrameWriter(outPipe)
+        for i in range(int(arg)):
+            writer.write(str(i).encode('utf8'), MsgType.TEXT)
+
+    def double(self, arg, inPipe=None, outPipe=1):
+        writer = FrameWriter(outPipe)
+        for frame in frameReader(inPipe):
+            writer.write(frame.payload * 2, frame.msgType)
+
+    def fail(self, arg, inPipe=None, outPipe=1):
+        raise ValueError('boom')
+
+
+class PiperunTest(unittest.TestCase):
+
+    def testStreaming(self):
+        # More data than a pipe buffer holds, so stages must overlap
+        shell = PipelineCmd()
+        shell.piperun('count 20000 | double | double')
+        self.assertEqual(len(shell.out), 20000)
+        self.assertEqual(shell.out[123], b'123123123123\n')
+        self.assertEqual(shell.errors, [])
+
+    def testBrokenStage(self):
+        shell = PipelineCmd()
+        shell.piperun('count 100000 | fail | double')
+        self.assertEqual(shell.out, [])
+        self.assertEqual(len(shell.errors), 1)
+        self.assertIn('boom', shell.errors[0])
+
+    def testUnknownCommand(self):
+        shell = PipelineCmd()
+        shell.piperun('count 3 | nope')
+        self.assertEqual(shell.out, [])
+        self.assertEqual(len(shell.errors), 1)
@@ -0,0 +1,168 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pricestore import STORE_RETENTION, PriceStore, WindowCache, \
+    adjustmentFactors, ffill, mapped
+
+SESSIONS = pd.bdate_range('2012-01-02', periods=10, tz='UTC')
+
+
+class FakeReader:
+    """Bars where close is 100 * sid + session number, volume 1000
+    """
+    def load_raw_arrays(self, columns, start, end, assets):
+        rows = np.arange(len(SESSIONS), dtype='f8')[:, None]
+        close = 100.0 * np.array(assets) + rows
+        close[:3, np.array(assets) == 2] = np.nan
+        close[5, np.array(assets) == 1] = np.nan
+        volume = np.where(np.isnan(close), 0.0, 1000.0)
+        return [volume if column == 'volume' else close
+                for column in columns]
+
+
+class Adjustments:
+    """The tables of a SQLiteAdjustmentReader
+    """
+    def __init__(self, splits=(), dividends=()):
+        self.conn = sqlite3.connect(':memory:')
+        for table in ('splits', 'mergers', 'dividends'):
+            self.conn.execute('CREATE TABLE {} (sid INTEGER, '
+                              'effective_date INTEGER, ratio REAL)'
+                              .format(table))
+        for table, rows in (('splits', splits), ('dividends', dividends)):
+            self.conn.executemany(
+                'INSERT INTO {} VALUES (?, ?, ?)'.format(table),
+                [(sid, pd.Timestamp(day).value // 10 ** 9, ratio)
+                 for sid, day, ratio in rows])
+
+
+class PriceStoreTest(unittest.TestCase):
+    """Test the memory-mapped price store
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = PriceStore.build(os.path.join(self.root, 'bundle'),
+                                      FakeReader(), SESSIONS, [0, 1, 2],
+                                      chunk=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testFfill(self):
+        values = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, 3.0]])
+        np.testing.assert_array_equal(
+            ffill(values), [[np.nan, 1.0], [2.0, 1.0], [2.0, 3.0]])
+
+    def testWindow(self):
+        row = self.store.locate(SESSIONS[6])
+        self.assertEqual(row, 6)
+        self.assertIsNone(self.store.locate(pd.Timestamp('2012-01-07')))
+
+        window = self.store.window('close', row, 3)
+        np.testing.assert_array_equal(window[:, 0], [4.0, 5.0, 6.0])
+        self.assertTrue(mapped(window))
+        window = self.store.window('close', row, 3, [1, 2])
+        self.assertTrue(mapped(window))
+        window = self.store.window('close', row, 3, [2, 0])
+        self.assertFalse(mapped(window))
+        np.testing.assert_array_equal(window[:, 1], [4.0, 5.0, 6.0])
+
+        # Editing a window leaves the store alone
+        window = self.store.window('close', row, 3)
+        window[:] = -1.0
+        np.testing.assert_array_equal(
+            self.store.window('close', row, 3)[:, 0], [4.0, 5.0, 6.0])
+        frame = self.store.frame('close', row, 3, [0, 1])
+        frame.iloc[0, 0] = -1.0
+        self.assertEqual(self.store.frame('close', row, 3, [0, 1]).iloc[0, 0],
+                         4.0)
+
+        # price carries close over the missing bar
+        price = self.store.window('price', row, 3, [1])
+        np.testing.assert_array_equal(price[:, 0], [104.0, 104.0, 106.0])
+
+    def testFrame(self):
+        frame = self.store.frame('close', 4, 2, [2, 0])
+        self.assertEqual(list(frame.columns), [2, 0])
+        self.assertEqual(frame.index[-1], SESSIONS[4])
+        self.assertEqual(frame.loc[SESSIONS[4], 2], 204.0)
+
+    def testReopen(self):
+        store = PriceStore.open(self.store.root, None, SESSIONS, [0, 1, 2])
+        self.assertEqual(store.sids, [0, 1, 2])
+
+        # A newer ingestion leaves the store of a recent one alone...
+        other = os.path.join(self.root, 'other')
+        PriceStore.open(other, FakeReader(), SESSIONS, [0])
+        self.assertTrue(os.path.exists(self.store.root))
+
+        # ...and deletes it once unused for long, while runs that have
+        # it open keep reading it
+        past = time.time() - STORE_RETENTION - 60
+        os.utime(self.store.root, (past, past))
+        PriceStore.open(other, None, SESSIONS, [0])
+        self.assertFalse(os.path.exists(self.store.root))
+        np.testing.assert_array_equal(store.window('close', 6, 3)[:, 0],
+                                      [4.0, 5.0, 6.0])
+
+    def testFactors(self):
+        entries = [(2, 1, 0.5, True), (4, 1, 0.9, False), (4, 3, 0.1, True)]
+        np.testing.assert_allclose(
+            adjustmentFactors(entries, 5, range(0, 2))[:, 1],
+            [0.45, 0.45, 0.9, 0.9, 1.0])
+        np.testing.assert_array_equal(
+            adjustmentFactors(entries, 5, range(0, 2), volume=True)[:, 1],
+            [2.0, 2.0, 1.0, 1.0, 1.0])
+
+    def testAdjustments(self):
+        store = PriceStore.build(
+            os.path.join(self.root, 'adjusted'), FakeReader(), SESSIONS,
+            [0, 1, 2], Adjustments(splits=[(0, SESSIONS[5], 0.5)],
+                                   dividends=[(1, SESSIONS[8], 0.9)]))
+
+        np.testing.assert_array_equal(store.window('close', 6, 3)[:, 0],
+                                      [2.0, 5.0, 6.0])
+        np.testing.assert_array_equal(store.window('volume', 6, 3)[:, 0],
+                                      [2000, 1000, 1000])
+        # Adjustments after the window's session do not apply
+        np.testing.assert_array_equal(store.window('close', 4, 3)[:, 0],
+                                      [2.0, 3.0, 4.0])
+        np.testing.assert_allclose(store.window('price', 9, 5, [1])[:, 0],
+                                   [104.0 * 0.9, 106.0 * 0.9, 107.0 * 0.9,
+                                    108.0, 109.0])
+        # Nothing is effective after the last session
+        window = store.window('close', 9, 3, [0, 1])
+        self.assertTrue(mapped(window))
+
+    def testWindowCache(self):
+        store = PriceStore.build(
+            os.path.join(self.root, 'adjusted'), FakeReader(), SESSIONS,
+            [0, 1, 2], Adjustments(splits=[(0, SESSIONS[5], 0.5)]))
+        cache = WindowCache(store, maxBytes=3 * 8 * 2)
+
+        window = cache.window('close', 4, 3, [0])
+        np.testing.assert_array_equal(window[:, 0], [2.0, 3.0, 4.0])
+        # Every caller gets its own copy to edit
+        window[:] = 0.0
+        again = cache.window('close', 4, 3, [0])
+        self.assertIsNot(again, window)
+        np.testing.assert_array_equal(again[:, 0], [2.0, 3.0, 4.0])
+        self.assertEqual(len(cache.entries), 1)
+        cache.window('close', 3, 3, [0])
+        self.assertEqual(cache.bytes, 48)
+        cache.window('close', 2, 3, [0])
+        self.assertEqual(len(cache.entries), 2)
+        self.assertNotIn(('close', 4, 3, (0,)), cache.entries)
+        # Views of the store cost nothing to keep and are not cached
+        cache.window('close', 9, 3, [0])
+        self.assertEqual(cache.bytes, 48)
+
+
+if __name__ == '__main__':
+    unittest.main()
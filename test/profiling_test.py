@@ -0,0 +1,64 @@
+import unittest
+import json
+import os
+from profiling import CallbackTimer, RunProfiler, packageOf
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+class ProfilingTest(unittest.TestCase):
+    """Test the backtest profiler
+    """
+
+    def testPackageOf(self):
+        site = os.path.join('usr', 'lib', 'python3', 'site-packages')
+        self.assertEqual(packageOf('<algorithm>'), 'algorithm')
+        self.assertEqual(packageOf('~'), 'builtin')
+        self.assertEqual(
+            packageOf(os.path.join(site, 'zipline', 'algorithm.py')),
+            'zipline')
+        self.assertEqual(packageOf(os.path.join(site, 'six.py')), 'six')
+        self.assertEqual(packageOf('/tmp/elsewhere.py'), 'other')
+
+    def testCallbackTimer(self):
+        timer = CallbackTimer()
+        self.assertIsNone(timer.wrap('before_trading_start', None))
+
+        handle_data = timer.wrap('handle_data', busy)
+        rebalance = timer.wrap('rebalance', busy)
+        for _ in range(3):
+            self.assertEqual(handle_data(10), busy(10))
+        rebalance(10000)
+
+        report = {r['callback']: r for r in timer.report()}
+        self.assertEqual(report['handle_data']['calls'], 3)
+        self.assertEqual(report['rebalance']['calls'], 1)
+        self.assertAlmostEqual(report['handle_data']['mean'] * 3,
+                               report['handle_data']['total'])
+        self.assertEqual(timer.report()[0]['callback'], 'rebalance')
+
+    def testReport(self):
+        profiler = RunProfiler(top=5, sort='cumtime')
+        handle_data = profiler.callbacks.wrap('handle_data', busy)
+        with profiler:
+            for _ in range(10):
+                handle_data(1000)
+
+        report = json.loads(json.dumps(profiler.report()))
+        self.assertEqual(report['type'], 'profile')
+        self.assertGreater(report['elapsed'], 0)
+        self.assertLessEqual(len(report['functions']), 5)
+        cumtimes = [f['cumtime'] for f in report['functions']]
+        self.assertEqual(cumtimes, sorted(cumtimes, reverse=True))
+        self.assertIn('busy', [f['function'] for f in report['functions']])
+        self.assertEqual(report['callbacks'][0]['calls'], 10)
+
+    def testInvalidSort(self):
+        with self.assertRaises(ValueError):
+            RunProfiler(sort='name')
+
+
+if __name__ == '__main__':
+    unittest.main()
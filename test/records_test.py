@@ -0,0 +1,118 @@
+import unittest
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from base import FrameWriter, MsgType, frameReader
+from records import (PORTFOLIO_DTYPE, RECORD_SIZE, RecordBatcher,
+                     packRecords, portfolioRecord, recordsToJSON,
+                     unpackRecords)
+
+
+class ListWriter:
+    """Stands in for a FrameWriter and remembers every frame
+    """
+    def __init__(self):
+        self.frames = []
+
+    def write(self, payload, msgType=MsgType.JSON):
+        self.frames.append((msgType, payload))
+
+
+class RecordsTest(unittest.TestCase):
+    """Test the binary portfolio record format
+    """
+
+    def testRoundTrip(self):
+        start = pd.Timestamp('2012-01-03', tz='utc')
+        records = [portfolioRecord(start + pd.Timedelta(days=i), {
+            'portfolio_value': 100000.0 + i,
+            'pnl': float(i),
+            'returns': i / 100000.0
+        }) for i in range(50)]
+
+        payload = packRecords(records)
+        self.assertEqual(len(payload), 50 * RECORD_SIZE)
+
+        decoded = unpackRecords(payload)
+        self.assertEqual(decoded.dtype, PORTFOLIO_DTYPE)
+        np.testing.assert_array_equal(decoded['pnl'], np.arange(50.0))
+        self.assertEqual(decoded['timestamp'][0], start.value)
+
+    def testJSON(self):
+        record = (pd.Timestamp('2012-01-03').value, 100.0, 1.5, 0.015)
+        msg = json.loads(recordsToJSON([record])[0])
+        self.assertEqual(msg, {
+            'timestamp': '2012-01-03T00:00:00.000000000',
+            'portfolio_value': 100.0,
+            'pnl': 1.5,
+            'return': 0.015
+        })
+
+
+class RecordBatcherTest(unittest.TestCase):
+    """Test coalescing of records into frames
+    """
+
+    def testCountLimit(self):
+        writer = ListWriter()
+        batcher = RecordBatcher(writer, maxCount=100, maxDelay=60)
+        for i in range(1050):
+            batcher.add((i, 1.0, 2.0, 3.0))
+        self.assertEqual(len(writer.frames), 10)
+        batcher.close()
+
+        self.assertEqual(len(writer.frames), 11)
+        counts = [len(unpackRecords(p)) for _, p in writer.frames]
+        self.assertEqual(counts, [100] * 10 + [50])
+
+    def testByteLimit(self):
+        writer = ListWriter()
+        batcher = RecordBatcher(writer, maxBytes=10 * RECORD_SIZE,
+                                maxDelay=60)
+        for i in range(25):
+            batcher.add((i, 1.0, 2.0, 3.0))
+        batcher.close()
+        sizes = [len(p) for _, p in writer.frames]
+        self.assertEqual(sizes, [10 * RECORD_SIZE] * 2 + [5 * RECORD_SIZE])
+
+    def testDeadline(self):
+        writer = ListWriter()
+        batcher = RecordBatcher(writer, maxCount=1000, maxDelay=0.01)
+        batcher.add((0, 1.0, 2.0, 3.0))
+        for _ in range(200):
+            if writer.frames:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(writer.frames), 1)
+        batcher.close()
+        self.assertEqual(len(writer.frames), 1)
+
+    def testExtend(self):
+        writer = ListWriter()
+        batcher = RecordBatcher(writer, maxCount=100, maxDelay=60)
+        batcher.add((0, 1.0, 2.0, 3.0))
+        records = np.zeros(250, dtype=PORTFOLIO_DTYPE)
+        batcher.extend(records)
+        batcher.close()
+        counts = [len(unpackRecords(p)) for _, p in writer.frames]
+        self.assertEqual(counts, [1, 100, 100, 50])
+
+    def testTextMode(self):
+        r, w = os.pipe()
+        batcher = RecordBatcher(FrameWriter(w), maxDelay=60, text=True)
+        for i in range(3):
+            batcher.add((i, 1.0, 2.0, 3.0))
+        batcher.close()
+        os.close(w)
+
+        frames = list(frameReader(r))
+        os.close(r)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0].msgType, MsgType.JSON)
+        self.assertEqual(len(json.loads(frames[0].payload)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
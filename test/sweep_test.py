@@ -0,0 +1,42 @@
+import unittest
+from sweep import expandGrid, parseAxis
+
+
+class SweepTest(unittest.TestCase):
+    """Test parsing of sweep grids
+    """
+
+    def testList(self):
+        self.assertEqual(parseAxis('window=20,50,100'),
+                         ('window', [20, 50, 100]))
+        self.assertEqual(parseAxis('symbol=SPY,QQQ'),
+                         ('symbol', ['SPY', 'QQQ']))
+
+    def testRange(self):
+        self.assertEqual(parseAxis('threshold=1.0:2.0:0.25'),
+                         ('threshold', [1.0, 1.25, 1.5, 1.75, 2.0]))
+        self.assertEqual(parseAxis('n=1:10:3'), ('n', [1, 4, 7, 10]))
+        self.assertEqual(parseAxis('x=0.1:0.3:0.1'), ('x', [0.1, 0.2, 0.3]))
+
+    def testUnevenRange(self):
+        # The last value never goes past stop
+        self.assertEqual(parseAxis('n=1:10:6'), ('n', [1, 7]))
+        self.assertEqual(parseAxis('n=1:10:5'), ('n', [1, 6]))
+        self.assertEqual(parseAxis('x=0.0:1.0:0.3'),
+                         ('x', [0.0, 0.3, 0.6, 0.9]))
+        self.assertEqual(parseAxis('n=3:3:2'), ('n', [3]))
+
+    def testInvalid(self):
+        for spec in ['window', '=1,2', 'n=1:5:0', 'n=5:1:1']:
+            with self.assertRaises(ValueError):
+                parseAxis(spec)
+
+    def testExpand(self):
+        combos = expandGrid(['a=1,2', 'b=x,y,z'])
+        self.assertEqual(len(combos), 6)
+        self.assertEqual(combos[0], {'a': 1, 'b': 'x'})
+        self.assertEqual(combos[-1], {'a': 2, 'b': 'z'})
+
+
+if __name__ == '__main__':
+    unittest.main()
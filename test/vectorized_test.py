@@ -0,0 +1,104 @@
+import unittest
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from vectorized import (VectorEngine, loadStrategy, simulate, summarize,
+                        toRecords)
+
+
+class VectorizedTest(unittest.TestCase):
+    """Test the numpy backtest engine
+    """
+
+    def testSimulate(self):
+        close = np.array([[10.0, 20.0],
+                          [11.0, 20.0],
+                          [11.0, 10.0],
+                          [22.0, 10.0]])
+        weights = np.array([[1.0, 0.0],
+                            [0.5, 0.5],
+                            [0.0, 1.0],
+                            [0.0, 1.0]])
+        values = simulate(close, weights, 100.0)
+        np.testing.assert_allclose(values, [100.0, 110.0, 82.5, 82.5])
+
+        costly = simulate(close, weights, 100.0, cost=0.01)
+        self.assertTrue((costly < values).all())
+
+    def testShapeMismatch(self):
+        with self.assertRaises(ValueError):
+            simulate(np.ones((3, 2)), np.ones((3, 1)), 100.0)
+
+    def testRecordsAndSummary(self):
+        sessions = pd.bdate_range('2012-01-02', periods=3, tz='UTC')
+        values = np.array([100.0, 120.0, 90.0])
+        records = toRecords(sessions, values, 100.0)
+        self.assertEqual(records['timestamp'][0], sessions[0].value)
+        np.testing.assert_allclose(records['returns'], [0.0, 0.2, -0.1])
+
+        summary = summarize(values, 100.0)
+        self.assertAlmostEqual(summary['return'], -0.1)
+        self.assertAlmostEqual(summary['max_drawdown'], -0.25)
+
+    def testExampleStrategy(self):
+        with open('static/algo/sma_crossover_numpy.py') as f:
+            code = f.read()
+        strategy = loadStrategy(code, ['fast=5', 'slow=10'])
+        self.assertEqual((strategy['fast'], strategy['slow']), (5, 10))
+
+        rng = np.random.RandomState(0)
+        close = 100 * np.cumprod(1 + rng.normal(0, 0.01, (2520, 500)),
+                                 axis=0)
+        weights = strategy['weights'](close)
+        self.assertEqual(weights.shape, close.shape)
+        np.testing.assert_allclose(weights[:9].sum(axis=1), 0.0)
+        self.assertTrue((weights.sum(axis=1) <= 1 + 1e-9).all())
+        self.assertEqual(len(simulate(close, weights, 1e5)), 2520)
+
+
+
+class FakeEngine:
+    """Closes of ten sessions for any symbols
+    """
+    def __init__(self):
+        self.timestamp = 1
+        self.loads = 0
+        self.trading_calendar = SimpleNamespace(
+            sessions_in_range=lambda start, end: pd.bdate_range(start, end))
+
+    def context(self):
+        def history(assets, end, count, *args):
+            self.loads += 1
+            return pd.DataFrame(np.ones((count, len(assets))))
+        return SimpleNamespace(
+            timestamp=self.timestamp,
+            env=SimpleNamespace(asset_finder=SimpleNamespace(
+                lookup_symbols=lambda symbols, as_of_date: symbols)),
+            data_portal=SimpleNamespace(get_history_window=history))
+
+
+class PriceCacheTest(unittest.TestCase):
+    """Test the bound on the prices a VectorEngine keeps
+    """
+
+    def testBound(self):
+        engine = FakeEngine()
+        # Room for two windows of 10 sessions x 1 asset
+        vector = VectorEngine(engine, maxBytes=160)
+        start, end = '2012-01-02', '2012-01-13'
+        for symbols in (['A'], ['B'], ['A'], ['C']):
+            vector.close(symbols, start, end)
+        self.assertEqual(engine.loads, 3)
+        self.assertEqual([k[0] for k in vector.prices], [('A',), ('C',)])
+        self.assertEqual(vector.bytes, 160)
+
+        vector.close(['A', 'B', 'C'], start, end)
+        self.assertEqual(len(vector.prices), 1)
+        engine.timestamp = 2
+        vector.close(['A'], start, end)
+        self.assertEqual(list(vector.prices), [(('A',), start, end, 2)])
+        self.assertEqual(vector.bytes, 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import pandas as pd
+from walkforward import splitWindows, stitch
+
+
+class WalkForwardTest(unittest.TestCase):
+    """Test window splitting and equity stitching
+    """
+
+    def setUp(self):
+        self.sessions = pd.bdate_range('2012-01-02', periods=100, tz='UTC')
+
+    def testWindows(self):
+        windows = splitWindows(self.sessions, train=50, test=20, warmup=10)
+        self.assertEqual(len(windows), 3)
+
+        s = self.sessions
+        self.assertEqual(windows[0]['train'], (s[0], s[49]))
+        self.assertEqual(windows[0]['test'], (s[50], s[69]))
+        self.assertEqual(windows[0]['run'], (s[40], s[69]))
+        # The last test range is cut short at the end of the study
+        self.assertEqual(windows[-1]['test'], (s[90], s[99]))
+
+        tests = [w['test'] for w in windows]
+        for (_, end), (start, _) in zip(tests, tests[1:]):
+            self.assertEqual(s.get_loc(start), s.get_loc(end) + 1)
+
+    def testTooShort(self):
+        self.assertEqual(splitWindows(self.sessions, train=100, test=5), [])
+        with self.assertRaises(ValueError):
+            splitWindows(self.sessions, train=0, test=5)
+
+    def testStitch(self):
+        segments = [(np.array([1, 2]), np.array([0.1, 0.0])),
+                    (np.array([3]), np.array([-0.5]))]
+        records = stitch(segments, 100.0)
+        self.assertEqual(list(records['timestamp']), [1, 2, 3])
+        np.testing.assert_allclose(records['portfolio_value'],
+                                   [110.0, 110.0, 55.0])
+        np.testing.assert_allclose(records['pnl'], [10.0, 10.0, -45.0])
+        np.testing.assert_allclose(records['returns'], [0.1, 0.1, -0.45])
+
+
+if __name__ == '__main__':
+    unittest.main()
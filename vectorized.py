@@ -0,0 +1,166 @@
+"""Vectorized backtests of signal-based strategies
+
+A strategy for the numpy engine is a python file defining
+
+    symbols = ['SPY', 'TLT']           # the universe
+    def weights(close):                # close: sessions x assets array
+        ...                            # return target weights, same shape
+    cost = 0.0005                      # optional, cost per unit turnover
+
+Row t of weights is the allocation held from the close of session t to
+the close of session t + 1. Positions, costs and returns are applied to
+the whole date x asset matrix at once and the result is the same record
+stream the zipline engine emits.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+from engine import getEngine
+from records import PORTFOLIO_DTYPE
+
+TRADING_DAYS = 252
+DEFAULT_PRICE_CACHE_BYTES = 256 << 20
+
+
+def simulate(close, weights, capital_base, cost=0.0):
+    """Apply target weights to prices
+
+    Args:
+        close (np.ndarray): Adjusted closes, sessions x assets
+        weights (np.ndarray): Target weights, sessions x assets
+        capital_base (float): Starting capital
+        cost (float): Cost charged per unit of turnover
+
+    Returns:
+        np.ndarray: Portfolio value at each session close
+    """
+    close = np.asarray(close, dtype='f8')
+    weights = np.nan_to_num(np.asarray(weights, dtype='f8'))
+    if close.shape != weights.shape:
+        raise ValueError('weights have shape {}, expected {}'.format(
+            weights.shape, close.shape))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        asset_returns = np.nan_to_num(close[1:] / close[:-1] - 1,
+                                      posinf=0.0, neginf=0.0)
+    turnover = np.abs(np.diff(weights, axis=0, prepend=0.0)).sum(axis=1)
+
+    returns = np.empty(len(close))
+    returns[0] = 0.0
+    returns[1:] = (weights[:-1] * asset_returns).sum(axis=1)
+    returns -= cost * turnover
+    return capital_base * np.cumprod(1 + returns)
+
+
+def toRecords(sessions, values, capital_base):
+    """Build the portfolio record stream of a vectorized run
+    """
+    records = np.zeros(len(values), dtype=PORTFOLIO_DTYPE)
+    timestamps = sessions.values.astype('datetime64[ns]')
+    records['timestamp'] = timestamps.view('i8')
+    records['portfolio_value'] = values
+    records['pnl'] = values - capital_base
+    records['returns'] = values / capital_base - 1
+    return records
+
+
+def summarize(values, capital_base):
+    """Summary statistics of one run, like the sweep reports for zipline
+    """
+    daily = np.diff(values, prepend=capital_base) / \
+        np.concatenate([[capital_base], values[:-1]])
+    std = daily.std()
+    peak = np.maximum.accumulate(values)
+    return {
+        'portfolio_value': float(values[-1]),
+        'return': float(values[-1] / capital_base - 1),
+        'sharpe': float(daily.mean() / std * np.sqrt(TRADING_DAYS))
+        if std > 0 else 0.0,
+        'max_drawdown': float((values / peak - 1).min()),
+    }
+
+
+def loadStrategy(code, defines=()):
+    """Execute a strategy file, then apply name=value overrides
+
+    Overrides are applied after the script runs, so they replace the
+    module-level defaults a strategy declares.
+    """
+    namespace = {}
+    exec(compile(code, '<algorithm>', 'exec'), namespace)
+    for assign in defines:
+        name, value = assign.split('=', 1)
+        namespace[name.strip()] = eval(value, namespace)
+    for name in ('symbols', 'weights'):
+        if name not in namespace:
+            raise ValueError('strategy does not define {!r}'.format(name))
+    return namespace
+
+
+class VectorEngine:
+    """The "numpy" backtest engine
+
+    Prices come adjusted from the warm zipline environment and are kept
+    per (symbols, start, end, bundle ingestion), so screening many
+    variants of a strategy loads them once. Least recently used prices
+    are dropped once they take more than maxBytes, as are those of
+    older ingestions.
+
+    Args:
+        engine (engine.ZiplineEngine): Source of the bundle data
+        maxBytes (int): Size bound of the kept prices
+    """
+    def __init__(self, engine=None, maxBytes=DEFAULT_PRICE_CACHE_BYTES):
+        self.engine = engine or getEngine('quandl')
+        self.maxBytes = maxBytes
+        self.prices = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def close(self, symbols, start, end):
+        """Adjusted closes for symbols over [start, end]
+
+        Returns:
+            tuple: (sessions, sessions x assets array)
+        """
+        ctx = self.engine.context()
+        key = (tuple(symbols), start, end, ctx.timestamp)
+        with self.lock:
+            if key in self.prices:
+                self.prices.move_to_end(key)
+                return self.prices[key]
+            sessions = self.engine.trading_calendar.sessions_in_range(
+                start, end)
+            assets = ctx.env.asset_finder.lookup_symbols(
+                symbols, as_of_date=end)
+            frame = ctx.data_portal.get_history_window(
+                assets, sessions[-1], len(sessions), '1d', 'close', 'daily')
+            for old in [k for k in self.prices if k[3] != ctx.timestamp]:
+                self.bytes -= self.prices.pop(old)[1].nbytes
+            self.prices[key] = (sessions, frame.values)
+            self.bytes += frame.values.nbytes
+            # The newest entry is kept even if larger than the bound
+            while self.bytes > self.maxBytes and len(self.prices) > 1:
+                _, (_, evicted) = self.prices.popitem(last=False)
+                self.bytes -= evicted.nbytes
+            return self.prices[key]
+
+    def run(self, code, start, end, capital_base=100000, defines=(),
+            timer=None):
+        """Backtest a strategy file
+
+        Args:
+            timer (profiling.CallbackTimer): Times the weights function,
+                                             or None
+
+        Returns:
+            tuple: (PORTFOLIO_DTYPE records, portfolio values)
+        """
+        strategy = loadStrategy(code, defines)
+        weights = strategy['weights']
+        if timer is not None:
+            weights = timer.wrap('weights', weights)
+        sessions, close = self.close(strategy['symbols'], start, end)
+        values = simulate(close, weights(close), capital_base,
+                          strategy.get('cost', 0.0))
+        return toRecords(sessions, values, capital_base), values
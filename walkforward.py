@@ -0,0 +1,135 @@
+"""Walk-forward backtests over parallel date-range segments
+"""
+import numpy as np
+from engine import getEngine
+from jobs import DONE, JobScheduler
+from records import PORTFOLIO_DTYPE
+
+
+def splitWindows(sessions, train, test, warmup=0):
+    """Split sessions into rolling in-sample/out-of-sample windows
+
+    Each window trains on `train` sessions and is evaluated on the `test`
+    sessions right after them; the next window starts `test` sessions
+    later, so the out-of-sample ranges tile the period without overlap.
+    A segment is simulated from `warmup` sessions before its test range
+    so that indicators are primed when the out-of-sample period starts.
+
+    Args:
+        sessions (pd.DatetimeIndex): Every session of the study
+        train (int): In-sample sessions per window
+        test (int): Out-of-sample sessions per window
+        warmup (int): Sessions simulated before the test range
+
+    Returns:
+        list: One dict per window with train, test and run (start, end)
+              session pairs
+    """
+    if train < 1 or test < 1 or warmup < 0:
+        raise ValueError('train and test must be positive, warmup >= 0')
+
+    windows = []
+    for i in range(train, len(sessions), test):
+        j = min(i + test, len(sessions)) - 1
+        windows.append({
+            'train': (sessions[i - train], sessions[i - 1]),
+            'test': (sessions[i], sessions[j]),
+            'run': (sessions[max(i - warmup, 0)], sessions[j]),
+        })
+    return windows
+
+
+def runSegment(code, window, capital_base, bundle='quandl'):
+    """Simulate one window; executed in a worker process
+
+    The window bounds are injected into the algorithm namespace as
+    train_start, train_end, test_start and test_end date strings so the
+    algorithm can fit itself on the in-sample range.
+
+    Returns:
+        tuple: (test sessions as int64 ns, daily returns over them)
+    """
+    defines = ['{}_{}={!r}'.format(part, edge, str(ts.date()))
+               for part in ('train', 'test')
+               for edge, ts in zip(('start', 'end'), window[part])]
+    start, end = window['run']
+    perf = getEngine(bundle).run(code, start=start, end=end,
+                                 capital_base=capital_base, defines=defines)
+
+    index = perf.index.normalize()
+    test = (index >= window['test'][0]) & (index <= window['test'][1])
+    return (index[test].values.astype('datetime64[ns]').view('i8'),
+            perf['returns'].values[test].astype('f8'))
+
+
+def stitch(segments, capital_base):
+    """Chain out-of-sample daily returns into one equity curve
+
+    Args:
+        segments (list): (sessions, returns) pairs, in time order
+        capital_base (float): Starting capital of the curve
+
+    Returns:
+        np.ndarray: PORTFOLIO_DTYPE records, one per out-of-sample session
+    """
+    timestamps = np.concatenate([t for t, _ in segments])
+    returns = np.concatenate([r for _, r in segments])
+    records = np.zeros(len(returns), dtype=PORTFOLIO_DTYPE)
+    records['timestamp'] = timestamps
+    records['portfolio_value'] = capital_base * np.cumprod(1 + returns)
+    records['pnl'] = records['portfolio_value'] - capital_base
+    records['returns'] = records['portfolio_value'] / capital_base - 1
+    return records
+
+
+def walkforward(code, start, end, train, test, warmup=0,
+                capital_base=100000, scheduler=None, priority=0,
+                bundle='quandl'):
+    """Run every walk-forward segment in parallel and stitch the result
+
+    Args:
+        code (str): The algorithm source
+        start (pd.Timestamp): First session of the study
+        end (pd.Timestamp): Last session of the study
+        train (int): In-sample sessions per window
+        test (int): Out-of-sample sessions per window
+        warmup (int): Sessions simulated before each test range
+        capital_base (float): Starting capital
+        scheduler (JobScheduler): Where the segments run, by default a
+                                  scheduler of their own
+        priority (int): Priority of the segments
+        bundle (str): The zipline bundle to run on
+
+    Returns:
+        np.ndarray: The stitched out-of-sample PORTFOLIO_DTYPE records
+
+    Raises:
+        RuntimeError: A segment failed
+    """
+    sessions = getEngine(bundle).trading_calendar.sessions_in_range(start, end)
+    windows = splitWindows(sessions, train, test, warmup)
+    if not windows:
+        raise ValueError('{} sessions are not enough for one window'
+                         .format(len(sessions)))
+
+    own = scheduler is None
+    if own:
+        scheduler = JobScheduler()
+    jobs = []
+    try:
+        jobs = [scheduler.submit(runSegment,
+                                 (code, window, capital_base, bundle),
+                                 priority=priority,
+                                 name='walkforward {}'.format(
+                                     window['test'][0].date()))
+                for window in windows]
+        for job in scheduler.completed(jobs):
+            if job.state != DONE:
+                raise RuntimeError('segment from {} {}: {}'.format(
+                    job.args[1]['test'][0].date(), job.state, job.error))
+        return stitch([job.result for job in jobs], capital_base)
+    finally:
+        for job in jobs:
+            scheduler.cancel(job.id)
+        if own:
+            scheduler.close()